@@ -0,0 +1,751 @@
+# HTTP benchmark: every route registered in twig_server/app.py, through the
+# Flask test client, against synthetic projects of a few sizes.
+#
+#   python -m benchmarks.http_benchmark --sizes 10 1000 --output bench.json
+#   python -m benchmarks.http_benchmark --baseline bench.json
+#
+# Without NEO4J_SERVER_URL the in-memory graph is used, so statement counts
+# are exact but latencies only cover the python side. Exits with 1 when a
+# route needs more statements or is slower than in the baseline.
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+os.environ.setdefault("NEO4J_SERVER_URL", "memory://")
+os.environ.setdefault("NEO4J_USERNAME", "neo4j")
+os.environ.setdefault("NEO4J_PASSWORD", "unused")
+
+from twig_server.app import create_app  # noqa: E402
+from twig_server.database.connection import Neo4jConnection  # noqa: E402
+from twig_server.jobs import Job  # noqa: E402
+
+BENCHMARK_USER = "benchmark-user"
+DEFAULT_SIZES = [10, 1000]
+POSITIONS_PER_UPDATE = 50
+RESOURCES_PER_IMPORT = 50
+
+
+class Fixture:
+    def __init__(
+        self, conn: Neo4jConnection, size: int, seed: int, jobs: Any = None
+    ) -> None:
+        """Synthetic project with `size` resources, one tag per ten
+        resources and roughly 1.5 prereq edges per resource
+        :param jobs:
+            the app's job runner
+        """
+        self.conn = conn
+        self.jobs = jobs
+        self.size = size
+        self.random = random.Random(seed)
+        self.counter = 0
+        self.user_id: int = -1
+        self.project_id: int = -1
+        self.resource_ids: List[int] = []
+        self.tag_ids: List[int] = []
+        self.prereq_ids: List[int] = []
+
+    def run(self, query: str, **parameters: Any) -> List[Any]:
+        # straight on the driver, setup statements are not counted
+        assert self.conn.conn is not None
+        with self.conn.conn.session() as session:
+            return [
+                record.values() for record in session.run(query, parameters)
+            ]
+
+    def unique(self, prefix: str) -> str:
+        self.counter += 1
+        return f"{prefix}-{self.size}-{self.counter}"
+
+    def seed(self) -> None:
+        self.user_id = self.run(
+            "MERGE (u:User {kratos_user_id: $kratos_user_id}) "
+            "ON CREATE SET u.username = $kratos_user_id RETURN id(u)",
+            kratos_user_id=BENCHMARK_USER,
+        )[0][0]
+        self.project_id = self.new_project(f"benchmark {self.size}")
+        self.tag_ids = [
+            row[0]
+            for row in self.run(
+                "MATCH (p:Project) WHERE id(p)=$project_id "
+                "UNWIND $tags AS tag "
+                "CREATE (p)-[:Project_Tag]->(t:Tag {name: tag, color: 'pink', "
+                "priority: 0, description: 'benchmark tag'}) RETURN id(t)",
+                project_id=self.project_id,
+                tags=[f"tag {i}" for i in range(max(1, self.size // 10))],
+            )
+        ]
+        self.resource_ids = [
+            row[0]
+            for row in self.run(
+                "MATCH (p:Project) WHERE id(p)=$project_id "
+                "UNWIND $resources AS resource "
+                "CREATE (p)-[:Has_Resource]->(r:Resource {name: resource.name, "
+                "description: 'benchmark resource', pos_x: resource.x, "
+                "pos_y: resource.y}) RETURN id(r)",
+                project_id=self.project_id,
+                resources=[
+                    {"name": f"resource {i}", "x": i % 100, "y": i // 100}
+                    for i in range(self.size)
+                ],
+            )
+        ]
+        self.run(
+            "UNWIND $pairs AS pair "
+            "MATCH (r:Resource) WHERE id(r)=pair[0] "
+            "MATCH (t:Tag) WHERE id(t)=pair[1] "
+            "CREATE (r)-[:Resource_Tag]->(t)",
+            pairs=[
+                [uid, self.random.choice(self.tag_ids)]
+                for uid in self.resource_ids
+            ],
+        )
+        # edges only point forwards, so the prereq graph stays acyclic
+        edges = []
+        for i in range(1, len(self.resource_ids)):
+            edges.append([self.resource_ids[i - 1], self.resource_ids[i]])
+            if i > 1 and self.random.random() < 0.5:
+                j = self.random.randrange(i - 1)
+                edges.append([self.resource_ids[j], self.resource_ids[i]])
+        self.prereq_ids = [
+            row[0]
+            for row in self.run(
+                "UNWIND $edges AS edge "
+                "MATCH (a:Resource) WHERE id(a)=edge[0] "
+                "MATCH (b:Resource) WHERE id(b)=edge[1] "
+                "CREATE (a)-[e:prereq]->(b) RETURN id(e)",
+                edges=edges,
+            )
+        ]
+
+    def cleanup(self) -> None:
+        """Removes every benchmark user with their projects"""
+        self.run(
+            "MATCH (u:User) WHERE u.kratos_user_id STARTS WITH $prefix "
+            "OPTIONAL MATCH (u)-[:Project_Owner]->(p:Project) "
+            "OPTIONAL MATCH (p)-[:Has_Resource|Project_Tag|Project_Change]->(x) "
+            "DETACH DELETE x, p, u",
+            prefix="benchmark-",
+        )
+
+    def new_project(self, name: str) -> int:
+        return self.run(
+            "MATCH (u:User) WHERE id(u)=$user_id "
+            "CREATE (u)-[:Project_Owner]->(p:Project {name: $name, "
+            "description: 'benchmark project', version: 0}) RETURN id(p)",
+            user_id=self.user_id,
+            name=name,
+        )[0][0]
+
+    def new_resource(self) -> int:
+        return self.run(
+            "MATCH (p:Project) WHERE id(p)=$project_id "
+            "CREATE (p)-[:Has_Resource]->(r:Resource {name: 'scratch'}) "
+            "RETURN id(r)",
+            project_id=self.project_id,
+        )[0][0]
+
+    def new_tag(self) -> int:
+        return self.run(
+            "MATCH (p:Project) WHERE id(p)=$project_id "
+            "CREATE (p)-[:Project_Tag]->(t:Tag {name: 'scratch', "
+            "color: 'pink', priority: 0}) RETURN id(t)",
+            project_id=self.project_id,
+        )[0][0]
+
+    def new_prereq(self) -> int:
+        a = self.new_resource()
+        b = self.new_resource()
+        return self.run(
+            "MATCH (a:Resource) WHERE id(a)=$a MATCH (b:Resource) WHERE id(b)=$b "
+            "CREATE (a)-[e:prereq]->(b) RETURN id(e)",
+            a=a,
+            b=b,
+        )[0][0]
+
+    def tagged_resource(self) -> Tuple[int, int]:
+        resource_id = self.new_resource()
+        tag_id = self.tag_ids[0]
+        self.run(
+            "MATCH (r:Resource) WHERE id(r)=$r MATCH (t:Tag) WHERE id(t)=$t "
+            "CREATE (r)-[:Resource_Tag]->(t)",
+            r=resource_id,
+            t=tag_id,
+        )
+        return resource_id, tag_id
+
+    def since(self) -> int:
+        """Version ten changes back, or as far back as the log goes"""
+        version, oldest = self.run(
+            "MATCH (p:Project) WHERE id(p)=$project_id "
+            "RETURN p.version, coalesce(p.changes_since, p.version)",
+            project_id=self.project_id,
+        )[0]
+        return max(version - 10, oldest)
+
+    def resource(self) -> int:
+        return self.random.choice(self.resource_ids)
+
+    def finished_job(self) -> str:
+        job = self.jobs.submit(
+            Job("benchmark", BENCHMARK_USER, lambda job: None)
+        )
+        self.jobs.wait(job.id)
+        return job.id
+
+    def running_job(self) -> str:
+        """A job that runs until it is cancelled"""
+
+        def run(job: Job) -> None:
+            while not job.cancel_requested:
+                time.sleep(0.001)
+            job.report()
+
+        job = self.jobs.submit(Job("benchmark", BENCHMARK_USER, run))
+        return job.id
+
+    def positions(self) -> Dict[str, Dict[str, int]]:
+        count = min(POSITIONS_PER_UPDATE, len(self.resource_ids))
+        return {
+            str(uid): {
+                "x": self.random.randrange(1000),
+                "y": self.random.randrange(1000),
+            }
+            for uid in self.random.sample(self.resource_ids, count)
+        }
+
+
+# a request: (method, path, test client keyword arguments)
+Request = Tuple[str, str, Dict[str, Any]]
+
+HEADERS = {"X-User": BENCHMARK_USER}
+# INTERNAL_ROUTES_TOKEN, unless the app already has one
+INTERNAL_TOKEN = "benchmark"
+
+
+def scenarios(
+    internal_token: str,
+) -> Dict[Tuple[str, str], Callable[[Fixture], Request]]:
+    """Request builder per (rule, method), every rule needs at least one.
+    Builders run untimed and create whatever a destructive route is about
+    to remove.
+    :param internal_token:
+        INTERNAL_ROUTES_TOKEN of the app, for /metrics and /internal/*
+    """
+    h = {"headers": HEADERS}
+    i = {"headers": {"Authorization": f"Bearer {internal_token}"}}
+
+    def project(f: Fixture) -> str:
+        return f"/project/{f.project_id}"
+
+    def new_user(f: Fixture) -> Request:
+        kratos_user_id = f.unique("benchmark-new-user")
+        return (
+            "PUT",
+            f"/user/{kratos_user_id}",
+            {"headers": {"X-User": kratos_user_id}},
+        )
+
+    def add_tag(f: Fixture) -> Request:
+        return (
+            "POST",
+            f"{project(f)}/resource/{f.resource()}/add_tag"
+            f"?tag_uid={f.new_tag()}",
+            h,
+        )
+
+    def import_project(f: Fixture) -> Request:
+        # a chain of resources into a scratch project, so imports do not
+        # grow the project the other routes work on
+        lines = [
+            {"type": "resource", "uid": i, "properties": {"name": f"r{i}"}}
+            for i in range(RESOURCES_PER_IMPORT)
+        ] + [
+            {
+                "type": "prereq",
+                "uid": RESOURCES_PER_IMPORT + i,
+                "a": i,
+                "b": i + 1,
+                "properties": {},
+            }
+            for i in range(RESOURCES_PER_IMPORT - 1)
+        ]
+        return (
+            "POST",
+            f"/project/{f.new_project('import')}/import",
+            {"data": "\n".join(json.dumps(line) for line in lines), **h},
+        )
+
+    def batch(f: Fixture) -> Request:
+        # a typical editing burst: five resources chained and tagged
+        operations: List[Dict[str, Any]] = []
+        for i in range(5):
+            operations.append({"op": "create_node", "ref": f"r{i}"})
+        for i in range(4):
+            operations.append(
+                {"op": "create_relationship", "a": f"r{i}", "b": f"r{i + 1}"}
+            )
+        for i in range(5):
+            operations.append(
+                {"op": "add_tag", "resource": f"r{i}", "tag": f.tag_ids[0]}
+            )
+        operations.append(
+            {
+                "op": "update_tag",
+                "tag": f.tag_ids[0],
+                "properties": {"color": f.unique("color")},
+            }
+        )
+        for i in range(5):
+            operations.append(
+                {
+                    "op": "edit_resource",
+                    "resource": f"r{i}",
+                    "properties": {"name": f"batch {i}"},
+                }
+            )
+        return (
+            "POST",
+            f"{project(f)}/batch",
+            {"json": {"operations": operations}, **h},
+        )
+
+    def dissociate_tag(f: Fixture) -> Request:
+        resource_id, tag_id = f.tagged_resource()
+        return (
+            "DELETE",
+            f"{project(f)}/resource/{resource_id}"
+            f"/dissociate_tag?tag_uid={tag_id}",
+            h,
+        )
+
+    return {
+        ("/", "GET"): lambda f: ("GET", "/", {}),
+        ("/project/new", "PUT"): lambda f: ("PUT", "/project/new", h),
+        ("/project/<project_id>", "GET"): lambda f: ("GET", project(f), h),
+        ("/project/<project_id>/edit", "POST"): lambda f: (
+            "POST",
+            f"{project(f)}/edit?description={f.unique('edit')}",
+            h,
+        ),
+        ("/project/<project_id>/delete", "POST"): lambda f: (
+            "POST",
+            f"/project/{f.new_project('scratch')}/delete",
+            h,
+        ),
+        ("/project/<project_id>/changes", "GET"): lambda f: (
+            "GET",
+            f"{project(f)}/changes?since={f.since()}",
+            h,
+        ),
+        # buffered, the export only runs its statements while streamed
+        ("/project/<project_id>/export", "GET"): lambda f: (
+            "GET",
+            f"{project(f)}/export",
+            {"buffered": True, **h},
+        ),
+        ("/project/<project_id>/prereqs/order", "GET"): lambda f: (
+            "GET",
+            f"{project(f)}/prereqs/order",
+            h,
+        ),
+        ("/project/<project_id>/prereqs/longest_chain", "GET"): lambda f: (
+            "GET",
+            f"{project(f)}/prereqs/longest_chain",
+            h,
+        ),
+        (
+            "/project/<project_id>/resource/<resource_id>/prereqs",
+            "GET",
+        ): lambda f: (
+            "GET",
+            f"{project(f)}/resource/{f.resource()}/prereqs",
+            h,
+        ),
+        (
+            "/project/<project_id>/resource/<resource_id>/unlocks",
+            "GET",
+        ): lambda f: (
+            "GET",
+            f"{project(f)}/resource/{f.resource()}/unlocks",
+            h,
+        ),
+        ("/project/<project_id>/import", "POST"): import_project,
+        ("/project/<project_id>/batch", "POST"): batch,
+        ("/project/<project_id>/positions/update", "POST"): lambda f: (
+            "POST",
+            f"{project(f)}/positions/update",
+            {"json": f.positions(), **h},
+        ),
+        ("/project/<project_id>/new", "PUT"): lambda f: (
+            "PUT",
+            f"{project(f)}/new?item=node",
+            h,
+        ),
+        (
+            "/project/<project_id>/resource/<resource_id>/add_tag",
+            "POST",
+        ): add_tag,
+        (
+            "/project/<project_id>/resource/<resource_id>/list_tags",
+            "GET",
+        ): lambda f: (
+            "GET",
+            f"{project(f)}/resource/{f.resource()}" "/list_tags",
+            h,
+        ),
+        (
+            "/project/<project_id>/resource/<resource_id>/dissociate_tag",
+            "DELETE",
+        ): dissociate_tag,
+        ("/project/<project_id>/create_tag", "PUT"): lambda f: (
+            "PUT",
+            f"{project(f)}/create_tag?name={f.unique('tag')}",
+            h,
+        ),
+        (
+            "/project/<project_id>/tag/<tag_id>/update_color",
+            "POST",
+        ): lambda f: (
+            "POST",
+            f"{project(f)}/tag/{f.tag_ids[0]}"
+            f"/update_color?color={f.unique('color')}",
+            h,
+        ),
+        (
+            "/project/<project_id>/tag/<tag_id>/list_resources",
+            "GET",
+        ): lambda f: (
+            "GET",
+            f"{project(f)}/tag/{f.tag_ids[0]}" "/list_resources",
+            h,
+        ),
+        ("/project/<project_id>/tag/<tag_id>/update_name", "POST"): lambda f: (
+            "POST",
+            f"{project(f)}/tag/{f.tag_ids[0]}"
+            f"/update_name?name={f.unique('name')}",
+            h,
+        ),
+        (
+            "/project/<project_id>/tag/<tag_id>/update_priority",
+            "POST",
+        ): lambda f: (
+            "POST",
+            f"{project(f)}/tag/{f.tag_ids[0]}" "/update_priority?priority=1",
+            h,
+        ),
+        ("/project/<project_id>/list_all_tags", "GET"): lambda f: (
+            "GET",
+            f"{project(f)}/list_all_tags",
+            h,
+        ),
+        ("/project/<project_id>/delete_tag", "DELETE"): lambda f: (
+            "DELETE",
+            f"{project(f)}/delete_tag?uid={f.new_tag()}",
+            h,
+        ),
+        (
+            "/project/<project_id>/resource/<resource_id>/edit",
+            "POST",
+        ): lambda f: (
+            "POST",
+            f"{project(f)}/resource/{f.resource()}"
+            f"/edit?name={f.unique('name')}",
+            h,
+        ),
+        (
+            "/project/<project_id>/resource/<resource_id>/delete",
+            "DELETE",
+        ): lambda f: (
+            "DELETE",
+            f"{project(f)}/resource/{f.new_resource()}" "/delete",
+            h,
+        ),
+        (
+            "/project/<project_id>/relationship/<relationship_id>/edit",
+            "POST",
+        ): lambda f: (
+            "POST",
+            f"{project(f)}/relationship/{f.prereq_ids[0]}/edit",
+            h,
+        ),
+        (
+            "/project/<project_id>/relationship/<relationship_id>/delete",
+            "DELETE",
+        ): lambda f: (
+            "DELETE",
+            f"{project(f)}/relationship/{f.new_prereq()}/delete",
+            h,
+        ),
+        ("/user/<kratos_username_or_user_id>", "GET"): lambda f: (
+            "GET",
+            f"/user/{BENCHMARK_USER}",
+            h,
+        ),
+        ("/user/<kratos_user_id>", "PUT"): new_user,
+        ("/explore", "GET"): lambda f: ("GET", "/explore", {}),
+        ("/user/update/<kratos_user_id>", "POST"): lambda f: (
+            "POST",
+            f"/user/update/{BENCHMARK_USER}"
+            f"?username={f.unique('username')}",
+            h,
+        ),
+        ("/internal/pool", "GET"): lambda f: ("GET", "/internal/pool", i),
+        ("/metrics", "GET"): lambda f: ("GET", "/metrics", i),
+        ("/internal/slow_queries", "GET"): lambda f: (
+            "GET",
+            "/internal/slow_queries",
+            i,
+        ),
+        ("/jobs/<job_id>", "GET"): lambda f: (
+            "GET",
+            f"/jobs/{f.finished_job()}",
+            h,
+        ),
+        ("/jobs", "GET"): lambda f: ("GET", "/jobs", h),
+        ("/jobs/<job_id>/cancel", "POST"): lambda f: (
+            "POST",
+            f"/jobs/{f.running_job()}/cancel",
+            h,
+        ),
+    }
+
+
+def registered_rules(app: Any) -> List[str]:
+    return [
+        rule.rule
+        for rule in app.url_map.iter_rules()
+        if rule.endpoint != "static"
+    ]
+
+
+def percentile(values: List[float], p: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class StatementCounter:
+    def __init__(self) -> None:
+        self.statements = 0
+        # background jobs started by a request run their own statements
+        self.thread = threading.get_ident()
+
+    def __call__(self, query, parameters, seconds, result, error) -> None:
+        if threading.get_ident() == self.thread:
+            self.statements += 1
+
+
+def measure(
+    client: Any,
+    counter: StatementCounter,
+    fixture: Fixture,
+    build: Callable[[Fixture], Request],
+    requests: int,
+    warmup: int,
+) -> Dict[str, Any]:
+    latencies: List[float] = []
+    statements: List[int] = []
+    statuses: Dict[str, int] = {}
+    for i in range(warmup + requests):
+        method, path, kwargs = build(fixture)
+        before = counter.statements
+        start = time.perf_counter()
+        response = client.open(path, method=method, **kwargs)
+        elapsed = time.perf_counter() - start
+        client.application.config["jobs"].wait_idle()
+        if i < warmup:
+            continue
+        latencies.append(elapsed)
+        statements.append(counter.statements - before)
+        status = str(response.status_code)
+        statuses[status] = statuses.get(status, 0) + 1
+    # one more request under tracemalloc, which would skew the timings
+    method, path, kwargs = build(fixture)
+    tracemalloc.start()
+    client.open(path, method=method, **kwargs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    client.application.config["jobs"].wait_idle()
+    return {
+        "requests": requests,
+        "statuses": statuses,
+        "p50_ms": 1000 * percentile(latencies, 50),
+        "p95_ms": 1000 * percentile(latencies, 95),
+        "p99_ms": 1000 * percentile(latencies, 99),
+        "throughput_rps": len(latencies) / sum(latencies),
+        "peak_memory_kib": peak / 1024,
+        "statements_median": statistics.median(statements),
+        "statements_max": max(statements),
+    }
+
+
+def run(
+    sizes: List[int], requests: int, warmup: int, seed: int
+) -> Dict[str, Any]:
+    app = create_app({"TESTING": True})
+    if not app.config.get("INTERNAL_ROUTES_TOKEN"):
+        app.config["INTERNAL_ROUTES_TOKEN"] = INTERNAL_TOKEN
+    conn: Neo4jConnection = app.config["driver"]
+    counter = StatementCounter()
+    conn.add_query_listener(counter)
+    builders = scenarios(app.config["INTERNAL_ROUTES_TOKEN"])
+    covered = {rule for rule, _ in builders}
+    missing = [r for r in registered_rules(app) if r not in covered]
+    if missing:
+        raise SystemExit(f"routes without a benchmark scenario: {missing}")
+    client = app.test_client()
+    results: Dict[str, Any] = {}
+    for size in sizes:
+        fixture = Fixture(conn, size, seed, app.config["jobs"])
+        start = time.perf_counter()
+        fixture.seed()
+        seeded = time.perf_counter() - start
+        print(f"size {size}: seeded in {seeded:.1f}s", file=sys.stderr)
+        routes: Dict[str, Any] = {}
+        try:
+            for (rule, method), build in builders.items():
+                routes[f"{method} {rule}"] = measure(
+                    client, counter, fixture, build, requests, warmup
+                )
+        finally:
+            fixture.cleanup()
+        results[str(size)] = routes
+    return {
+        "meta": {
+            "backend": conn.url.split("://")[0],
+            "python": platform.python_version(),
+            "requests": requests,
+            "warmup": warmup,
+            "seed": seed,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+
+
+def regressions(
+    current: Dict[str, Any],
+    baseline: Dict[str, Any],
+    latency_ratio: float,
+    latency_slack_ms: float,
+    extra_statements: int,
+) -> List[str]:
+    """Routes whose statement count or p95 latency regressed. Latency only
+    counts when it is both `latency_ratio` times and `latency_slack_ms`
+    above the baseline, so sub-millisecond noise does not fail a run.
+    """
+    ret = []
+    for size, routes in current["results"].items():
+        for route, result in routes.items():
+            before = baseline.get("results", {}).get(size, {}).get(route)
+            if before is None:
+                continue
+            if (
+                result["statements_max"]
+                > before["statements_max"] + extra_statements
+            ):
+                ret.append(
+                    f"{size} {route}: {result['statements_max']} statements, "
+                    f"baseline {before['statements_max']}"
+                )
+            if (
+                result["p95_ms"] > before["p95_ms"] * latency_ratio
+                and result["p95_ms"] - before["p95_ms"] > latency_slack_ms
+            ):
+                ret.append(
+                    f"{size} {route}: p95 {result['p95_ms']:.2f}ms, "
+                    f"baseline {before['p95_ms']:.2f}ms"
+                )
+    return ret
+
+
+def print_table(report: Dict[str, Any]) -> None:
+    for size, routes in report["results"].items():
+        print(f"\n{size} resources")
+        print(
+            f"{'route':<72} {'stmts':>5} {'p50ms':>8} {'p95ms':>8} "
+            f"{'p99ms':>8} {'rps':>8} {'KiB':>8}"
+        )
+        for route, r in routes.items():
+            print(
+                f"{route:<72} {r['statements_max']:>5} {r['p50_ms']:>8.2f} "
+                f"{r['p95_ms']:>8.2f} {r['p99_ms']:>8.2f} "
+                f"{r['throughput_rps']:>8.0f} {r['peak_memory_kib']:>8.0f}"
+            )
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Benchmark every HTTP route against synthetic projects"
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=DEFAULT_SIZES,
+        help="resources per synthetic project, e.g. 10 1000 50000",
+    )
+    parser.add_argument(
+        "--requests",
+        type=int,
+        default=50,
+        help="timed requests per route and size",
+    )
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument(
+        "--latency-ratio",
+        type=float,
+        default=1.5,
+        help="allowed p95 slowdown against the baseline",
+    )
+    parser.add_argument(
+        "--latency-slack-ms",
+        type=float,
+        default=1.0,
+        help="p95 slowdowns below this are ignored",
+    )
+    parser.add_argument(
+        "--extra-statements",
+        type=int,
+        default=0,
+        help="allowed extra statements per request",
+    )
+    args = parser.parse_args(argv)
+
+    report = run(args.sizes, args.requests, args.warmup, args.seed)
+    print_table(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        failed = regressions(
+            report,
+            baseline,
+            args.latency_ratio,
+            args.latency_slack_ms,
+            args.extra_statements,
+        )
+        if failed:
+            print("\nregressions:", *failed, sep="\n  ", file=sys.stderr)
+            return 1
+        print("\nno regressions against", args.baseline)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,10 +1,19 @@
+from contextlib import contextmanager
+import os
+
 import pytest
 from dotenv import load_dotenv
-from twig_server.app import create_app
-from flask import current_app
-import os
 
-from twig_server.database.User import User
+# .env first, then the in-memory graph when no server is configured
+load_dotenv()
+os.environ.setdefault("NEO4J_SERVER_URL", "memory://")
+os.environ.setdefault("NEO4J_USERNAME", "neo4j")
+os.environ.setdefault("NEO4J_PASSWORD", "unused")
+
+from twig_server.app import create_app  # noqa: E402
+from flask import current_app  # noqa: E402
+
+from twig_server.database.User import User  # noqa: E402
 
 if (
     os.getenv("_PYTEST_RAISE", "0") != "0"
@@ -26,7 +35,7 @@ def load_env():
 
 @pytest.fixture(scope="session")
 def app():
-    app = create_app({"TESTING": True})
+    app = create_app({"TESTING": True, "INTERNAL_ROUTES_TOKEN": "test-token"})
     return app
 
 
@@ -49,3 +58,43 @@ def create_user_username(connection):
     assert db_obj == jh.db_obj
     yield jh
     jh.delete()
+
+
+KRATOS_USER_ID = "test-user"
+HEADERS = {"X-User": KRATOS_USER_ID}
+INTERNAL_HEADERS = {"Authorization": "Bearer test-token"}
+
+
+@pytest.fixture()
+def project(app):
+    """an empty project of KRATOS_USER_ID, deleted after the test"""
+    client = app.test_client()
+    client.put(f"/user/{KRATOS_USER_ID}", headers=HEADERS)
+    project = client.put("/project/new", headers=HEADERS).get_json()["project"]
+    yield project
+    client.delete(f"/project/{project['uid']}/delete", headers=HEADERS)
+
+
+@pytest.fixture()
+def record_statements(app, connection):
+    """`with record_statements() as statements:` collects the queries run
+    inside the block. Jobs of earlier tests (e.g. project deletes) finish
+    first so their queries are not counted, and the listener is removed
+    even if the block fails.
+    """
+
+    @contextmanager
+    def record():
+        app.config["jobs"].wait_idle()
+        statements = []
+
+        def listener(query, *_):
+            statements.append(query)
+
+        connection.add_query_listener(listener)
+        try:
+            yield statements
+        finally:
+            connection.remove_query_listener(listener)
+
+    return record
@@ -0,0 +1,35 @@
+from benchmarks.http_benchmark import regressions, run
+
+
+def test_benchmark_covers_every_route(app):
+    report = run(sizes=[10], requests=2, warmup=0, seed=0)
+    routes = report["results"]["10"]
+    rules = {
+        rule.rule
+        for rule in app.url_map.iter_rules()
+        if rule.endpoint != "static"
+    }
+    assert rules == {route.split(" ", 1)[1] for route in routes}
+    for result in routes.values():
+        assert "500" not in result["statuses"]
+
+
+def test_benchmark_regressions():
+    def report(statements, p95_ms):
+        return {
+            "results": {
+                "10": {
+                    "GET /explore": {
+                        "statements_max": statements,
+                        "p95_ms": p95_ms,
+                    }
+                }
+            }
+        }
+
+    baseline = report(1, 10.0)
+    assert regressions(report(1, 12.0), baseline, 1.5, 1.0, 0) == []
+    assert len(regressions(report(2, 10.0), baseline, 1.5, 1.0, 0)) == 1
+    assert len(regressions(report(1, 20.0), baseline, 1.5, 1.0, 0)) == 1
+    # below the slack, a large ratio alone is noise
+    assert regressions(report(1, 0.3), report(1, 0.1), 1.5, 1.0, 0) == []
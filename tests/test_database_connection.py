@@ -1,6 +1,13 @@
 import pytest
 from flask import current_app
 import os
+import subprocess
+import sys
+
+from neo4j.exceptions import ClientError
+
+from twig_server.database.connection import Neo4jConnection
+from twig_server.database.unit_of_work import read_only
 
 
 def test_env_vars():
@@ -15,3 +22,137 @@ def test_app(app):
 
 def test_connection(connection):
     connection.verify_connectivity()
+
+
+@pytest.mark.parametrize(
+    "url,routing,expected",
+    [
+        ("bolt://db:7687", True, "neo4j://db:7687"),
+        ("neo4j+s://db:7687", False, "bolt+s://db:7687"),
+        ("bolt+ssc://db", None, "bolt+ssc://db"),
+        ("memory://", True, "memory://"),
+    ],
+)
+def test_routing_scheme(url, routing, expected):
+    assert (
+        Neo4jConnection("u", "p", url, routing=routing).driver_url()
+        == expected
+    )
+
+
+@pytest.mark.parametrize("url", [None, ""])
+def test_missing_server_url(url):
+    with pytest.raises(ValueError, match="NEO4J_SERVER_URL is not set"):
+        Neo4jConnection("u", "p", url).connect()
+
+
+def test_read_only_views_refuse_writes(app):
+    assert app.view_functions["list_all_tags"].read_only
+    view = app.view_functions["list_all_tags"]
+    app.view_functions["list_all_tags"] = read_only(
+        lambda project_id: (
+            current_app.config["driver"]
+            .session()
+            .run("CREATE (n:Tag) RETURN n"),
+            "",
+        )[1]
+    )
+    try:
+        with pytest.raises(ClientError):
+            app.test_client().get("/project/0/list_all_tags")
+    finally:
+        app.view_functions["list_all_tags"] = view
+
+
+@pytest.mark.parametrize(
+    "status,committed", [(200, True), (404, True), (500, False)]
+)
+def test_unit_of_work_commits_unless_5xx(app, connection, status, committed):
+    name = f"uow-{status}"
+
+    def view():
+        with connection.session() as session:
+            session.run("CREATE (:UnitOfWorkProbe {name: $name})", name=name)
+            session.run("CREATE (:UnitOfWorkProbe {name: $name})", name=name)
+        return "", status
+
+    original = app.view_functions["new_project"]
+    app.view_functions["new_project"] = view
+    try:
+        assert app.test_client().put("/project/new").status_code == status
+    finally:
+        app.view_functions["new_project"] = original
+    with connection.driver_session() as session:
+        count = session.run(
+            "MATCH (n:UnitOfWorkProbe {name: $name}) RETURN count(n)",
+            name=name,
+        ).single()[0]
+        session.run("MATCH (n:UnitOfWorkProbe) DETACH DELETE n")
+    assert count == (2 if committed else 0)
+
+
+def test_pool_settings_reach_the_driver(app):
+    conn = Neo4jConnection(
+        "u",
+        "p",
+        "bolt://localhost:7687",
+        max_connection_pool_size=7,
+        connection_acquisition_timeout=2.5,
+        fetch_size=50,
+        keep_alive=None,  # keeps the driver default
+    )
+    conn.connect()  # the driver only connects on first use
+    try:
+        pool = conn.conn._pool
+        assert pool.pool_config.max_connection_pool_size == 7
+        assert pool.workspace_config.connection_acquisition_timeout == 2.5
+        assert pool.workspace_config.fetch_size == 50
+        status = conn.pool_status()
+        assert status["config"] == {
+            "max_connection_pool_size": 7,
+            "connection_acquisition_timeout": 2.5,
+            "fetch_size": 50,
+        }
+        assert status["in_use"] == status["idle"] == 0
+    finally:
+        conn.close()
+    # from the environment through the app config
+    env = dict(
+        os.environ,
+        NEO4J_SERVER_URL="memory://",
+        NEO4J_MAX_CONNECTION_POOL_SIZE="7",
+        NEO4J_KEEP_ALIVE="false",
+        NEO4J_CONNECTION_ACQUISITION_TIMEOUT="",
+        NEO4J_MAX_CONNECTION_LIFETIME="",
+        NEO4J_FETCH_SIZE="",
+    )
+    out = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            (
+                "from twig_server.app import app; "
+                "print(sorted(app.config['driver'].driver_config.items()))"
+            ),
+        ],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    assert (
+        out.strip()
+        == "[('keep_alive', False), ('max_connection_pool_size', 7)]"
+    )
+
+
+def test_pool_status_without_driver_internals():
+    class Driver:
+        _pool = object()  # a driver whose pool has none of the internals
+
+    conn = Neo4jConnection("u", "p", "bolt://localhost:7687")
+    assert conn.pool_statistics.instrument(Driver._pool) is False
+    conn.conn = Driver()
+    status = conn.pool_status()
+    assert status["servers"] == {}
+    assert status["in_use"] == status["idle"] == 0
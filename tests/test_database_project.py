@@ -26,5 +26,51 @@ def test_database_project_query_uid(create_project):
 def test_database_project_ownership(create_project):
     assert create_project.owner_rls is not None
 
-def test_database_list_projects(connection: Neo4jDriver, create_project: Project):
-    assert len(Project.list_projects(connection.conn, create_project.owner)) == 1
\ No newline at end of file
+
+def test_database_list_projects(
+    connection: Neo4jDriver, create_project: Project
+):
+    assert (
+        len(Project.list_projects(connection.conn, create_project.owner)) == 1
+    )
+
+
+def test_database_create_with_parent_in_one_statement(
+    connection: Neo4jConnection, create_user_username, record_statements
+):
+    proj = Project(connection, name="one statement")
+    with record_statements() as statements:
+        proj.create(create_user_username)
+    try:
+        assert len(statements) == 1
+        assert statements[0].count("CREATE") == 1
+        assert proj.properties["name"] == "one statement"
+        assert proj.owner_rls is not None
+        assert proj.owner_rls.properties["uid"] is not None
+        assert [
+            project["m"].id
+            for project in Project.list_projects(
+                connection, create_user_username
+            )
+        ].count(proj.uid) == 1
+    finally:
+        proj.delete()
+
+
+def test_database_lazy_load_and_identity_map(
+    app, connection, project, record_statements
+):
+    with record_statements() as statements:
+        with app.test_request_context():
+            first = Project.lookup(connection, project["uid"])
+            assert first.uid == project["uid"]
+            assert statements == []  # nothing read yet
+            assert first.properties["version"] == project["version"]
+            assert len(statements) == 1
+            second = Project.lookup(connection, str(project["uid"]))
+            assert second is first
+            assert second.db_obj is not None
+            assert len(statements) == 1
+    with app.test_request_context():
+        # every request starts with an empty identity map
+        assert Project.lookup(connection, project["uid"]) is not first
@@ -0,0 +1,39 @@
+import pytest
+
+from twig_server.database import schema
+
+
+def test_schema_migrated_at_startup(connection):
+    versions = schema.applied_versions(connection)
+    assert {version for version, _, _ in schema.MIGRATIONS} <= versions
+
+
+def test_schema_migrate_is_idempotent(connection):
+    assert schema.migrate(connection) == []
+
+
+def test_schema_unique_constraint_lists_duplicates(connection):
+    with connection.session() as session:
+        for key in ["a", "a", "b", "c", "c", "c", None]:
+            session.run(
+                "CREATE (n:SchemaDuplicateProbe {key: $key})", {"key": key}
+            ).consume()
+    migration = (
+        1000,
+        "unique SchemaDuplicateProbe.key",
+        [
+            "CREATE CONSTRAINT schema_duplicate_probe_key IF NOT EXISTS "
+            "FOR (n:SchemaDuplicateProbe) REQUIRE n.key IS UNIQUE",
+        ],
+    )
+    try:
+        with pytest.raises(schema.DuplicateValuesError) as e:
+            schema.migrate(connection, [migration])
+        assert [value for value, _ in e.value.duplicates] == ["a", "c"]
+        assert [len(nodes) for _, nodes in e.value.duplicates] == [2, 3]
+        assert "SchemaDuplicateProbe.key" in str(e.value)
+        assert "'c' (nodes " in str(e.value)
+        assert 1000 not in schema.applied_versions(connection)
+    finally:
+        with connection.session() as session:
+            session.run("MATCH (n:SchemaDuplicateProbe) DELETE n").consume()
@@ -39,3 +39,21 @@ def query_user_uid(connection, create_user_username):
 
 def test_database_query_user_uid(query_user_uid, create_user_username):
     assert query_user_uid.properties == create_user_username.properties
+
+
+def test_database_user_patch(connection):
+    user = User(connection, username="patched")
+    user.create()
+    try:
+        user.patch({"username": "patched-2", "bio": "hi", "age": 3})
+        assert user.properties["username"] == "patched-2"
+        assert user.properties["age"] == 3
+        user.patch({"bio": None})
+        assert "bio" not in user.properties
+        with pytest.raises(ValueError):
+            user.patch({"username": "x", "uid": 1})
+        with pytest.raises(ValueError):
+            user.patch({"links": {"a": 1}})
+        assert user.properties["username"] == "patched-2"
+    finally:
+        user.delete()
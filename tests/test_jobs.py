@@ -0,0 +1,129 @@
+import threading
+
+from flask import Flask
+
+from twig_server import jobs
+from twig_server.jobs import (
+    CANCELLED,
+    DONE,
+    FAILED,
+    QUEUED,
+    Job,
+    JobLimitExceeded,
+    JobRunner,
+    JobStore,
+)
+import pytest
+
+from tests.conftest import HEADERS
+
+
+def blocked_job(owner, gate):
+    def run(job):
+        gate.wait(5)
+        job.report(step=1)
+        return "ran"
+
+    return Job("test", owner, run)
+
+
+def test_jobs_survive_a_restart(tmp_path):
+    database = str(tmp_path / "jobs.sqlite3")
+    runner = JobRunner(1, database)
+    done = runner.submit(Job("test", "a", lambda job: {"n": 1}))
+    assert runner.wait(done.id, 5)
+    store = JobStore(database)
+    # left queued by a process that died
+    store.save(Job("test", "a", None))
+
+    restarted = JobRunner(1, database)
+    assert restarted.get(done.id).result == {"n": 1}
+    assert [job.status for job in restarted.list("a")] == [FAILED, DONE]
+
+
+def test_user_limits():
+    runner = JobRunner(2, user_limit=1, user_queue_limit=2)
+    gate = threading.Event()
+    first = runner.submit(blocked_job("a", gate))
+    second = runner.submit(blocked_job("a", gate))
+    other = runner.submit(Job("test", "b", lambda job: "ran"))
+    with pytest.raises(JobLimitExceeded):
+        runner.submit(blocked_job("a", gate))
+    # one running per user, the free worker goes to another user
+    assert runner.wait(other.id, 5)
+    assert second.status == QUEUED
+    gate.set()
+    assert runner.wait_idle(5)
+    assert first.result == second.result == "ran"
+
+
+@pytest.mark.parametrize(
+    "config, limits",
+    [
+        ({}, (1, 20)),
+        ({"JOB_USER_LIMIT": None, "JOB_USER_QUEUE_LIMIT": None}, (1, 20)),
+        ({"JOB_USER_LIMIT": 0, "JOB_USER_QUEUE_LIMIT": 0}, (None, None)),
+        ({"JOB_USER_LIMIT": 3, "JOB_USER_QUEUE_LIMIT": 5}, (3, 5)),
+    ],
+)
+def test_init_app_limits(config, limits):
+    app = Flask(__name__)
+    app.config.update(config)
+    runner = jobs.init_app(app)
+    assert app.config["jobs"] is runner
+    assert (runner.user_limit, runner.user_queue_limit) == limits
+
+
+def test_cancel():
+    runner = JobRunner(1)
+    gate = threading.Event()
+    running = runner.submit(blocked_job("a", gate))
+    queued = runner.submit(blocked_job("b", gate))
+    assert runner.cancel(queued.id).status == CANCELLED
+    runner.cancel(running.id)
+    gate.set()
+    assert runner.wait_idle(5)
+    assert running.status == CANCELLED and running.progress == {"step": 1}
+    assert runner.cancel(running.id) is None
+
+    gate = threading.Event()
+    runner.submit(blocked_job("a", gate))
+    kept = blocked_job("b", gate)
+    kept.cancellable = False
+    runner.submit(kept)
+    # queued or not, a job that is not cancellable runs to its end
+    assert not runner.cancel(kept.id).cancel_requested
+    assert kept.to_dict()["cancellable"] is False
+    gate.set()
+    assert runner.wait_idle(5)
+    assert kept.status == DONE
+
+
+def test_job_routes(app, project):
+    client = app.test_client()
+    url = f"/project/{project['uid']}"
+    resource = client.put(f"{url}/new?item=node", headers=HEADERS).get_json()
+
+    res = client.post(
+        f"{url}/positions/update?background=true",
+        headers=HEADERS,
+        json={str(resource["uid"]): {"x": 3, "y": 4}, "0": {"x": 1, "y": 1}},
+    )
+    assert res.status_code == 202
+    job = res.get_json()["job"]
+    assert app.config["jobs"].wait(job["id"], 5)
+    status = client.get(f"/jobs/{job['id']}", headers=HEADERS).get_json()
+    assert status["status"] == "done" and status["result"] == {
+        "skipped": ["0"]
+    }
+    item = client.get(url).get_json()["items"][0]
+    assert (item["pos_x"], item["pos_y"]) == (3, 4)
+
+    jobs = client.get("/jobs", headers=HEADERS).get_json()
+    assert jobs[0]["id"] == job["id"]
+    assert client.get("/jobs").status_code == 401
+    assert (
+        client.post(f"/jobs/{job['id']}/cancel", headers=HEADERS).status_code
+        == 404
+    )
+    assert client.post(f"/jobs/{job['id']}/cancel").status_code == 401
@@ -0,0 +1,114 @@
+import pytest
+from neo4j import READ_ACCESS, graph
+from neo4j.exceptions import ClientError
+
+from twig_server.database.memory import MemoryDriver
+
+
+@pytest.fixture()
+def driver():
+    driver = MemoryDriver()
+    with driver.session() as session:
+        session.run(
+            "CREATE (p:Project {name: 'p'})-[:Has_Resource]->(a:Resource {name: 'a'}), "
+            "(p)-[:Has_Resource]->(b:Resource {name: 'b'}), "
+            "(a)-[:prereq]->(b)"
+        )
+    return driver
+
+
+def test_memory_create_returns_nodes(driver):
+    with driver.session() as session:
+        record = session.run(
+            "CREATE (n:Tag $props) RETURN n",
+            props={"name": "t", "color": None},
+        ).single()
+    assert type(record[0]) is graph.Node
+    assert record[0]["name"] == "t"
+    assert "color" not in record[0]
+
+
+def test_memory_match_and_id_lookup(driver):
+    with driver.session() as session:
+        project_id = session.run("MATCH (p:Project) RETURN id(p)").single()[0]
+        names = session.run(
+            "MATCH (p:Project)-[:Has_Resource]->(r:Resource) "
+            "WHERE id(p)=$uid RETURN r.name AS name ORDER BY name DESC",
+            uid=project_id,
+        ).value()
+    assert names == ["b", "a"]
+
+
+def test_memory_optional_match_and_aggregation(driver):
+    with driver.session() as session:
+        rows = session.run(
+            "MATCH (r:Resource) OPTIONAL MATCH (r)-[e:prereq]->(:Resource) "
+            "RETURN r.name AS name, count(e) AS prereqs ORDER BY name"
+        ).data()
+    assert rows == [{"name": "a", "prereqs": 1}, {"name": "b", "prereqs": 0}]
+
+
+def test_memory_unwind_set(driver):
+    with driver.session() as session:
+        summary = session.run(
+            "UNWIND $positions AS pos MATCH (n:Resource) WHERE n.name = pos.name "
+            "SET n += {pos_x: pos.x} RETURN n",
+            positions=[{"name": "a", "x": 1}, {"name": "c", "x": 2}],
+        ).consume()
+        assert summary.counters.properties_set == 1
+        assert (
+            session.run(
+                "MATCH (n:Resource {name: 'a'}) RETURN n.pos_x"
+            ).single()[0]
+            == 1
+        )
+
+
+def test_memory_delete_needs_detach(driver):
+    with driver.session() as session:
+        with pytest.raises(ClientError):
+            session.run("MATCH (n:Project) DELETE n")
+        session.run("MATCH (n:Project) DETACH DELETE n")
+        assert session.run("MATCH (n:Project) RETURN n").single() is None
+        assert (
+            session.run("MATCH ()-[e:Has_Resource]->() RETURN e").single()
+            is None
+        )
+
+
+def test_memory_rejects_nested_property_values(driver):
+    with driver.session() as session:
+        for value in ({"x": 1}, [{"x": 1}], [[1]]):
+            with pytest.raises(ClientError):
+                session.run("CREATE (:Resource {a: $a})", a=value)
+            with pytest.raises(ClientError):
+                session.run(
+                    "MATCH (n:Resource) SET n += $props", props={"a": value}
+                )
+        session.run("MATCH (n:Resource) SET n.a = $a", a=[1, 2])
+        assert session.run(
+            "MATCH (n:Resource {name: 'a'}) RETURN n.a"
+        ).single()[0] == [1, 2]
+
+
+def test_memory_transaction_rollback(driver):
+    with driver.session() as session:
+        tx = session.begin_transaction()
+        tx.run("MATCH (n:Resource) SET n.name = 'changed'")
+        tx.run("CREATE (:Resource {name: 'c'})")
+        tx.rollback()
+        names = session.run("MATCH (n:Resource) RETURN n.name").value()
+    assert sorted(names) == ["a", "b"]
+
+
+def test_memory_read_access_refuses_writes(driver):
+    with driver.session(default_access_mode=READ_ACCESS) as session:
+        assert len(session.run("MATCH (n:Resource) RETURN n").value()) == 2
+        with pytest.raises(ClientError):
+            session.run("MATCH (n:Resource) SET n.name = 'changed'")
+    with driver.session() as session:
+        with pytest.raises(ClientError):
+            session.read_transaction(lambda tx: tx.run("CREATE (:Resource)"))
+        session.write_transaction(lambda tx: tx.run("CREATE (:Resource)"))
+        names = session.run("MATCH (n:Resource) RETURN n.name").value()
+    assert sorted(names, key=str) == [None, "a", "b"]
@@ -0,0 +1,116 @@
+import re
+
+import pytest
+
+from twig_server.metrics import Histogram, Metrics
+
+from tests.conftest import INTERNAL_HEADERS
+
+
+def sample(text, name, **labels):
+    """value of the `name` sample with exactly `labels`, `None` if absent"""
+    rendered = ",".join(f'{key}="{value}"' for key, value in labels.items())
+    line = f"{name}{{{rendered}}}" if labels else name
+    for row in text.splitlines():
+        if row.startswith(line + " "):
+            return float(row.rsplit(" ", 1)[1])
+    return None
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram((1, 2))
+    for value in (0.5, 1, 1.5, 3):
+        histogram.observe(value)
+    assert histogram.cumulative() == [("1", 2), ("2", 3), ("+Inf", 4)]
+    assert (histogram.sum, histogram.count) == (6.0, 4)
+
+
+def test_metrics_render(app, project):
+    client = app.test_client()
+    route = "/project/<project_id>"
+    before = (
+        sample(
+            client.get("/metrics", headers=INTERNAL_HEADERS).get_data(
+                as_text=True
+            ),
+            "twig_http_requests_total",
+            route=route,
+            method="GET",
+            status="200",
+        )
+        or 0
+    )
+    client.get(f"/project/{project['uid']}")
+    client.get("/project/999999999")
+    res = client.get("/metrics", headers=INTERNAL_HEADERS)
+    assert res.status_code == 200
+    assert res.content_type.startswith("text/plain; version=0.0.4")
+    text = res.get_data(as_text=True)
+    assert "# TYPE twig_http_request_duration_seconds histogram" in text
+    assert "# TYPE twig_db_statements_total counter" in text
+    assert (
+        sample(
+            text,
+            "twig_http_requests_total",
+            route=route,
+            method="GET",
+            status="200",
+        )
+        == before + 1
+    )
+    assert (
+        sample(
+            text,
+            "twig_http_requests_total",
+            route=route,
+            method="GET",
+            status="404",
+        )
+        >= 1
+    )
+    assert (
+        sample(
+            text,
+            "twig_http_request_db_statements_bucket",
+            route=route,
+            method="GET",
+            le="+Inf",
+        )
+        >= 2
+    )
+    assert sample(text, "twig_db_statements_total") > 0
+    # every sample line is `name{labels} value`
+    for row in text.splitlines():
+        assert row.startswith("#") or re.fullmatch(
+            r"[a-z_]+(\{[^}]*\})? [0-9.e+-]+", row
+        ), row
+
+
+def test_metrics_escape_label_values():
+    metrics = Metrics()
+    metrics.describe_counter("c", "counter")
+    metrics.inc("c", (("route", 'a"b\\c\n'),))
+    assert 'c{route="a\\"b\\\\c\\n"} 1' in metrics.render()
+
+
+@pytest.mark.parametrize(
+    "route", ["/metrics", "/internal/pool", "/internal/slow_queries"]
+)
+def test_internal_routes_need_the_token(app, route):
+    client = app.test_client()
+    assert client.get(route).status_code == 401
+    assert (
+        client.get(
+            route, headers={"Authorization": "Bearer wrong"}
+        ).status_code
+        == 401
+    )
+    res = client.get(route, headers=INTERNAL_HEADERS)
+    assert res.status_code == 200 or res.get_data(as_text=True).startswith(
+        "query log is disabled"
+    )
+    app.config["INTERNAL_ROUTES_TOKEN"] = None
+    try:
+        assert client.get(route, headers=INTERNAL_HEADERS).status_code == 404
+    finally:
+        app.config["INTERNAL_ROUTES_TOKEN"] = "test-token"
@@ -0,0 +1,87 @@
+import pytest
+
+from twig_server.database.position_buffer import PositionBuffer
+
+from tests.conftest import HEADERS
+
+
+@pytest.fixture()
+def buffered(app, connection):
+    buffer = PositionBuffer(connection, start=False)
+    app.config["position_buffer"] = buffer
+    yield buffer
+    app.config["position_buffer"] = None
+
+
+def test_buffered_positions(app, buffered, project, record_statements):
+    client = app.test_client()
+    url = f"/project/{project['uid']}"
+    a, b = [
+        client.put(f"{url}/new?item=node", headers=HEADERS).get_json()
+        for _ in range(2)
+    ]
+
+    with record_statements() as statements:
+        for x in range(10):
+            res = client.post(
+                f"{url}/positions/update",
+                headers=HEADERS,
+                json={
+                    str(a["uid"]): {"x": x, "y": 1},
+                    str(b["uid"]): {"x": 2, "y": x},
+                    "bad": {"x": 1},
+                },
+            )
+            assert res.get_json() == {
+                "success": True,
+                "skipped": ["bad"],
+                "buffered": True,
+            }
+    # only the authorization checks
+    assert len(statements) == 10
+
+    res = client.get(url)
+    assert res.headers.get("ETag") is None
+    items = {item["uid"]: item for item in res.get_json()["items"]}
+    assert (items[a["uid"]]["pos_x"], items[b["uid"]]["pos_y"]) == (9, 9)
+
+    assert buffered.flush() == 2
+    assert buffered.positions(project["uid"]) == {}
+    res = client.get(url)
+    assert res.headers.get("ETag") is not None
+    items = {item["uid"]: item for item in res.get_json()["items"]}
+    assert (items[a["uid"]]["pos_x"], items[a["uid"]]["pos_y"]) == (9, 1)
+    assert (items[b["uid"]]["pos_x"], items[b["uid"]]["pos_y"]) == (2, 9)
+    changes = client.get(
+        f"{url}/changes?since={res.get_json()['project']['version'] - 1}"
+    )
+    assert [c["kind"] for c in changes.get_json()["changes"]] == [
+        "position"
+    ] * 2
+
+    # deleted while its position waited, so it is not written
+    client.post(
+        f"{url}/positions/update",
+        headers=HEADERS,
+        json={
+            str(a["uid"]): {"x": 5, "y": 5},
+            str(b["uid"]): {"x": 6, "y": 6},
+        },
+    )
+    client.delete(f"{url}/resource/{b['uid']}/delete", headers=HEADERS)
+    assert buffered.flush() == 1
+
+
+def test_flusher_thread_and_close(connection):
+    buffer = PositionBuffer(connection, interval=3600, flush_size=2)
+    try:
+        assert buffer.add(
+            0, {"1": {"x": 1, "y": 1}, "3": {"x": float("inf"), "y": 1}}
+        ) == ["3"]
+        assert buffer.positions(0) == {1: (1, 1)}
+        # over flush_size, the flusher wakes up; nothing matches project 0
+        buffer.add(0, {"2": {"x": 1, "y": 1}})
+    finally:
+        buffer.close()
+    assert buffer.positions(0) == {}
+    assert not buffer.thread.is_alive()
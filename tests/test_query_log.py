@@ -0,0 +1,43 @@
+import json
+import logging
+
+from twig_server.database.query_log import QueryLog, parameter_shape
+
+
+def test_slow_query_threshold(connection, caplog):
+    query_log = QueryLog(connection, slow_ms=50)
+    with caplog.at_level(logging.WARNING, logger="twig_server.slow_queries"):
+        query_log.observe("MATCH (n) RETURN n", {"uid": 1}, 0.049, 0, None)
+        assert caplog.records == [] and query_log.recent() == []
+        query_log.observe(
+            "MATCH (n)\n  WHERE id(n)=$uid RETURN n", {"uid": 1}, 0.05, 1, None
+        )
+    assert len(caplog.records) == 1
+    record = json.loads(caplog.records[0].getMessage())
+    assert record == query_log.recent()[0]
+    assert record["query"] == "MATCH (n) WHERE id(n)=$uid RETURN n"
+    assert record["parameters"] == {"uid": "int"}  # never the values
+    assert (record["wall_ms"], record["rows"]) == (50.0, 1)
+
+
+def test_slow_query_log_listens_to_statements(connection):
+    query_log = QueryLog(connection, slow_ms=0)
+    connection.add_summary_listener(query_log.observe)
+    try:
+        with connection.driver_session() as session:
+            session.run(
+                "MATCH (n:Project) WHERE id(n) IN $uids RETURN n", uids=[1, 2]
+            ).single()
+    finally:
+        connection.summary_listeners.remove(query_log.observe)
+    [record] = query_log.recent()
+    assert record["parameters"] == {"uids": ["list[2]", "int"]}
+    assert record["query_type"] == "r"
+
+
+def test_parameter_shape():
+    assert parameter_shape({"a": [], "b": {"c": "x"}, "d": (1.5,)}) == {
+        "a": "list[0]",
+        "b": {"c": "str"},
+        "d": ["list[1]", "float"],
+    }
@@ -0,0 +1,156 @@
+import pytest
+
+from tests.conftest import HEADERS
+
+
+def post_batch(client, project, operations, headers=HEADERS):
+    return client.post(
+        f"/project/{project['uid']}/batch",
+        json={"operations": operations},
+        headers=headers,
+    )
+
+
+def test_batch_with_refs(app, project, record_statements):
+    client = app.test_client()
+    existing = client.put(
+        f"/project/{project['uid']}/new?item=node", headers=HEADERS
+    ).get_json()
+    with record_statements() as statements:
+        res = post_batch(
+            client,
+            project,
+            [
+                {"op": "create_node", "ref": "a", "properties": {"name": "a"}},
+                {"op": "create_node", "ref": "b"},
+                {
+                    "op": "create_tag",
+                    "ref": "t",
+                    "properties": {"color": "red"},
+                },
+                {
+                    "op": "create_relationship",
+                    "ref": "e",
+                    "a": "a",
+                    "b": existing["uid"],
+                },
+                {"op": "create_relationship", "a": "b", "b": "a"},
+                {"op": "add_tag", "resource": "a", "tag": "t"},
+                {"op": "add_tag", "resource": "b", "tag": "t"},
+                {
+                    "op": "update_tag",
+                    "tag": "t",
+                    "properties": {"name": "done"},
+                },
+                {
+                    "op": "edit_resource",
+                    "resource": existing["uid"],
+                    "properties": {"name": "renamed"},
+                },
+                {"op": "dissociate_tag", "resource": "b", "tag": "t"},
+            ],
+        )
+    assert res.status_code == 200
+    body = res.get_json()
+    # authorization, uid check, project lock and prereq graph for the
+    # cycle check, seven groups of operations, change log
+    assert len(statements) == 12
+    results = body["results"]
+    assert results[0]["name"] == "a"
+    assert results[1]["name"] == "Untitled Resource"
+    assert results[2]["color"] == "red" and results[2]["priority"] == 0
+    assert results[7]["name"] == "done"
+    assert results[8]["name"] == "renamed"
+    assert body["refs"]["a"] == results[0]["uid"]
+    assert body["refs"]["e"] == results[3]["uid"]
+
+    changes = client.get(
+        f"/project/{project['uid']}/changes" f"?since={project['version'] + 1}"
+    ).get_json()
+    assert changes["version"] == body["version"] == project["version"] + 2
+    assert [(c["op"], c["kind"]) for c in changes["changes"]][-2:] == [
+        ("updated", "resource"),
+        ("deleted", "tag_link"),
+    ]
+    assert len(changes["changes"]) == 10
+
+    tags = client.get(
+        f"/project/{project['uid']}/resource/{results[0]['uid']}" "/list_tags"
+    ).get_json()
+    assert [t["name"] for t in tags] == ["done"]
+
+
+def test_batch_is_all_or_nothing(app, project):
+    client = app.test_client()
+    res = post_batch(
+        client,
+        project,
+        [
+            {"op": "create_node", "ref": "a"},
+            {"op": "delete_resource", "resource": "a"},
+            {
+                "op": "edit_resource",
+                "resource": "a",
+                "properties": {"name": "x"},
+            },
+        ],
+    )
+    assert res.status_code == 404
+    assert res.get_data(as_text=True) == "operation 2: not found"
+    graph = client.get(f"/project/{project['uid']}").get_json()
+    assert graph["items"] == []
+    assert graph["project"]["version"] == project["version"]
+
+
+def test_batch_rejects_foreign_uids(app, project):
+    client = app.test_client()
+    other = client.put("/project/new", headers=HEADERS).get_json()["project"]
+    resource = client.put(
+        f"/project/{other['uid']}/new?item=node", headers=HEADERS
+    ).get_json()
+    res = post_batch(
+        client,
+        project,
+        [
+            {"op": "create_node"},
+            {"op": "delete_resource", "resource": resource["uid"]},
+        ],
+    )
+    assert res.status_code == 401
+    assert (
+        post_batch(client, project, [{"op": "drop_project"}]).status_code
+        == 404
+    )
+    assert (
+        post_batch(
+            client, project, [{"op": "create_node"}], headers={}
+        ).status_code
+        == 401
+    )
+    client.delete(f"/project/{other['uid']}/delete", headers=HEADERS)
+
+
+@pytest.mark.parametrize(
+    "properties",
+    [
+        {"a": {"x": 1}},
+        {"a": [{"x": 1}]},
+        {"a": [[1]]},
+    ],
+)
+def test_batch_rejects_nested_properties(app, project, properties):
+    client = app.test_client()
+    res = post_batch(
+        client,
+        project,
+        [
+            {"op": "create_node", "properties": properties},
+        ],
+    )
+    assert res.status_code == 404
+    assert (
+        res.get_data(as_text=True)
+        == "operation 0: a must be a scalar or a list of scalars"
+    )
+    graph = client.get(f"/project/{project['uid']}").get_json()
+    assert graph["items"] == []
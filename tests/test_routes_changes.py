@@ -0,0 +1,79 @@
+from tests.conftest import HEADERS
+
+
+def test_changes_since_version(app, project):
+    client = app.test_client()
+    url = f"/project/{project['uid']}"
+    since = project["version"]
+    assert client.get(f"{url}/changes?since={since}").get_json() == {
+        "reload": False,
+        "version": since,
+        "changes": [],
+    }
+
+    a = client.put(f"{url}/new?item=node", headers=HEADERS).get_json()
+    b = client.put(f"{url}/new?item=node", headers=HEADERS).get_json()
+    client.post(
+        f"{url}/resource/{a['uid']}/edit?name=renamed", headers=HEADERS
+    )
+    client.delete(f"{url}/resource/{b['uid']}/delete", headers=HEADERS)
+
+    res = client.get(f"{url}/changes?since={since}").get_json()
+    assert res["reload"] is False
+    assert res["version"] == since + 4
+    assert [(c["op"], c["kind"], c["uid"]) for c in res["changes"]] == [
+        ("created", "resource", a["uid"]),
+        ("created", "resource", b["uid"]),
+        ("updated", "resource", a["uid"]),
+        ("deleted", "resource", b["uid"]),
+    ]
+    assert res["changes"][2]["data"]["name"] == "renamed"
+
+    res = client.get(f"{url}/changes?since={since + 3}").get_json()
+    assert [c["seq"] for c in res["changes"]] == [since + 4]
+
+
+def test_changes_reload_when_too_old(app, project):
+    client = app.test_client()
+    url = f"/project/{project['uid']}/changes"
+    res = client.get(f"{url}?since={project['version'] - 1}").get_json()
+    assert res == {"reload": True, "version": project["version"]}
+    assert client.get(url).status_code == 404
+
+
+def test_failed_writes_are_not_logged(app, project):
+    client = app.test_client()
+    url = f"/project/{project['uid']}"
+    a = client.put(f"{url}/new?item=node", headers=HEADERS).get_json()
+    tag = client.put(f"{url}/create_tag?name=t", headers=HEADERS).get_json()
+    client.put(
+        f"{url}/resource/{a['uid']}/add_tag?tag_uid={tag['uid']}",
+        headers=HEADERS,
+    )
+    other = client.put("/project/new", headers=HEADERS).get_json()["project"]
+    since = client.get(url).get_json()["project"]["version"]
+
+    res = client.put(
+        f"{url}/new?item=relationship&a_id={a['uid']}&b_id=999999999",
+        headers=HEADERS,
+    )
+    assert res.status_code == 404
+    dissociate = f"/resource/{a['uid']}/dissociate_tag?tag_uid={tag['uid']}"
+    assert client.delete(url + dissociate).status_code == 401
+    assert (
+        client.delete(
+            f"/project/{other['uid']}{dissociate}", headers=HEADERS
+        ).status_code
+        == 404
+    )
+    assert (
+        client.get(f"{url}/changes?since={since}").get_json()["changes"] == []
+    )
+
+    assert client.delete(url + dissociate, headers=HEADERS).status_code == 200
+    res = client.get(f"{url}/changes?since={since}").get_json()
+    assert [(c["op"], c["kind"]) for c in res["changes"]] == [
+        ("deleted", "tag_link")
+    ]
+    assert client.get(f"{url}/resource/{a['uid']}/list_tags").get_json() == []
+    client.delete(f"/project/{other['uid']}/delete", headers=HEADERS)
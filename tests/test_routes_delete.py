@@ -0,0 +1,182 @@
+import threading
+
+import pytest
+
+from twig_server.database.Project import Project
+from twig_server.jobs import Job
+
+from tests.conftest import HEADERS, KRATOS_USER_ID
+
+
+def count(connection, query, **parameters):
+    with connection.session() as session:
+        return session.run(query, parameters).single()[0]
+
+
+@pytest.fixture()
+def project(app, project):
+    """five chained resources, the first with three tags"""
+    client = app.test_client()
+    url = f"/project/{project['uid']}"
+    resources = [
+        client.put(f"{url}/new?item=node", headers=HEADERS).get_json()
+        for _ in range(5)
+    ]
+    for a, b in zip(resources, resources[1:]):
+        client.put(
+            f"{url}/new?item=relationship&a_id={a['uid']}&b_id={b['uid']}",
+            headers=HEADERS,
+        )
+    for _ in range(3):
+        tag = client.put(
+            f"{url}/create_tag?name=t", headers=HEADERS
+        ).get_json()
+        client.put(
+            f"{url}/resource/{resources[0]['uid']}/add_tag"
+            f"?tag_uid={tag['uid']}",
+            headers=HEADERS,
+        )
+    return project
+
+
+def test_delete_project_cascades_in_batches(app, connection, project):
+    app.config["PROJECT_DELETE_BATCH_SIZE"] = 2
+    client = app.test_client()
+    try:
+        res = client.delete(
+            f"/project/{project['uid']}/delete", headers=HEADERS
+        )
+    finally:
+        app.config["PROJECT_DELETE_BATCH_SIZE"] = None
+    assert res.status_code == 202
+    job = res.get_json()["job"]
+    assert client.get(f"/project/{project['uid']}").status_code == 404
+
+    assert app.config["jobs"].wait(job["id"], timeout=5)
+    status = client.get(f"/jobs/{job['id']}", headers=HEADERS).get_json()
+    assert status["status"] == "done"
+    assert status["result"] == {
+        "changes": 15,
+        "resources": 5,
+        "tags": 3,
+        "projects": 1,
+    }
+    assert status["progress"] == status["result"]
+    assert client.get(f"/jobs/{job['id']}").status_code == 401
+    assert client.get("/jobs/unknown", headers=HEADERS).status_code == 404
+
+    assert (
+        count(
+            connection,
+            "MATCH (n) WHERE id(n)=$uid RETURN count(n)",
+            uid=project["uid"],
+        )
+        == 0
+    )
+
+
+def test_queued_delete_cannot_be_cancelled(app, connection, project):
+    client = app.test_client()
+    url = f"/project/{project['uid']}"
+    uids = [
+        item["uid"]
+        for item in client.get(url).get_json()["items"]
+        if isinstance(item, dict)  # resources, relationships are lists
+    ]
+    # takes the user's only job slot, so the delete stays queued
+    gate = threading.Event()
+    blocker = app.config["jobs"].submit(
+        Job("test", KRATOS_USER_ID, lambda job: gate.wait(5))
+    )
+    try:
+        job = client.delete(f"{url}/delete", headers=HEADERS).get_json()["job"]
+        assert job["status"] == "queued" and job["cancellable"] is False
+        res = client.post(f"/jobs/{job['id']}/cancel", headers=HEADERS)
+        assert res.status_code == 404
+    finally:
+        gate.set()
+    assert app.config["jobs"].wait(blocker.id, 5)
+    assert app.config["jobs"].wait(job["id"], 5)
+    assert (
+        client.get(f"/jobs/{job['id']}", headers=HEADERS).get_json()["status"]
+        == "done"
+    )
+    assert (
+        count(
+            connection,
+            "MATCH (n) WHERE id(n) IN $uids RETURN count(n)",
+            uids=uids + [project["uid"]],
+        )
+        == 0
+    )
+
+
+def test_deleted_project_is_gone_for_every_route(app, project):
+    client = app.test_client()
+    url = f"/project/{project['uid']}"
+    resource = client.get(url).get_json()["items"][0]["uid"]
+    tag = client.get(f"{url}/list_all_tags").get_json()[0]["uid"]
+    # keeps the hidden project around until the test is done
+    gate = threading.Event()
+    blocker = app.config["jobs"].submit(
+        Job("test", KRATOS_USER_ID, lambda job: gate.wait(5))
+    )
+    try:
+        job = client.delete(f"{url}/delete", headers=HEADERS).get_json()["job"]
+        for path in [
+            "",
+            "/export",
+            "/changes?since=0",
+            "/list_all_tags",
+            f"/resource/{resource}/list_tags",
+            f"/tag/{tag}/list_resources",
+            "/prereqs/order",
+            f"/resource/{resource}/prereqs",
+        ]:
+            assert client.get(url + path).status_code == 404, path
+        assert (
+            client.post(f"{url}/edit?name=x", headers=HEADERS).status_code
+            == 404
+        )
+        assert (
+            client.put(f"{url}/new?item=node", headers=HEADERS).status_code
+            == 404
+        )
+    finally:
+        gate.set()
+    assert app.config["jobs"].wait(blocker.id, 5)
+    assert app.config["jobs"].wait(job["id"], 5)
+
+
+def test_sweep_orphans(app, connection, project):
+    with connection.session() as session:
+        session.run(
+            "CREATE (:Resource {name: 'orphan'})-[:prereq]->(:Resource), "
+            "(:Tag {name: 'orphan'}), (:Change {seq: 1})"
+        )
+        # deleted before deletes cascaded
+        session.run(
+            "MATCH (p:Project) WHERE id(p)=$uid DETACH DELETE p",
+            uid=project["uid"],
+        )
+    kept = app.test_client().put("/project/new", headers=HEADERS).get_json()
+    url = f"/project/{kept['project']['uid']}"
+    app.test_client().put(f"{url}/new?item=node", headers=HEADERS)
+    app.config["jobs"].wait_idle()
+
+    counts = Project.sweep_orphans(connection, 2)
+    assert counts["resources"] >= 7 and counts["tags"] >= 4
+    assert (
+        count(
+            connection, "MATCH (r:Resource {name: 'orphan'}) RETURN count(r)"
+        )
+        == 0
+    )
+    assert len(app.test_client().get(url).get_json()["items"]) == 1
+    assert Project.sweep_orphans(connection, 2) == {
+        "changes": 0,
+        "resources": 0,
+        "tags": 0,
+        "projects": 0,
+    }
+    app.test_client().delete(f"{url}/delete", headers=HEADERS)
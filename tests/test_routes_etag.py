@@ -0,0 +1,40 @@
+import pytest
+
+from tests.conftest import HEADERS
+
+
+@pytest.fixture()
+def project_id(project):
+    return project["uid"]
+
+
+def test_project_not_modified(app, project_id):
+    client = app.test_client()
+    res = client.get(f"/project/{project_id}")
+    etag = res.headers["ETag"]
+    assert res.status_code == 200
+    res = client.get(f"/project/{project_id}", headers={"If-None-Match": etag})
+    assert res.status_code == 304
+    assert res.headers["ETag"] == etag
+    assert res.data == b""
+
+
+def test_project_etag_changes_on_write(app, project_id):
+    client = app.test_client()
+    etag = client.get(f"/project/{project_id}").headers["ETag"]
+    client.put(f"/project/{project_id}/new?item=node", headers=HEADERS)
+    res = client.get(f"/project/{project_id}", headers={"If-None-Match": etag})
+    assert res.status_code == 200
+    assert res.headers["ETag"] != etag
+    assert len(res.get_json()["items"]) == 1
+
+
+def test_tags_not_modified(app, project_id):
+    client = app.test_client()
+    url = f"/project/{project_id}/list_all_tags"
+    etag = client.get(url).headers["ETag"]
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+    client.put(f"/project/{project_id}/create_tag?name=t", headers=HEADERS)
+    res = client.get(url, headers={"If-None-Match": etag})
+    assert res.status_code == 200
+    assert len(res.get_json()) == 1
@@ -0,0 +1,108 @@
+import pytest
+
+OWNER = {"X-User": "ownership-owner"}
+OTHER = {"X-User": "ownership-other"}
+
+
+@pytest.fixture()
+def projects(app):
+    """a project with two resources, a prereq and a tag of OWNER, and an
+    empty project of OTHER
+    """
+    client = app.test_client()
+    client.put(f"/user/{OWNER['X-User']}", headers=OWNER)
+    client.put(f"/user/{OTHER['X-User']}", headers=OTHER)
+    owned = client.put("/project/new", headers=OWNER).get_json()["project"]
+    other = client.put("/project/new", headers=OTHER).get_json()["project"]
+    url = f"/project/{owned['uid']}"
+    a, b = (
+        client.put(f"{url}/new?item=node", headers=OWNER).get_json()
+        for _ in range(2)
+    )
+    prereq = client.put(
+        f"{url}/new?item=relationship&a_id={a['uid']}&b_id={b['uid']}",
+        headers=OWNER,
+    ).get_json()
+    tag = client.put(f"{url}/create_tag?name=t", headers=OWNER).get_json()
+    yield url, f"/project/{other['uid']}", a, b, prereq, tag
+    client.delete(f"{url}/delete", headers=OWNER)
+    client.delete(f"/project/{other['uid']}/delete", headers=OTHER)
+
+
+def test_writes_stay_in_the_owned_project(app, projects):
+    url, other, a, b, prereq, tag = projects
+    client = app.test_client()
+    version = client.get(url).get_json()["project"]["version"]
+
+    # OTHER owns the project in the URL, nothing else
+    for method, path in [
+        ("post", f"/resource/{a['uid']}/edit?name=hacked"),
+        ("delete", f"/resource/{a['uid']}/delete"),
+        ("put", f"/new?item=relationship&a_id={b['uid']}&b_id={a['uid']}"),
+        ("delete", f"/relationship/{prereq['uid']}/delete"),
+        ("put", f"/resource/{a['uid']}/add_tag?tag_uid={tag['uid']}"),
+        (
+            "delete",
+            f"/resource/{a['uid']}/dissociate_tag?tag_uid={tag['uid']}",
+        ),
+        ("post", f"/tag/{tag['uid']}/update_name?name=hacked"),
+        ("delete", f"/delete_tag?uid={tag['uid']}"),
+    ]:
+        res = getattr(client, method)(other + path, headers=OTHER)
+        assert res.status_code == 404, path
+
+    graph = client.get(url).get_json()
+    assert graph["project"]["version"] == version
+    assert [
+        item["name"] for item in graph["items"] if isinstance(item, dict)
+    ] == ["Untitled Resource"] * 2
+    assert [
+        item[1]["uid"] for item in graph["items"] if isinstance(item, list)
+    ] == [prereq["uid"]]
+    assert client.get(f"{url}/list_all_tags").get_json()[0]["name"] == "t"
+
+    # the owner still can
+    res = client.post(
+        f"{url}/tag/{tag['uid']}/update_name?name=done", headers=OWNER
+    )
+    assert res.status_code == 200 and res.get_json()["name"] == "done"
+    assert (
+        client.put(
+            f"{url}/resource/{a['uid']}/add_tag?tag_uid={tag['uid']}",
+            headers=OWNER,
+        ).status_code
+        == 200
+    )
+    assert (
+        client.delete(
+            f"{url}/relationship/{prereq['uid']}/delete", headers=OWNER
+        ).status_code
+        == 200
+    )
+    assert (
+        client.delete(
+            f"{url}/delete_tag?uid={tag['uid']}", headers=OWNER
+        ).status_code
+        == 200
+    )
+
+
+def test_writes_check_the_owner_only_when_refused(
+    app, projects, record_statements
+):
+    url, other, a, b, prereq, tag = projects
+    client = app.test_client()
+    edit = f"/resource/{a['uid']}/edit?name=renamed"
+    with record_statements() as statements:
+        assert client.post(url + edit, headers=OWNER).status_code == 200
+    assert not any("AS authorized" in query for query in statements)
+
+    assert client.post(url + edit, headers=OTHER).status_code == 401
+    assert client.post(url + edit).status_code == 401
+    assert (
+        client.post(f"/project/999999999{edit}", headers=OWNER).status_code
+        == 404
+    )
+    res = client.post(f"{url}/resource/999999999/edit?name=x", headers=OWNER)
+    assert res.status_code == 404
+    assert res.get_data(as_text=True) == "resource not found"
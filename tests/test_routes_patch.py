@@ -0,0 +1,67 @@
+from tests.conftest import HEADERS, KRATOS_USER_ID
+
+
+def test_edit_resource_json_in_one_statement(app, project, record_statements):
+    client = app.test_client()
+    url = f"/project/{project['uid']}"
+    resource = client.put(f"{url}/new?item=node", headers=HEADERS).get_json()
+    fields = {f"field_{i}": i for i in range(7)}
+    fields["name"] = "eight fields"
+    with record_statements() as statements:
+        res = client.post(
+            f"{url}/resource/{resource['uid']}/edit",
+            json=fields,
+            headers=HEADERS,
+        )
+    assert res.status_code == 200
+    assert res.get_json() == {**resource, **fields}
+    assert len([q for q in statements if "SET n +=" in q]) == 1
+    assert not [q for q in statements if "SET n.`" in q]
+
+
+def test_edit_resource_query_string(app, project):
+    client = app.test_client()
+    url = f"/project/{project['uid']}"
+    resource = client.put(f"{url}/new?item=node", headers=HEADERS).get_json()
+    res = client.post(
+        f"{url}/resource/{resource['uid']}/edit?name=a&pos_x=3",
+        headers=HEADERS,
+    )
+    assert res.get_json()["name"] == "a"
+    assert res.get_json()["pos_x"] == "3"
+    res = client.post(
+        f"{url}/resource/{resource['uid']}/edit",
+        json={"uid": 1},
+        headers=HEADERS,
+    )
+    assert res.status_code == 404
+
+
+def test_edit_project_rejects_version(app, project):
+    client = app.test_client()
+    url = f"/project/{project['uid']}/edit"
+    res = client.patch(url, json={"name": "x", "version": 1}, headers=HEADERS)
+    assert res.status_code == 404
+    assert (
+        res.get_data(as_text=True) == "you cannot change the project version"
+    )
+    assert (
+        client.get(f"/project/{project['uid']}").get_json()["project"]["name"]
+        == project["name"]
+    )
+    res = client.patch(
+        url, json={"name": "x", "public": True}, headers=HEADERS
+    )
+    assert res.status_code == 200
+    assert res.get_json()["public"] is True
+    assert client.patch(url, json=[1], headers=HEADERS).status_code == 404
+
+
+def test_update_user_json(app):
+    client = app.test_client()
+    client.put(f"/user/{KRATOS_USER_ID}", headers=HEADERS)
+    url = f"/user/update/{KRATOS_USER_ID}"
+    res = client.post(url, json={"username": "patcher", "kratos_user_id": "x"})
+    assert res.status_code == 401
+    res = client.post(url, json={"username": "patcher"})
+    assert res.get_json()["user"]["username"] == "patcher"
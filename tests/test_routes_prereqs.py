@@ -0,0 +1,192 @@
+import json
+
+from twig_server.database.prereq_graph import PrereqGraph
+import pytest
+
+from tests.conftest import HEADERS
+
+
+@pytest.fixture()
+def graph(app, project):
+    """a -> b -> d, a -> c -> d, d -> e and a lone f"""
+    client = app.test_client()
+    url = f"/project/{project['uid']}"
+    uids = {
+        name: client.put(f"{url}/new?item=node", headers=HEADERS).get_json()[
+            "uid"
+        ]
+        for name in "abcdef"
+    }
+    for a, b in ["ab", "ac", "bd", "cd", "de"]:
+        client.put(
+            f"{url}/new?item=relationship&a_id={uids[a]}&b_id={uids[b]}",
+            headers=HEADERS,
+        )
+    return url, uids
+
+
+def test_prereq_analytics(app, graph):
+    url, uids = graph
+    client = app.test_client()
+    names = {uid: name for name, uid in uids.items()}
+
+    order = client.get(f"{url}/prereqs/order").get_json()
+    assert "".join(names[uid] for uid in order["order"]) == "abcdef"
+    assert order["cyclic"] == []
+    chain = client.get(f"{url}/prereqs/longest_chain").get_json()["chain"]
+    assert "".join(names[uid] for uid in chain) in ("abde", "acde")
+    prereqs = client.get(f"{url}/resource/{uids['e']}/prereqs").get_json()
+    assert "".join(names[uid] for uid in prereqs["prereqs"]) == "abcd"
+    unlocks = client.get(f"{url}/resource/{uids['b']}/unlocks").get_json()
+    assert "".join(names[uid] for uid in unlocks["unlocks"]) == "de"
+    assert client.get(f"{url}/resource/0/unlocks").status_code == 404
+    assert client.get("/project/0/prereqs/order").status_code == 404
+
+
+def test_prereq_graph_follows_the_change_log(app, graph, record_statements):
+    url, uids = graph
+    client = app.test_client()
+    client.get(f"{url}/prereqs/order")
+    edge = client.put(
+        f"{url}/new?item=relationship&a_id={uids['f']}&b_id={uids['a']}",
+        headers=HEADERS,
+    ).get_json()
+    client.post(f"{url}/resource/{uids['c']}/edit?name=c", headers=HEADERS)
+    g = client.put(f"{url}/new?item=node", headers=HEADERS).get_json()["uid"]
+    client.put(
+        f"{url}/new?item=relationship&a_id={uids['e']}&b_id={g}",
+        headers=HEADERS,
+    )
+    client.delete(f"{url}/resource/{uids['d']}/delete", headers=HEADERS)
+
+    with record_statements() as statements:
+        order = client.get(f"{url}/prereqs/order").get_json()
+        chain = client.get(f"{url}/prereqs/longest_chain").get_json()
+    # the change log since the cached version, the graph is not read again
+    assert len(statements) == 2
+    assert all("prereq" not in query for query in statements)
+    # d is gone, so e is ready first
+    assert order["order"] == [
+        uids["e"],
+        uids["f"],
+        uids["a"],
+        uids["b"],
+        uids["c"],
+        g,
+    ]
+    assert chain["chain"] == [uids["f"], uids["a"], uids["b"]]
+    assert chain["version"] == order["version"]
+
+    client.delete(f"{url}/relationship/{edge['uid']}/delete", headers=HEADERS)
+    unlocks = client.get(f"{url}/resource/{uids['f']}/unlocks").get_json()
+    assert unlocks["unlocks"] == []
+
+
+def test_prereq_cycles_are_rejected(app, graph):
+    url, uids = graph
+    client = app.test_client()
+    names = {uid: name for name, uid in uids.items()}
+
+    res = client.put(
+        f"{url}/new?item=relationship&a_id={uids['e']}&b_id={uids['b']}",
+        headers=HEADERS,
+    )
+    assert res.status_code == 404
+    cycle = res.get_data(as_text=True).split(": ")[1].split(" -> ")
+    assert "".join(names[int(uid)] for uid in cycle) == "bdeb"
+    assert (
+        client.put(
+            f"{url}/new?item=relationship&a_id={uids['a']}&b_id={uids['a']}",
+            headers=HEADERS,
+        ).status_code
+        == 404
+    )
+    assert (
+        client.put(
+            f"{url}/new?item=relationship&a_id={uids['e']}&b_id={uids['f']}",
+            headers=HEADERS,
+        ).status_code
+        == 200
+    )
+
+    res = client.post(
+        f"{url}/batch",
+        headers=HEADERS,
+        json={
+            "operations": [
+                {"op": "create_node", "ref": "g"},
+                {"op": "create_relationship", "a": uids["f"], "b": "g"},
+                {"op": "create_relationship", "a": "g", "b": uids["a"]},
+            ]
+        },
+    )
+    assert res.status_code == 404
+    assert (
+        res.get_data(as_text=True) == "operation 2: would close a prereq cycle"
+    )
+    # six resources and six prereqs
+    assert len(client.get(url).get_json()["items"]) == 12
+    # the cycle is broken by a deletion in the same batch
+    res = client.post(
+        f"{url}/batch",
+        headers=HEADERS,
+        json={
+            "operations": [
+                {"op": "create_relationship", "a": uids["f"], "b": uids["a"]},
+                {"op": "delete_resource", "resource": uids["e"]},
+            ]
+        },
+    )
+    assert res.status_code == 200
+
+    body = "\n".join(
+        [
+            json.dumps({"type": "resource", "uid": 1}),
+            json.dumps({"type": "resource", "uid": 2}),
+            json.dumps({"type": "prereq", "uid": 3, "a": 1, "b": 2}),
+            json.dumps({"type": "prereq", "uid": 4, "a": 2, "b": 1}),
+        ]
+    )
+    res = client.post(f"{url}/import", data=body, headers=HEADERS)
+    assert res.status_code == 404
+    assert res.get_data(as_text=True) == "line 4: prereq closes a cycle"
+    assert len(client.get(url).get_json()["items"]) == 10
+
+
+def test_prereq_check_locks_the_project_first(app, graph, record_statements):
+    url, uids = graph
+    client = app.test_client()
+    with record_statements() as statements:
+        res = client.put(
+            f"{url}/new?item=relationship&a_id={uids['f']}&b_id={uids['a']}",
+            headers=HEADERS,
+        )
+    assert res.status_code == 200
+    lock = [n for n, query in enumerate(statements) if "_lock" in query]
+    reads = [
+        n
+        for n, query in enumerate(statements)
+        if "prereq" in query or "Project_Change" in query
+    ]
+    # a concurrent prereq commits before the graph is read or waits
+    assert len(lock) == 1
+    assert lock[0] < min(reads)
+
+
+def test_prereq_order_is_repaired_locally():
+    graph = PrereqGraph(0)
+    for uid in range(6):
+        graph.add_node(uid)
+    for edge, (a, b) in enumerate([(4, 5), (5, 1), (3, 0), (1, 3)]):
+        graph.add_edge(edge, a, b)
+        assert graph.acyclic
+        assert all(
+            graph.ord[i] < graph.ord[j] for i, j in graph.edges.values()
+        )
+    # 2 is not between 4 and 0, so it keeps its slot
+    assert graph.ord[2] == 2
+    assert graph.check_edge(0, 4) == [4, 5, 1, 3, 0]
+    assert graph.check_edge(4, 0) is None
+    assert graph.check_edges([(0, 2), (2, 4)]) == 1
+    assert graph.check_edges([(0, 2), (2, 4)], removed=[1]) is None
+    assert graph.check_edges([(0, 7), (7, 8)]) is None
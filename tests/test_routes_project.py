@@ -0,0 +1,187 @@
+from tests.conftest import HEADERS
+
+
+def test_update_positions_in_one_statement(app, project, record_statements):
+    client = app.test_client()
+    url = f"/project/{project['uid']}"
+    a, b = [
+        client.put(f"{url}/new?item=node", headers=HEADERS).get_json()
+        for _ in range(2)
+    ]
+    other = client.put("/project/new", headers=HEADERS).get_json()["project"]
+    foreign = client.put(
+        f"/project/{other['uid']}/new?item=node", headers=HEADERS
+    ).get_json()
+    with record_statements() as statements:
+        res = client.post(
+            f"{url}/positions/update",
+            headers=HEADERS,
+            json={
+                str(a["uid"]): {"x": 1.4, "y": 2},
+                "bad": {"x": 1},
+                str(b["uid"]): {"x": 3, "y": 4.6},
+                "999999999": {"x": 1, "y": 1},
+                str(foreign["uid"]): {"x": 1, "y": 1},
+            },
+        )
+    assert res.status_code == 200
+    body = res.get_json()
+    assert body["success"] is True
+    assert sorted(body["skipped"]) == sorted(
+        ["bad", "999999999", str(foreign["uid"])]
+    )
+    assert len([q for q in statements if "UNWIND" in q]) == 1
+    assert not [q for q in statements if "SET n.pos_x = $x" in q]
+
+    items = {item["uid"]: item for item in client.get(url).get_json()["items"]}
+    assert (items[a["uid"]]["pos_x"], items[a["uid"]]["pos_y"]) == (1, 2)
+    assert (items[b["uid"]]["pos_x"], items[b["uid"]]["pos_y"]) == (3, 5)
+    moved = client.get(f"/project/{other['uid']}").get_json()["items"][0]
+    assert "pos_x" not in moved
+    client.delete(f"/project/{other['uid']}/delete", headers=HEADERS)
+
+
+def test_update_positions_rejects_malformed_bodies(app, project):
+    client = app.test_client()
+    url = f"/project/{project['uid']}"
+    a = client.put(f"{url}/new?item=node", headers=HEADERS).get_json()
+    for body in ([], [{"x": 1, "y": 1}], "x", None):
+        res = client.post(
+            f"{url}/positions/update", headers=HEADERS, json=body
+        )
+        assert res.status_code == 404
+        assert res.get_data(as_text=True) == "body must be a JSON object"
+    res = client.post(
+        f"{url}/positions/update",
+        headers=HEADERS,
+        json={str(a["uid"]): {"x": float("inf"), "y": 1}},
+    )
+    assert res.get_json() == {"success": True, "skipped": [str(a["uid"])]}
+
+
+def test_update_positions_logs_moved_resources_once(app, project):
+    client = app.test_client()
+    url = f"/project/{project['uid']}"
+    a = client.put(f"{url}/new?item=node", headers=HEADERS).get_json()
+    version = client.get(url).get_json()["project"]["version"]
+    res = client.post(
+        f"{url}/positions/update",
+        headers=HEADERS,
+        json={"bad": {"x": 1}, "999999999": {"x": 1, "y": 1}},
+    )
+    assert sorted(res.get_json()["skipped"]) == ["999999999", "bad"]
+    # nothing moved, so no new version
+    assert client.get(url).get_json()["project"]["version"] == version
+    res = client.post(
+        f"{url}/positions/update",
+        headers=HEADERS,
+        json={
+            f"0{a['uid']}": {"x": 1, "y": 1},
+            str(a["uid"]): {"x": 2, "y": 3},
+            f"0{999999999}": {"x": 1, "y": 1},
+        },
+    )
+    assert res.get_json()["skipped"] == ["0999999999"]
+    changes = client.get(f"{url}/changes?since={version}").get_json()[
+        "changes"
+    ]
+    assert [(c["kind"], c["uid"], c["data"]) for c in changes] == [
+        ("position", a["uid"], {"pos_x": 2, "pos_y": 3})
+    ]
+
+
+def test_authorization_in_the_project_query(app, project, record_statements):
+    client = app.test_client()
+    url = f"/project/{project['uid']}/edit?name=renamed"
+    stranger = {"X-User": "stranger"}
+    client.put("/user/stranger", headers=stranger)
+    with record_statements() as statements:
+        assert client.post(url, headers=stranger).status_code == 401
+    # project and ownership in one round trip, nothing written
+    assert len(statements) == 1
+    assert client.post(url).status_code == 401
+    assert (
+        client.post(
+            "/project/999999999/edit?name=x", headers=HEADERS
+        ).status_code
+        == 404
+    )
+    assert (
+        client.post(
+            "/project/999999999/edit?name=x", headers=stranger
+        ).status_code
+        == 404
+    )
+    res = client.post(url, headers=HEADERS)
+    assert res.status_code == 200
+    assert res.get_json()["name"] == "renamed"
+
+
+def test_project_graph_shape(app, project, record_statements):
+    client = app.test_client()
+    url = f"/project/{project['uid']}"
+    a, b = [
+        client.put(f"{url}/new?item=node", headers=HEADERS).get_json()
+        for _ in range(2)
+    ]
+    prereq = client.put(
+        f"{url}/new?item=relationship&a_id={a['uid']}&b_id={b['uid']}",
+        headers=HEADERS,
+    ).get_json()
+    tag = client.put(f"{url}/create_tag?name=t", headers=HEADERS).get_json()
+    client.put(
+        f"{url}/resource/{a['uid']}/add_tag?tag_uid={tag['uid']}",
+        headers=HEADERS,
+    )
+    with record_statements() as statements:
+        res = client.get(url)
+    assert len(statements) == 1  # project, resources, tags and prereqs
+    body = res.get_json()
+    assert body["project"]["uid"] == project["uid"]
+    resources = sorted(
+        (item for item in body["items"] if isinstance(item, dict)),
+        key=lambda item: item["uid"],
+    )
+    assert resources == [a, b]
+    assert [item for item in body["items"] if isinstance(item, list)] == [
+        [a["uid"], prereq, b["uid"]]
+    ]
+    assert body["resource_tags"] == {
+        str(a["uid"]): [tag["uid"]],
+        str(b["uid"]): [],
+    }
+    assert client.get("/project/999999999").status_code == 404
+
+
+def test_explore_pages_with_a_cursor(app, project, record_statements):
+    client = app.test_client()
+    mine = [project["uid"]] + [
+        client.put("/project/new", headers=HEADERS).get_json()["project"][
+            "uid"
+        ]
+        for _ in range(2)
+    ]
+    seen, after, pages = [], None, 0
+    with record_statements() as statements:
+        while True:
+            query = "/explore?limit=2" + (
+                f"&after={after}" if after is not None else ""
+            )
+            page = client.get(query).get_json()
+            pages += 1
+            assert len(page["projects"]) <= 2
+            for row in page["projects"]:
+                seen.append(row["project"]["uid"])
+                if row["project"]["uid"] in mine:
+                    assert row["owner"]["kratos_user_id"] == HEADERS["X-User"]
+            if page["next"] is None:
+                break
+            assert page["next"] == seen[-1]
+            after = page["next"]
+    assert pages >= 2
+    assert len(statements) == pages  # owners come with their projects
+    assert seen == sorted(set(seen))
+    assert set(mine) <= set(seen)
+    assert client.get("/explore?limit=x").status_code == 404
+    for uid in mine[1:]:
+        client.delete(f"/project/{uid}/delete", headers=HEADERS)
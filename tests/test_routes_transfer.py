@@ -0,0 +1,202 @@
+import json
+
+import pytest
+
+from twig_server.database import transfer
+
+from tests.conftest import HEADERS
+
+
+def new_project(client):
+    return client.put("/project/new", headers=HEADERS).get_json()["project"]
+
+
+@pytest.fixture()
+def source(app, project):
+    client = app.test_client()
+    url = f"/project/{project['uid']}"
+    a = client.put(f"{url}/new?item=node", headers=HEADERS).get_json()
+    b = client.put(f"{url}/new?item=node", headers=HEADERS).get_json()
+    client.post(f"{url}/resource/{a['uid']}/edit?name=first", headers=HEADERS)
+    client.put(
+        f"{url}/new?item=relationship&a_id={a['uid']}&b_id={b['uid']}",
+        headers=HEADERS,
+    )
+    tag = client.put(f"{url}/create_tag?name=t", headers=HEADERS).get_json()
+    client.put(
+        f"{url}/resource/{b['uid']}/add_tag?tag_uid={tag['uid']}",
+        headers=HEADERS,
+    )
+    return project
+
+
+def read_export(client, project_uid):
+    res = client.get(f"/project/{project_uid}/export")
+    assert res.status_code == 200
+    assert res.mimetype == "application/x-ndjson"
+    return [
+        json.loads(line) for line in res.get_data(as_text=True).splitlines()
+    ]
+
+
+def test_export_lists_the_project_graph(app, source):
+    records = read_export(app.test_client(), source["uid"])
+    types = [record["type"] for record in records]
+    assert types == [
+        "project",
+        "tag",
+        "resource",
+        "resource",
+        "prereq",
+        "tag_link",
+    ]
+    resources = {
+        r["uid"]: r["properties"] for r in records if r["type"] == "resource"
+    }
+    assert sorted(p["name"] for p in resources.values()) == [
+        "Untitled Resource",
+        "first",
+    ]
+    prereq = records[4]
+    assert resources[prereq["a"]]["name"] == "first"
+    assert records[5]["resource"] == prereq["b"]
+    assert records[5]["tag"] == records[1]["uid"]
+
+
+def test_import_remaps_ids(app, source):
+    client = app.test_client()
+    exported = client.get(f"/project/{source['uid']}/export").get_data()
+    target = new_project(client)
+    url = f"/project/{target['uid']}"
+
+    res = client.post(
+        f"{url}/import?batch_size=1", data=exported, headers=HEADERS
+    )
+    assert res.status_code == 200
+    body = res.get_json()
+    assert body["counts"] == {
+        "tag": 1,
+        "resource": 2,
+        "prereq": 1,
+        "tag_link": 1,
+    }
+    assert body["batches"] == 5
+    assert body["version"] > target["version"]
+
+    records = read_export(client, target["uid"])
+    source_records = read_export(client, source["uid"])
+    ids = body["ids"]
+    for old, new in zip(source_records[1:], records[1:]):
+        assert old["type"] == new["type"]
+        if "properties" in old:
+            assert old["properties"] == new["properties"]
+            assert ids[old["type"]][str(old["uid"])] == new["uid"]
+    assert ids["resource"][str(source_records[4]["a"])] == records[4]["a"]
+
+    changes = client.get(f"{url}/changes?since={target['version']}").get_json()
+    assert changes["reload"] is True
+    client.delete(f"{url}/delete", headers=HEADERS)
+
+
+def test_import_is_all_or_nothing(app, project):
+    client = app.test_client()
+    url = f"/project/{project['uid']}"
+    body = "\n".join(
+        [
+            json.dumps(
+                {"type": "resource", "uid": 1, "properties": {"name": "x"}}
+            ),
+            json.dumps({"type": "prereq", "uid": 2, "a": 1, "b": 99}),
+        ]
+    )
+    res = client.post(f"{url}/import", data=body, headers=HEADERS)
+    assert res.status_code == 404
+    assert "line 2" in res.get_data(as_text=True)
+    assert [r["type"] for r in read_export(client, project["uid"])] == [
+        "project"
+    ]
+
+    res = client.post(
+        f"{url}/import?background=true&batch_size=1",
+        data=body,
+        headers=HEADERS,
+    )
+    assert res.status_code == 202
+    job = res.get_json()["job"]
+    assert app.config["jobs"].wait(job["id"], 5)
+    job = client.get(f"/jobs/{job['id']}", headers=HEADERS).get_json()
+    assert job["status"] == "failed" and "line 2" in job["error"]
+    assert job["progress"] == {
+        "tag": 0,
+        "resource": 1,
+        "prereq": 0,
+        "tag_link": 0,
+    }
+    assert [r["type"] for r in read_export(client, project["uid"])] == [
+        "project"
+    ]
+
+    assert client.post(f"{url}/import", data=body).status_code == 401
+
+
+@pytest.mark.parametrize(
+    "line, message",
+    [
+        (
+            {"type": "resource", "uid": 1, "properties": {"x": {"y": 1}}},
+            "x must be a scalar or a list of scalars",
+        ),
+        (
+            {"type": "resource", "uid": 1, "properties": {"x": [{"y": 1}]}},
+            "x must be a scalar or a list of scalars",
+        ),
+        ({"type": "resource", "uid": [1]}, "uid must be a string or a number"),
+        ({"type": "tag", "uid": {"a": 1}}, "uid must be a string or a number"),
+        ({"type": "prereq", "a": [1], "b": 1}, "unknown resource [1]"),
+        (
+            {"type": "tag_link", "resource": {}, "tag": 1},
+            "unknown resource {}",
+        ),
+    ],
+)
+def test_import_rejects_malformed_records(app, project, line, message):
+    client = app.test_client()
+    url = f"/project/{project['uid']}"
+    res = client.post(f"{url}/import", data=json.dumps(line), headers=HEADERS)
+    assert res.status_code == 404
+    assert res.get_data(as_text=True) == f"line 1: {message}"
+
+
+def test_export_only_links_exported_records(app, connection, source):
+    lines = transfer.export_project(connection, source["uid"])
+    records = [json.loads(next(lines)) for _ in range(4)]
+    assert [r["type"] for r in records] == [
+        "project",
+        "tag",
+        "resource",
+        "resource",
+    ]
+    # written while the export streams, after its tags and resources were read
+    with connection.session() as session:
+        session.run(
+            "MATCH (p:Project)-[:Has_Resource]->(a:Resource) WHERE id(p)=$uid "
+            "CREATE (p)-[:Has_Resource]->(n:Resource)-[:prereq]->(a) "
+            "CREATE (p)-[:Project_Tag]->(t:Tag)<-[:Resource_Tag]-(a)",
+            {"uid": source["uid"]},
+        )
+    records += [json.loads(line) for line in lines]
+    exported = {r["uid"] for r in records if r["type"] == "resource"}
+    prereqs = [r for r in records if r["type"] == "prereq"]
+    assert len(prereqs) == 1 and {prereqs[0]["a"], prereqs[0]["b"]} <= exported
+    tags = {r["uid"] for r in records if r["type"] == "tag"}
+    links = [r for r in records if r["type"] == "tag_link"]
+    assert len(links) == 1 and links[0]["tag"] in tags
+
+    client = app.test_client()
+    target = new_project(client)
+    body = "".join(json.dumps(record) + "\n" for record in records)
+    res = client.post(
+        f"/project/{target['uid']}/import", data=body, headers=HEADERS
+    )
+    assert res.status_code == 200
+    client.delete(f"/project/{target['uid']}/delete", headers=HEADERS)
@@ -0,0 +1,66 @@
+from twig_server.database.user_cache import UserCache
+
+from tests.conftest import INTERNAL_HEADERS
+
+
+class FakeNode(dict):
+    def __init__(self, uid, **properties):
+        super().__init__(properties)
+        self.id = uid
+
+
+def test_lru_and_ttl():
+    now = [0.0]
+    cache = UserCache(maxsize=2, ttl=10, clock=lambda: now[0])
+    a = FakeNode(1, kratos_user_id="a")
+    b = FakeNode(2, kratos_user_id="b")
+    cache.put(a, cache.token())
+    cache.put(b, cache.token())
+    assert cache.get("kratos_user_id", "a") is a
+    cache.put(FakeNode(3, kratos_user_id="c"), cache.token())
+    # b was the least recently used
+    assert cache.get("kratos_user_id", "b") is None
+    now[0] = 11
+    assert cache.get("kratos_user_id", "a") is None
+    assert cache.stats() == {"size": 1, "hits": 1, "misses": 2, "evictions": 1}
+
+
+def test_invalidation_drops_pending_fills():
+    cache = UserCache()
+    node = FakeNode(1, kratos_user_id="a", username="old")
+    cache.put(node, cache.token())
+    token = cache.token()
+    cache.invalidate([], uid=1)
+    assert cache.get("username", "old") is None
+    cache.put(node, token)  # read before the invalidation
+    assert cache.get("kratos_user_id", "a") is None
+
+
+def test_user_routes_use_the_cache(app, record_statements):
+    client = app.test_client()
+    headers = {"X-User": "cached-user"}
+    client.put("/user/cached-user", headers=headers)
+    client.get("/user/cached-user")
+    with record_statements() as statements:
+        assert client.get("/user/cached-user").status_code == 200
+    assert not any("kratos_user_id=$value" in query for query in statements)
+
+    res = client.post(
+        "/user/update/cached-user",
+        json={"username": "renamed"},
+        headers=headers,
+    )
+    assert res.status_code == 200
+    assert (
+        client.get("/user/cached-user").get_json()["user"]["username"]
+        == "renamed"
+    )
+    assert (
+        client.get("/user/renamed").get_json()["user"]["kratos_user_id"]
+        == "cached-user"
+    )
+    metrics = client.get("/metrics", headers=INTERNAL_HEADERS).get_data(
+        as_text=True
+    )
+    assert "twig_user_cache_hits_total" in metrics
+    assert "twig_user_cache_misses_total" in metrics
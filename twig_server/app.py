@@ -1,19 +1,72 @@
 from flask import Flask, current_app
 from flask_cors import CORS
-from twig_server.routes import project, resource, user, tag
+from twig_server.routes import project, resource, user, tag, misc
 
 import os
 from dotenv import load_dotenv
 
 from twig_server.database.connection import Neo4jConnection
+from twig_server.database import unit_of_work, query_log, schema, user_cache, position_buffer, prereq_graph
+from twig_server import jobs, metrics
+
+
+def getenv_typed(name: str, cast):
+    """environment variable converted with `cast`, `None` if unset"""
+    value = os.getenv(name)
+    if value is None or value == "":
+        return None
+    if cast is bool:
+        return value.lower() in ("1", "true", "yes", "on")
+    return cast(value)
+
 
 load_dotenv()
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=[unit_of_work.BOOKMARK_HEADER])
 app.config.from_mapping(
     NEO4J_USERNAME=os.getenv("NEO4J_USERNAME"),
     NEO4J_PASSWORD=os.getenv("NEO4J_PASSWORD"),
     NEO4J_SERVER_URL=os.getenv("NEO4J_SERVER_URL"),
+    # true: neo4j:// routing scheme, reads of read only routes go to
+    # followers and read replicas; false: bolt://; unset: as in the url
+    NEO4J_ROUTING=getenv_typed("NEO4J_ROUTING", bool),
+    # connection pool, unset values keep the neo4j driver defaults
+    NEO4J_MAX_CONNECTION_POOL_SIZE=getenv_typed(
+        "NEO4J_MAX_CONNECTION_POOL_SIZE", int),
+    NEO4J_CONNECTION_ACQUISITION_TIMEOUT=getenv_typed(
+        "NEO4J_CONNECTION_ACQUISITION_TIMEOUT", float),  # seconds
+    NEO4J_MAX_CONNECTION_LIFETIME=getenv_typed(
+        "NEO4J_MAX_CONNECTION_LIFETIME", float),  # seconds
+    NEO4J_KEEP_ALIVE=getenv_typed("NEO4J_KEEP_ALIVE", bool),
+    NEO4J_FETCH_SIZE=getenv_typed("NEO4J_FETCH_SIZE", int),
+    # query log, see twig_server/database/query_log.py
+    NEO4J_QUERY_LOG=getenv_typed("NEO4J_QUERY_LOG", bool),
+    NEO4J_SLOW_QUERY_MS=getenv_typed("NEO4J_SLOW_QUERY_MS", float),
+    NEO4J_PROFILE_SAMPLE_RATE=getenv_typed("NEO4J_PROFILE_SAMPLE_RATE", float),
+    NEO4J_SLOW_QUERY_KEEP=getenv_typed("NEO4J_SLOW_QUERY_KEEP", int),
+    # schema migrations at startup, see twig_server/database/schema.py
+    NEO4J_MIGRATE_SCHEMA=getenv_typed("NEO4J_MIGRATE_SCHEMA", bool),
+    # records per UNWIND statement in /project/<id>/import
+    IMPORT_BATCH_SIZE=getenv_typed("IMPORT_BATCH_SIZE", int),
+    # background jobs, see twig_server/jobs.py
+    JOB_WORKERS=getenv_typed("JOB_WORKERS", int),
+    JOB_DATABASE=os.getenv("JOB_DATABASE"),
+    JOB_USER_LIMIT=getenv_typed("JOB_USER_LIMIT", int),
+    JOB_USER_QUEUE_LIMIT=getenv_typed("JOB_USER_QUEUE_LIMIT", int),
+    # users cached by kratos id and username, see twig_server/database/user_cache.py
+    USER_CACHE_SIZE=getenv_typed("USER_CACHE_SIZE", int),
+    USER_CACHE_TTL=getenv_typed("USER_CACHE_TTL", float),
+    # buffer position updates and write them in batches, see
+    # twig_server/database/position_buffer.py
+    POSITION_WRITE_BEHIND=getenv_typed("POSITION_WRITE_BEHIND", bool),
+    POSITION_FLUSH_INTERVAL=getenv_typed("POSITION_FLUSH_INTERVAL", float),
+    POSITION_FLUSH_SIZE=getenv_typed("POSITION_FLUSH_SIZE", int),
+    # projects whose prereq graph is kept for the analytics routes
+    PREREQ_GRAPH_CACHE_SIZE=getenv_typed("PREREQ_GRAPH_CACHE_SIZE", int),
+    # nodes per transaction when deleting a project
+    PROJECT_DELETE_BATCH_SIZE=getenv_typed("PROJECT_DELETE_BATCH_SIZE", int),
+    # bearer token of /metrics and /internal/*, they answer 404 when unset
+    INTERNAL_ROUTES_TOKEN=os.getenv("INTERNAL_ROUTES_TOKEN"),
 )
 with app.app_context():
     current_app.config[
@@ -23,9 +76,26 @@ with app.app_context():
         app.config.get("NEO4J_USERNAME"),
         app.config.get("NEO4J_PASSWORD"),
         app.config.get("NEO4J_SERVER_URL"),
+        routing=app.config.get("NEO4J_ROUTING"),
+        max_connection_pool_size=app.config.get(
+            "NEO4J_MAX_CONNECTION_POOL_SIZE"),
+        connection_acquisition_timeout=app.config.get(
+            "NEO4J_CONNECTION_ACQUISITION_TIMEOUT"),
+        max_connection_lifetime=app.config.get(
+            "NEO4J_MAX_CONNECTION_LIFETIME"),
+        keep_alive=app.config.get("NEO4J_KEEP_ALIVE"),
+        fetch_size=app.config.get("NEO4J_FETCH_SIZE"),
     )
     current_app.config["driver"].connect()
     current_app.config["driver"].verify_connectivity()
+    schema.init_app(app)
+unit_of_work.init_app(app)
+metrics.init_app(app)
+user_cache.init_app(app)
+query_log.init_app(app)
+jobs.init_app(app)
+position_buffer.init_app(app)
+prereq_graph.init_app(app)
 
 
 @app.route("/")
@@ -40,6 +110,14 @@ app.add_url_rule("/project/<project_id>/edit",
                  methods=["POST", "PATCH"], view_func=project.edit_project)
 app.add_url_rule("/project/<project_id>/delete", 
                  methods=["POST", "DELETE"], view_func=project.delete_project)
+app.add_url_rule("/project/<project_id>/changes",
+                 methods=["GET"], view_func=project.project_changes)
+app.add_url_rule("/project/<project_id>/export",
+                 methods=["GET"], view_func=project.export_project)
+app.add_url_rule("/project/<project_id>/import",
+                 methods=["POST"], view_func=project.import_project)
+app.add_url_rule("/project/<project_id>/batch",
+                 methods=["POST"], view_func=project.batch_operations)
 app.add_url_rule("/project/<project_id>/positions/update",
                  methods=["POST"], view_func=project.update_positions)
 app.add_url_rule("/project/<project_id>/new",
@@ -74,6 +152,14 @@ app.add_url_rule("/project/<project_id>/relationship/<relationship_id>/edit",
                  methods=["POST", "PUT"], view_func=resource.edit_relationship)
 app.add_url_rule("/project/<project_id>/relationship/<relationship_id>/delete",
                  methods=["POST", "DELETE"], view_func=resource.delete_relationship)
+app.add_url_rule("/project/<project_id>/prereqs/order",
+                 methods=["GET"], view_func=project.prereq_order)
+app.add_url_rule("/project/<project_id>/prereqs/longest_chain",
+                 methods=["GET"], view_func=project.longest_prereq_chain)
+app.add_url_rule("/project/<project_id>/resource/<resource_id>/prereqs",
+                 methods=["GET"], view_func=resource.resource_prereqs)
+app.add_url_rule("/project/<project_id>/resource/<resource_id>/unlocks",
+                 methods=["GET"], view_func=resource.resource_unlocks)
 
 app.add_url_rule("/user/<kratos_username_or_user_id>",
                  methods=["GET"], view_func=user.query_user)
@@ -84,6 +170,19 @@ app.add_url_rule("/explore",
 app.add_url_rule("/user/update/<kratos_user_id>",
                  methods=["POST"], view_func=user.update_user)
 
+app.add_url_rule("/internal/pool",
+                 methods=["GET"], view_func=misc.pool_status)
+app.add_url_rule("/metrics",
+                 methods=["GET"], view_func=misc.metrics)
+app.add_url_rule("/internal/slow_queries",
+                 methods=["GET"], view_func=misc.slow_queries)
+app.add_url_rule("/jobs",
+                 methods=["GET"], view_func=misc.list_jobs)
+app.add_url_rule("/jobs/<job_id>",
+                 methods=["GET"], view_func=misc.job_status)
+app.add_url_rule("/jobs/<job_id>/cancel",
+                 methods=["POST", "DELETE"], view_func=misc.cancel_job)
+
 def create_app(test_config=None):
     if test_config is not None:
         app.config.update(test_config)
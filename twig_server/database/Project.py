@@ -1,13 +1,23 @@
+import json
+import time
+
 from twig_server.database.connection import Neo4jConnection, Neo4jDriver
 from twig_server.database.native import Node, Relationship
 from twig_server.database.User import User
-from typing import Any, List, Optional
+from typing import Any, Callable, Dict, List, Optional, Tuple
 from neo4j import Record
 
 
 class Project(Node):
     _label_name = "Project"
     _label_owner_relationship = "Project_Owner"
+    _version_property = "version"
+    _changes_since_property = "changes_since"
+    _label_change = "Change"
+    _label_change_relationship = "Project_Change"
+    _label_deleted = "DeletedProject"  # replaces Project until deleted
+    _changes_kept = 1000  # versions of change log kept per project
+    _compact_every = 100  # versions between compactions
 
     def __init__(
         self,
@@ -31,41 +41,375 @@ class Project(Node):
         self.owner: Optional[User] = owner
         self.owner_rls: Optional[Relationship] = None
 
-    def get_owner(self) -> Optional[User]:
+    def query_uid(self, label_name: Optional[str] = None) -> Optional[Record]:
+        """Only matches `Project` nodes, so a project is not found by any
+        route once `mark_deleted` hid it
+        """
+        return super().query_uid(label_name or Project._label_name)
+
+    def owned_match(
+        self, kratos_user_id: Optional[str]
+    ) -> Tuple[str, Dict[str, Any]]:
+        """Start of a statement writing to the project's resources,
+        relationships or tags, with its parameters: matches the project as
+        `p` only while `kratos_user_id` owns it, so what follows cannot
+        reach into a project the user does not own
+        """
+        assert self.uid is not None
         queryStr = \
-            f"MATCH (n:{User._label_name})\
-                -[e:{Project._label_owner_relationship}]->\
-                    (m:{Project._label_name})\
-            WHERE id(m)=$uid\
-            RETURN n"
-        with self.db_conn.session() as session:
-            res = session.run(queryStr, {'uid': self.properties['uid']})
-            one_res = res.single()
-            user = Node.extract_properties(one_res.get(one_res._Record__keys[0]))
-        return user
-
-    def set_owner(self, owner: User) -> Optional[Relationship]:
+            f"MATCH (u:{User._label_name})\
+                -[:{Project._label_owner_relationship}]->\
+                (p:{Project._label_name}) \
+            WHERE id(p)=$project_uid AND u.kratos_user_id=$kratos_user_id "
+        return queryStr, {
+            'project_uid': int(self.uid),
+            'kratos_user_id': kratos_user_id,
+        }
+
+    def lock(self) -> None:
+        """Takes the write lock on the project node, held until the unit of
+        work ends. Writes that check the project's current state first,
+        like the prereq cycle check, lock it before reading so concurrent
+        ones run one after the other and each sees the last one's changes.
+        """
+        queryStr = \
+            f"MATCH (p:{Project._label_name}) WHERE id(p)=$uid \
+            SET p._lock = true REMOVE p._lock"
+        assert self.uid is not None
+        with self.conn.session() as session:
+            session.run(queryStr, {'uid': int(self.uid)}).consume()
+
+    def query_authorized(self, kratos_user_id: Optional[str]) -> bool:
+        """Loads the project and checks that `kratos_user_id` owns it,
+        in a single query. The project node ends up in `db_obj` as with
+        `query_uid`, it is `None` if the project does not exist.
+        :returns:
+            whether the user owns the project
+        """
+        queryStr = \
+            f"MATCH (m:{Project._label_name}) WHERE id(m)=$uid \
+            OPTIONAL MATCH (n:{User._label_name})\
+                -[e:{Project._label_owner_relationship}]->(m) \
+            WHERE n.kratos_user_id=$kratos_user_id \
+            RETURN m, count(e) > 0 AS authorized"
+        if self.uid is None or kratos_user_id is None:
+            self.query_uid()
+            return False
+        with self.conn.session() as session:
+            res = session.run(
+                queryStr,
+                {'uid': int(self.uid), 'kratos_user_id': kratos_user_id}
+            )
+            row = res.single()
+            self.db_obj = row['m'] if row else None
+            self.sync_properties()
+            authorized = bool(row['authorized']) if row else False
+        return authorized
+
+    def record_changes(
+        self, changes: List[Dict[str, Any]], reload: bool = False
+    ) -> Optional[int]:
+        """Bumps the project version, invalidating its `etag`, and appends
+        `changes` (see `change_entry`) to the project's change log under
+        the new version. Every route that changes the project, its
+        resources, tags or relationships calls this in the same unit of
+        work, so the log and the graph commit together.
+        :param reload:
+            for changes too big to log, the log restarts at the new version
+            and every client behind it has to reload
+        :returns:
+            the new version, `None` if the project does not exist
+        """
+        queryStr = \
+            f"MATCH (p:{Project._label_name}) WHERE id(p)=$uid \
+            SET p.{Project._changes_since_property} = coalesce( \
+                    p.{Project._changes_since_property}, \
+                    p.{Project._version_property}, 0), \
+                p.{Project._version_property} = \
+                    coalesce(p.{Project._version_property}, 0) + 1 \
+            SET p.{Project._changes_since_property} = CASE WHEN $reload \
+                THEN p.{Project._version_property} \
+                ELSE p.{Project._changes_since_property} END \
+            FOREACH (change IN $changes | \
+                CREATE (p)-[:{Project._label_change_relationship}]->\
+                    (:{Project._label_change} {{ \
+                        seq: p.{Project._version_property}, \
+                        op: change.op, kind: change.kind, uid: change.uid, \
+                        data: change.data, at: timestamp()}})) \
+            RETURN p"
+        assert self.uid is not None
+        with self.conn.session() as session:
+            res = session.run(
+                queryStr,
+                {'uid': int(self.uid), 'changes': changes, 'reload': reload},
+            )
+            self.db_obj = self.extract_node(res)
+            self.sync_properties()
+        version = self.properties.get(Project._version_property)
+        if version is not None and version % Project._compact_every == 0:
+            self.compact_changes()
+        return version
+
+    @staticmethod
+    def change_entry(
+        op: str, kind: str, uid: Optional[int], data: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """
+        :param op:
+            `created`, `updated` or `deleted`
+        :param kind:
+            `project`, `resource`, `relationship`, `tag`, `tag_link` or
+            `position`
+        :param uid:
+            uid of the changed node or relationship
+        :param data:
+            its properties after the change, stored as JSON
+        """
+        return {
+            'op': op,
+            'kind': kind,
+            'uid': uid,
+            'data': json.dumps(data, default=str) if data is not None else None,
+        }
+
+    def update_positions(self, positions: Dict[str, Any]) -> List[str]:
+        """Moves resources of the project and logs the moves. The version
+        stays as it is when no resource moved.
+        :param positions:
+            mapping of resource uid to `{'x': ..., 'y': ...}`
+        :returns:
+            the uids that were skipped, see `Resource.update_all_positions`
+        """
+        # imported here since Resource depends on this module
+        from twig_server.database.Resource import Resource
+
+        assert self.uid is not None
+        skipped = Resource.update_all_positions(
+            self.conn, positions, project_id=int(self.uid))
+        skipped_keys = set(skipped)
+        # by int uid, so "01" and "1" are one resource, the last one wins
+        # as in the UNWIND
+        moved = {
+            int(uid): {'pos_x': round(pos['x']), 'pos_y': round(pos['y'])}
+            for uid, pos in positions.items()
+            if uid not in skipped_keys
+        }
+        if not moved:
+            return skipped
+        self.record_changes([
+            Project.change_entry('updated', 'position', uid, data)
+            for uid, data in moved.items()
+        ])
+        return skipped
+
+    def compact_changes(self) -> None:
+        """Drops all but the last `_changes_kept` versions of the change log,
+        clients behind that have to reload the whole project
+        """
+        queryStr = \
+            f"MATCH (p:{Project._label_name}) WHERE id(p)=$uid \
+                AND p.{Project._version_property} - $keep > \
+                    p.{Project._changes_since_property} \
+            SET p.{Project._changes_since_property} = \
+                p.{Project._version_property} - $keep \
+            WITH p \
+            MATCH (p)-[:{Project._label_change_relationship}]->\
+                (c:{Project._label_change}) \
+            WHERE c.seq <= p.{Project._changes_since_property} \
+            DETACH DELETE c"
+        assert self.uid is not None
+        with self.conn.session() as session:
+            session.run(
+                queryStr,
+                {'uid': int(self.uid), 'keep': Project._changes_kept},
+            ).consume()
+
+    def list_changes(self, since: int) -> Optional[List[Dict[str, Any]]]:
+        """Changes after version `since` in order, loading the project.
+        :returns:
+            `None` if the log no longer reaches back to `since` (or the
+            project does not exist), the client has to reload
+        """
+        queryStr = \
+            f"MATCH (p:{Project._label_name}) WHERE id(p)=$uid \
+            OPTIONAL MATCH (p)-[:{Project._label_change_relationship}]->\
+                (c:{Project._label_change}) \
+            WHERE c.seq > $since \
+            WITH p, c ORDER BY c.seq \
+            RETURN p, collect(c) AS changes"
+        assert self.uid is not None
+        with self.conn.session() as session:
+            res = session.run(queryStr, {'uid': int(self.uid), 'since': since})
+            row = res.single()
+        self.db_obj = row['p'] if row else None
+        self.sync_properties()
+        if row is None:
+            return None
+        version = self.properties.get(Project._version_property, 0)
+        oldest = self.properties.get(Project._changes_since_property, version)
+        if since < oldest or since > version:
+            return None
+        ret = []
+        for c in row['changes']:
+            ret.append({
+                'seq': c.get('seq'),
+                'op': c.get('op'),
+                'kind': c.get('kind'),
+                'uid': c.get('uid'),
+                'data': json.loads(c['data']) if c.get('data') else None,
+            })
+        return ret
+
+    def etag(self) -> str:
+        """Entity tag of everything served about the project, loads it"""
+        version = self.properties.get(Project._version_property, 0)
+        return f"{self.uid}.{version}"
+
+    def mark_deleted(self) -> None:
+        """Hides the project by relabelling it, so nothing matches it as a
+        `Project` anymore. `delete_cascade` then removes it with
+        everything it owns, which can take longer than a request.
+        """
+        queryStr = \
+            f"MATCH (p:{Project._label_name}) WHERE id(p)=$uid \
+            REMOVE p:{Project._label_name} SET p:{Project._label_deleted}"
+        assert self.uid is not None
+        with self.conn.session() as session:
+            session.run(queryStr, {'uid': int(self.uid)}).consume()
+
+    @classmethod
+    def delete_cascade(
+        cls,
+        db_conn: Neo4jConnection,
+        uid: int,
+        batch_size: int,
+        report: Optional[Callable[..., None]] = None,
+    ) -> Dict[str, int]:
+        """Deletes a project marked by `mark_deleted`: its change log,
+        resources (with their prereqs and tag links) and tags, then the
+        project. Each transaction deletes at most `batch_size` nodes, so
+        large projects do not need a huge transaction, and it can resume
+        where an interrupted run stopped.
+        :param report:
+            called with the counts deleted so far after every batch
+        :returns:
+            nodes deleted per kind
+        """
+        # imported here since Resource and Tag depend on this module
+        from twig_server.database.Resource import Resource
+        from twig_server.database.Tag import Tag
+
+        counts = {'changes': 0, 'resources': 0, 'tags': 0, 'projects': 0}
+        children = [
+            ('changes', Project._label_change_relationship,
+             Project._label_change),
+            ('resources', Resource._label_project_relationship,
+             Resource._label_name),
+            ('tags', Tag._label_project_relationship, Tag._label_name),
+        ]
+        with db_conn.driver_session() as session:
+            for kind, relationship, label in children:
+                queryStr = \
+                    f"MATCH (p:{Project._label_deleted})\
+                        -[:{relationship}]->(x:{label}) \
+                    WHERE id(p)=$uid \
+                    WITH x LIMIT $batch_size \
+                    DETACH DELETE x \
+                    RETURN count(*) AS deleted"
+                while True:
+                    deleted = session.run(
+                        queryStr, {'uid': uid, 'batch_size': batch_size}
+                    ).single()['deleted']
+                    counts[kind] += deleted
+                    if report is not None:
+                        report(**counts)
+                    if deleted < batch_size:
+                        break
+            queryStr = \
+                f"MATCH (p:{Project._label_deleted}) WHERE id(p)=$uid \
+                DETACH DELETE p \
+                RETURN count(*) AS deleted"
+            counts['projects'] = session.run(
+                queryStr, {'uid': uid}).single()['deleted']
+        if report is not None:
+            report(**counts)
+        return counts
+
+    @classmethod
+    def sweep_orphans(
+        cls,
+        db_conn: Neo4jConnection,
+        batch_size: int,
+        report: Optional[Callable[..., None]] = None,
+    ) -> Dict[str, int]:
+        """Finishes interrupted `delete_cascade`s and deletes resources,
+        tags and change log entries that belong to no project, as left
+        behind by deleting only the project node. `batch_size` nodes per
+        transaction.
+        :returns:
+            nodes deleted per kind
+        """
+        from twig_server.database.Resource import Resource
+        from twig_server.database.Tag import Tag
+
+        counts = {'changes': 0, 'resources': 0, 'tags': 0, 'projects': 0}
+        queryStr = f"MATCH (p:{Project._label_deleted}) RETURN id(p) AS uid"
+        with db_conn.driver_session() as session:
+            deleted_projects = [row['uid'] for row in session.run(queryStr)]
+        for uid in deleted_projects:
+            cascade = Project.delete_cascade(db_conn, uid, batch_size)
+            for kind, deleted in cascade.items():
+                counts[kind] += deleted
+            if report is not None:
+                report(**counts)
+        orphans = [
+            ('changes', Project._label_change_relationship,
+             Project._label_change),
+            ('resources', Resource._label_project_relationship,
+             Resource._label_name),
+            ('tags', Tag._label_project_relationship, Tag._label_name),
+        ]
+        with db_conn.driver_session() as session:
+            for kind, relationship, label in orphans:
+                queryStr = \
+                    f"MATCH (x:{label}) \
+                    OPTIONAL MATCH (p:{Project._label_name})\
+                        -[:{relationship}]->(x) \
+                    WITH x, p WHERE p IS NULL \
+                    WITH x LIMIT $batch_size \
+                    DETACH DELETE x \
+                    RETURN count(*) AS deleted"
+                while True:
+                    deleted = session.run(
+                        queryStr, {'batch_size': batch_size}
+                    ).single()['deleted']
+                    counts[kind] += deleted
+                    if report is not None:
+                        report(**counts)
+                    if deleted < batch_size:
+                        break
+        return counts
+
+    def create(self, owner: User) -> Record:
         assert owner is not None
         self.owner = owner
-        owner_id = owner.properties["uid"]
-        proj_id = self.properties["uid"]
-        self.owner_rls = Relationship(self.conn, a_id=owner_id, b_id=proj_id)
-        self.owner_rls_db_obj = self.owner_rls.create(
-            Project._label_owner_relationship
+        self.db_obj = super().create(
+            Project._label_name,
+            {
+                "name": self.name,
+                "description": self.description,
+                # a timestamp rather than 0, so a project reusing the id of
+                # a deleted one never repeats its versions
+                Project._version_property: int(time.time() * 1000),
+            },
+            parent=owner,
+            parent_rls_label=Project._label_owner_relationship,
         )
-        self.owner_rls.sync_properties()
-        return self.owner_rls_db_obj
-
-    def create(self, owner: User) -> Record:
-        self.db_obj = super().create(Project._label_name)
-        self.set("name", self.name)
-        self.set("description", self.description)
-        self.sync_properties()
-        self.set_owner(owner)
+        self.owner_rls = self.parent_rls
         return self.db_obj
 
     @classmethod
-    def list_projects(cls, db_conn: Neo4jDriver, user: User) -> List[Record]:
+    def list_projects(cls, db_conn: Neo4jConnection, user: User) -> List[Record]:
         queryStr = \
             f"MATCH (n:{User._label_name})\
                     -[e:{Project._label_owner_relationship}]->\
@@ -79,14 +423,24 @@ class Project(Node):
         return res_list
 
     @classmethod
-    def explore_projects(cls, db_conn: Neo4jDriver) -> List[Record]:
+    def explore_projects(cls, db_conn: Neo4jConnection, limit: int, after: Optional[int] = None) -> List[Record]:
+        """
+        page of (owner, project) rows ordered by project uid
+        :param limit:
+            maximum number of rows
+        :param after:
+            cursor, only projects with a uid greater than this are returned
+        """
         queryStr = \
             f"MATCH (a:{User._label_name})\
-            -[{Project._label_owner_relationship}]->\
+            -[:{Project._label_owner_relationship}]->\
             (m:{Project._label_name}) \
-            RETURN a,m"
+            WHERE $after IS NULL OR id(m) > $after \
+            RETURN a,m \
+            ORDER BY id(m) \
+            LIMIT $limit"
         res_list = []
         with db_conn.session() as session:
-            res = session.run(queryStr)
+            res = session.run(queryStr, {'after': after, 'limit': limit})
             res_list = [x for x in res]
         return res_list
\ No newline at end of file
@@ -1,4 +1,4 @@
-from typing import Any, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 from twig_server.database.Project import Project
 from twig_server.database.Tag import Tag
 from twig_server.database.connection import Neo4jConnection
@@ -11,6 +11,7 @@ import twig_server.app as app
 class Resource(Node):
     _label_name = "Resource"
     _label_project_relationship = "Has_Resource"
+    _label_prereq_relationship = "prereq"
 
     def __init__(
         self,
@@ -35,16 +36,6 @@ class Resource(Node):
         self.project: Optional[Project] = project
         self.project_rls: Optional[Relationship] = None
 
-    def set_project(self, project: Project) -> Optional[Relationship]:
-        assert project is not None
-        self.project = project
-        project_id = project.properties['uid']
-        resource_id = self.properties['uid']
-        self.project_rls = Relationship(self.conn, a_id = project_id, b_id = resource_id)
-        self.project_rls_db_obj = self.project_rls.create(Resource._label_project_relationship)
-        self.project_rls.sync_properties()
-        return self.project_rls_db_obj
-
     def add_tag(self, tag: Tag) -> Optional[Relationship]:
         assert tag is not None
         resource_id = self.properties['uid']
@@ -54,65 +45,186 @@ class Resource(Node):
         tag_rls.sync_properties()
         return tag_rls_db_obj
 
-    def unjoin_tag(self, tag: Tag):
-        pass
+    def in_project(
+        self, project: Project, kratos_user_id: Optional[str]
+    ) -> Tuple[str, Dict[str, Any]]:
+        """MATCH clause binding the resource as `n` only if it belongs to
+        `project` and `kratos_user_id` owns it, see `Node.patch_matched`
+        """
+        queryStr, params = project.owned_match(kratos_user_id)
+        queryStr += \
+            f"MATCH (p)-[:{Resource._label_project_relationship}]->\
+                (n:{Resource._label_name}) \
+            WHERE id(n)=$uid "
+        return queryStr, {**params, 'uid': self.uid}
 
-    def query_uid(self):
-        return super().query_uid(Resource._label_name)
+    def join_tag(
+        self, tag: Tag, project: Project, kratos_user_id: Optional[str]
+    ) -> Optional[Relationship]:
+        """Links `tag` to the resource, only if both belong to `project`
+        and `kratos_user_id` owns it
+        :returns: the link, `None` if nothing matched
+        """
+        queryStr, params = self.in_project(project, kratos_user_id)
+        queryStr += \
+            f"MATCH (p)-[:{Tag._label_project_relationship}]->\
+                (t:{Tag._label_name}) \
+            WHERE id(t)=$tag_uid \
+            CREATE (n)-[e:{Tag._label_resource_relationship}]->(t) \
+            RETURN e"
+        with self.conn.session() as session:
+            res = session.run(queryStr, {**params, 'tag_uid': tag.uid})
+            rls_db_obj = Relationship.extract_relationship(res)
+        if rls_db_obj is None:
+            return None
+        rls = Relationship(self.conn, a_id=self.uid, b_id=tag.uid)
+        rls.db_obj = rls_db_obj
+        rls.sync_properties()
+        return rls
 
-    def create(self, project: Project) -> Record:
-        self.db_obj = super().create(Resource._label_name)
-        self.set("name", self.name)
-        self.set("description", self.description)
-        self.sync_properties()
-        self.set_project(project)
-        return self.db_obj
+    def unjoin_tag(
+        self, tag: Tag, project: Project, kratos_user_id: Optional[str]
+    ) -> Optional[int]:
+        """Removes the link to `tag`, only if the resource and the tag
+        both belong to `project` and `kratos_user_id` owns it
+        :returns: uid of the removed link, `None` if there was none
+        """
+        queryStr, params = self.in_project(project, kratos_user_id)
+        queryStr += \
+            f"MATCH (n)-[e:{Tag._label_resource_relationship}]->\
+                (t:{Tag._label_name})<-[:{Tag._label_project_relationship}]-(p) \
+            WHERE id(t)=$tag_uid \
+            WITH e, id(e) AS uid \
+            DELETE e \
+            RETURN uid"
+        with self.conn.session() as session:
+            row = session.run(queryStr, {**params, 'tag_uid': tag.uid}).single()
+        return row['uid'] if row else None
 
-    def find_rls_with(self, tag: Tag):
-        queryStr = f"MATCH (n:{Resource._label_name})-[e]->(t:{Tag._label_name})"+\
-                   f"WHERE id(n)=$uid AND id(t)=$tag_id RETURN e"
-        rls_db_obj = None
-        with self.db_conn.session() as session:
+    @classmethod
+    def create_prereq(
+        cls,
+        db_conn: Neo4jConnection,
+        project: Project,
+        kratos_user_id: Optional[str],
+        a_id: int,
+        b_id: int,
+    ) -> Optional[Relationship]:
+        """Makes resource `a_id` a prereq of `b_id`, only if both belong
+        to `project` and `kratos_user_id` owns it
+        :returns: the prereq, `None` if nothing matched
+        """
+        queryStr, params = project.owned_match(kratos_user_id)
+        queryStr += \
+            f"MATCH (p)-[:{Resource._label_project_relationship}]->\
+                (a:{Resource._label_name}) \
+            WHERE id(a)=$a_id \
+            MATCH (p)-[:{Resource._label_project_relationship}]->\
+                (b:{Resource._label_name}) \
+            WHERE id(b)=$b_id \
+            CREATE (a)-[e:{Resource._label_prereq_relationship}]->(b) \
+            RETURN e"
+        with db_conn.session() as session:
             res = session.run(
-                queryStr,
-                {
-                    'uid': self.properties['uid'],
-                    'tag_id': tag.properties['uid']
-                }
-            )
+                queryStr, {**params, 'a_id': int(a_id), 'b_id': int(b_id)})
             rls_db_obj = Relationship.extract_relationship(res)
-        return Relationship.extract_properties(rls_db_obj)
+        if rls_db_obj is None:
+            return None
+        rls = Relationship(db_conn, a_id=a_id, b_id=b_id)
+        rls.db_obj = rls_db_obj
+        rls.sync_properties()
+        return rls
+
+    @classmethod
+    def delete_prereq(
+        cls,
+        db_conn: Neo4jConnection,
+        project: Project,
+        kratos_user_id: Optional[str],
+        uid: int,
+    ) -> bool:
+        """Deletes prereq `uid`, only if it joins resources of `project`
+        and `kratos_user_id` owns it
+        :returns: whether it was deleted
+        """
+        queryStr, params = project.owned_match(kratos_user_id)
+        queryStr += \
+            f"MATCH (p)-[:{Resource._label_project_relationship}]->\
+                (:{Resource._label_name})\
+                -[e:{Resource._label_prereq_relationship}]->\
+                (:{Resource._label_name}) \
+            WHERE id(e)=$uid \
+            WITH e, id(e) AS uid \
+            DELETE e \
+            RETURN uid"
+        with db_conn.session() as session:
+            row = session.run(queryStr, {**params, 'uid': int(uid)}).single()
+        return row is not None
 
+    def query_uid(self):
+        return super().query_uid(Resource._label_name)
+
+    def create(self, project: Project) -> Record:
+        assert project is not None
+        self.project = project
+        self.db_obj = super().create(
+            Resource._label_name,
+            {"name": self.name, "description": self.description},
+            parent=project,
+            parent_rls_label=Resource._label_project_relationship,
+        )
+        self.project_rls = self.parent_rls
+        return self.db_obj
 
     @classmethod
-    def update_all_positions(cls, db_conn: Neo4jConnection, new_positions: dict, project_id: int) -> None:
+    def update_all_positions(cls, db_conn: Neo4jConnection, new_positions: dict, project_id: int) -> List[str]:
+        """
+        update the positions of many resources of a project in one statement
+        :param new_positions:
+            mapping of resource uid to `{'x': ..., 'y': ...}`
+        :returns:
+            uids that were skipped, as given in `new_positions`, either
+            because they are malformed or because they are not resources
+            of the project
+        """
+        positions = []
+        keys = []
+        skipped = []
         for uid in new_positions:
-            r = Resource(db_conn, uid=int(uid))
-            r.query_uid()
-            if(r.get_project().properties['uid'] != project_id):
-                continue
-            if('uid' in r.properties):
-                r.update_position(new_positions[uid])
-
-    def update_position(self, new_pos: dict) -> Record:
-        if "uid" not in self.properties:
-            return None
-        queryStr = f"MATCH (n:{Resource._label_name}) WHERE id(n)=$uid SET n.pos_x = $x SET n.pos_y = $y RETURN n"
-        with self.db_conn.session() as session:
+            try:
+                pos = new_positions[uid]
+                positions.append({
+                    'uid': int(uid),
+                    'x': round(pos['x']),
+                    'y': round(pos['y'])
+                })
+                keys.append(uid)
+            except (KeyError, TypeError, ValueError, OverflowError):
+                skipped.append(uid)
+        if not positions:
+            return skipped
+        queryStr = \
+            f"UNWIND $positions AS pos \
+              MATCH (p:{Project._label_name})\
+                    -[:{Resource._label_project_relationship}]->\
+                    (n:{Resource._label_name}) \
+              WHERE id(p)=$project_id AND id(n)=pos.uid \
+              SET n.pos_x = pos.x, n.pos_y = pos.y \
+              RETURN id(n) AS uid"
+        with db_conn.session() as session:
             res = session.run(
                 queryStr,
-                {
-                    'x': round(new_pos['x']),
-                    'y': round(new_pos['y']),
-                    'uid': self.properties['uid']
-                }
+                {'positions': positions, 'project_id': int(project_id)}
             )
-            self.db_obj = self.extract_node(res)
-            self.sync_properties()
-        return self.db_obj
+            updated = set(x['uid'] for x in res)
+        skipped.extend(
+            key for key, pos in zip(keys, positions)
+            if pos['uid'] not in updated
+        )
+        return skipped
 
     @classmethod
-    def get_tagged_resources(cls, db_conn: Neo4jDriver, tag: Tag):
+    def get_tagged_resources(cls, db_conn: Neo4jConnection, tag: Tag):
         queryStr = \
             f"MATCH (n:{Resource._label_name})\
                 -[e:{Tag._label_resource_relationship}]->\
@@ -125,22 +237,39 @@ class Resource(Node):
             res_list = [x for x in res]
         return res_list
 
-
     @classmethod
-    def list_resources(cls, db_conn: Neo4jDriver, project: Project) -> List[Record]:
+    def query_project_graph(cls, db_conn: Neo4jConnection, project: Project) -> Optional[Record]:
+        """
+        fetch a project with all its resources, their tag uids and their
+        prereq relationships in one query, loading the project node into
+        `project`. The project is returned once, in column `p`; column
+        `resources` holds one `{resource, tags, edges}` map per resource.
+        :returns:
+            the single row, `None` if the project does not exist
+        """
         queryStr = \
-            f"MATCH (n:{Project._label_name})\
-                    -[e:{Resource._label_project_relationship}]->\
-                    (m:{Resource._label_name}) \
-                WHERE id(n)=$uid \
-                RETURN n,e,m"
-        res_list = []
+            f"MATCH (p:{Project._label_name}) WHERE id(p)=$uid \
+              OPTIONAL MATCH (p)\
+                    -[:{Resource._label_project_relationship}]->\
+                    (r:{Resource._label_name}) \
+              OPTIONAL MATCH (r)\
+                    -[:{Tag._label_resource_relationship}]->\
+                    (t:{Tag._label_name}) \
+              WITH p, r, collect(id(t)) AS tags \
+              OPTIONAL MATCH (r)\
+                    -[e:{Resource._label_prereq_relationship}]->\
+                    (:{Resource._label_name}) \
+              WITH p, r, tags, collect(e) AS edges \
+              RETURN p, collect({{resource: r, tags: tags, edges: edges}}) AS resources"
         with db_conn.session() as session:
-            res = session.run(queryStr, {'uid': project.properties['uid']})
-            res_list = [x for x in res]
-        return res_list
+            res = session.run(queryStr, {'uid': project.uid})
+            row = res.single()
+        project.db_obj = row['p'] if row else None
+        project.sync_properties()
+        return row
+
     @classmethod
-    def list_resource_tags(cls, db_conn: Neo4jDriver, resource: Any) -> List[Record]:
+    def list_resource_tags(cls, db_conn: Neo4jConnection, resource: Any) -> List[Record]:
         """
         list tags associated with project
         """
@@ -162,10 +291,11 @@ class Resource(Node):
                     (m:{Resource._label_name}) \
                 WHERE id(m)=$uid \
                 RETURN n"
-        with self.db_conn.session() as session:
+        with self.conn.session() as session:
             res = session.run(queryStr, {'uid': self.properties['uid']})
             one_res = res.single()
-            project_properties = Node.extract_properties(one_res.get(one_res._Record__keys[0]))
-            self.project = Project(self.conn, uid=project_properties['uid'])
+            project_db_obj = one_res.get(one_res._Record__keys[0])
+            self.project = Project.lookup(self.conn, project_db_obj.id)
+            self.project.db_obj = project_db_obj
             self.project.sync_properties()
         return self.project
\ No newline at end of file
@@ -1,7 +1,7 @@
 from twig_server.database.connection import Neo4jConnection, Neo4jDriver
 from twig_server.database.native import Node, Relationship
 from twig_server.database.Project import Project
-from typing import Any, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 from neo4j import Record
 import twig_server.app as app
 
@@ -22,6 +22,8 @@ class Tag(Node):
             * uid: `str` -- Neo4J Unique ID
             * name: `str` -- Name of Tag
             * project: `Project` -- Project which Tag belongs to
+            * color: `str` -- Color of Tag
+            * priority: `int` -- Priority of Tag
         """
         uid: Optional[int] = kwargs.get("uid", None)
         name = kwargs.get("name", "Empty Tag")
@@ -30,6 +32,8 @@ class Tag(Node):
         self.name: str = name
         self.description: str = "default tag description"
         self.project: Optional[Project] = project
+        self.color: Optional[str] = kwargs.get("color", None)
+        self.priority: Optional[int] = kwargs.get("priority", None)
         self.project_rls: Optional[Relationship] = None
 
     def get_project_properties(self) -> Optional[Project]:
@@ -39,34 +43,44 @@ class Tag(Node):
                     (m:{Tag._label_name})\
             WHERE id(m)=$uid\
             RETURN n"
-        with self.db_conn.session() as session:
+        with self.conn.session() as session:
             res = session.run(queryStr, {'uid': self.properties['uid']})
             one_res = res.single()
             project_properties = Node.extract_properties(one_res.get(one_res._Record__keys[0]))
         return project_properties
 
-    def set_project(self, project: Project) -> Optional[Relationship]:
+    def in_project(
+        self, project: Project, kratos_user_id: Optional[str]
+    ) -> Tuple[str, Dict[str, Any]]:
+        """MATCH clause binding the tag as `n` only if it belongs to
+        `project` and `kratos_user_id` owns it, see `Node.patch_matched`
+        """
+        queryStr, params = project.owned_match(kratos_user_id)
+        queryStr += \
+            f"MATCH (p)-[:{Tag._label_project_relationship}]->\
+                (n:{Tag._label_name}) \
+            WHERE id(n)=$uid "
+        return queryStr, {**params, 'uid': self.uid}
+
+    def create(self, project: Project) -> Record:
         assert project is not None
         self.project = project
-        project_id = project.properties["uid"]
-        tag_id = self.properties["uid"]
-        self.project_rls = Relationship(self.conn, a_id=project_id, b_id=tag_id)
-        self.project_rls_db_obj = self.project_rls.create(
-            Tag._label_project_relationship
+        self.db_obj = super().create(
+            Tag._label_name,
+            {
+                "name": self.name,
+                "description": self.description,
+                "color": self.color,
+                "priority": self.priority,
+            },
+            parent=project,
+            parent_rls_label=Tag._label_project_relationship,
         )
-        self.project_rls.sync_properties()
-        return self.project_rls_db_obj
-
-    def create(self, project: Project) -> Record:
-        self.db_obj = super().create(Tag._label_name)
-        self.set("name", self.name)
-        self.set("description", self.description)
-        self.sync_properties()
-        self.set_project(project)
+        self.project_rls = self.parent_rls
         return self.db_obj
 
     @classmethod
-    def list_project_tags(cls, db_conn: Neo4jDriver, project: Project) -> List[Record]:
+    def list_project_tags(cls, db_conn: Neo4jConnection, project: Project) -> List[Record]:
         """
         list tags associated with project
         """
@@ -1,6 +1,7 @@
-from typing import List, Optional
+from typing import Any, Dict, List, Mapping, Optional
 from twig_server.database.native import Node
 from twig_server.database.connection import Neo4jConnection
+from twig_server.database.unit_of_work import current_unit_of_work
 
 from neo4j import Record
 
@@ -22,59 +23,110 @@ class User(Node):
         self.username: str = kwargs.get("username", None)
         self.kratos_user_id: str = kwargs.get("kratos_user_id", None)
         super().__init__(conn, uid)
+
+    def load(self) -> None:
         if self.username != None:
             self.query_username()
         elif self.kratos_user_id != None:
             self.query_kratos_user_id()
+        else:
+            self.query_uid()
 
     def query_username(self) -> Optional[Record]:  # query a User by username
         if self.username == None:
             return None
-        queryStr = (
-            f"MATCH (n:{User._label_name}) WHERE n.username=$username RETURN n"
-        )
-        with self.db_conn.session() as session:
-            res = session.run(queryStr, {"username": self.username})
-            self.db_obj = self.extract_node(res)
-            self.sync_properties()
-        return self.db_obj
+        return self.query_cached("username", self.username)
 
     def query_kratos_user_id(self):
         if self.kratos_user_id == None:
             return
-        queryStr = f"MATCH (n:{User._label_name}) WHERE n.kratos_user_id=$kratos_user_id RETURN n"
-        with self.db_conn.session() as session:
-            res = session.run(
-                queryStr, {"kratos_user_id": self.kratos_user_id}
-            )
+        return self.query_cached("kratos_user_id", self.kratos_user_id)
+
+    def query_cached(self, field: str, value: str) -> Optional[Record]:
+        """Loads the user whose `field` is `value`, from `conn.user_cache`
+        when it is there
+        """
+        cache = self.conn.user_cache
+        if cache is not None:
+            node = cache.get(field, value)
+            if node is not None:
+                self.db_obj = node
+                self.sync_properties()
+                return self.db_obj
+            token = cache.token()
+        queryStr = f"MATCH (n:{User._label_name}) WHERE n.{field}=$value RETURN n"
+        with self.conn.session() as session:
+            res = session.run(queryStr, {"value": value})
             self.db_obj = self.extract_node(res)
             self.sync_properties()
+        if cache is not None and self._db_obj is not None:
+            cache.fill(self._db_obj, token)
         return self.db_obj
 
+    def invalidate_cache(self, *properties: Dict[str, Any]) -> None:
+        """Drops this user from `conn.user_cache`, by its uid, its current
+        keys and those in `properties`. Again once the unit of work commits,
+        in case another request cached it in the meantime.
+        """
+        cache = self.conn.user_cache
+        if cache is None:
+            return
+        keys = list(properties) + [
+            dict(self._properties),
+            {"username": self.username, "kratos_user_id": self.kratos_user_id},
+        ]
+        uid = self.uid
+        cache.invalidate(keys, uid)
+        unit_of_work = current_unit_of_work()
+        if unit_of_work is not None:
+            unit_of_work.after_commit(lambda: cache.invalidate(keys, uid))
+
     def create(self):  # create a new User in the database
-        super().create(User._label_name)
-        self.set("kratos_user_id", self.kratos_user_id)
-        if self.username != None:
-            self.set("username", self.username)
+        super().create(
+            User._label_name,
+            {
+                "kratos_user_id": self.kratos_user_id,
+                "username": self.username,
+            },
+        )
+        self.invalidate_cache()
+        return self.db_obj
 
+    def patch(self, properties: Mapping[str, Any]) -> Optional[Record]:
+        before = dict(self._properties)
+        self.invalidate_cache()
+        super().patch(properties)
+        self.invalidate_cache(before)
         return self.db_obj
 
+    def delete(self) -> None:
+        self.invalidate_cache()
+        super().delete()
+
     def delete_uid(self):  # delete a user by ID
         queryStr = (
             f"MATCH (n:{User._label_name}) WHERE id(n)=$uid DETACH DELETE n"
         )
 
-        self.db_conn.session().run(queryStr, {"uid": self.uid})
+        self.invalidate_cache()
+        with self.conn.session() as session:
+            session.run(queryStr, {"uid": self.uid})
         self.db_obj = None
 
     def delete_username(self):  # delete a user by username
         queryStr = f"MATCH (n:{User._label_name}) WHERE n.username=$username DETACH DELETE n"
-        self.db_conn.session().run(queryStr, {"username": self.username})
+        self.invalidate_cache()
+        with self.conn.session() as session:
+            session.run(queryStr, {"username": self.username})
         self.db_obj = None
 
     def delete_kratos_user_id(self):
         queryStr = f"MATCH (n:{User._label_name}) WHERE n.kratos_user_id=$kratos_user_id DETACH DELETE n"
-        self.db_conn.session().run(queryStr, {"username": self.username})
+        self.invalidate_cache()
+        with self.conn.session() as session:
+            session.run(
+                queryStr, {"kratos_user_id": self.kratos_user_id}
+            )
         self.db_obj = None
 
     def save(self):  # save python object information to database
@@ -0,0 +1,411 @@
+# ordered lists of edit operations on one project, run in the request's
+# unit of work so they commit or roll back together. Consecutive
+# operations of the same kind share one UNWIND statement.
+#
+#   {"op": "create_node", "ref": "a", "properties": {"name": "x"}}
+#   {"op": "create_relationship", "ref": "e", "a": "a", "b": 12}
+#   {"op": "add_tag", "resource": "a", "tag": 7}
+#
+# Ids are uids (ints) or the `ref` (a string) of an earlier create.
+# A batch whose prereqs would end up in a cycle is refused as a whole.
+
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from twig_server.database.connection import Neo4jConnection
+from twig_server.database.native import Node, Relationship
+from twig_server.database.prereq_graph import PrereqGraphs
+from twig_server.database.Project import Project
+from twig_server.database.Resource import Resource
+from twig_server.database.Tag import Tag
+
+
+class BatchError(ValueError):
+    def __init__(self, index: int, message: str, status: int = 404) -> None:
+        """Operation `index` cannot run, nothing of the batch is kept
+        :param status:
+            404 for bad operations, 401 for uids outside the project
+        """
+        super().__init__(f"operation {index}: {message}")
+        self.index = index
+        self.status = status
+
+
+_project_match = f"MATCH (p:{Project._label_name}) WHERE id(p)=$uid "
+_resource = Resource._label_name
+_tag = Tag._label_name
+_prereq = Resource._label_prereq_relationship
+_tag_link = Tag._label_resource_relationship
+
+# op -> (id fields with the kind they refer to, kind it creates or None,
+#        change log op and kind, statement run for a list of $rows)
+OPERATIONS: Dict[str, Any] = {
+    "create_node": (
+        {},
+        "resource",
+        ("created", "resource"),
+        _project_match
+        + f"UNWIND $rows AS row \
+        CREATE (p)-[:{Resource._label_project_relationship}]->(n:{_resource}) \
+        SET n = row.properties \
+        RETURN row.index AS index, n AS entity",
+    ),
+    "edit_resource": (
+        {"resource": "resource"},
+        None,
+        ("updated", "resource"),
+        f"UNWIND $rows AS row \
+        MATCH (n:{_resource}) WHERE id(n)=row.resource \
+        SET n += row.properties \
+        RETURN row.index AS index, n AS entity",
+    ),
+    "delete_resource": (
+        {"resource": "resource"},
+        None,
+        ("deleted", "resource"),
+        f"UNWIND $rows AS row \
+        MATCH (n:{_resource}) WHERE id(n)=row.resource \
+        WITH row, n, id(n) AS uid \
+        DETACH DELETE n \
+        RETURN row.index AS index, uid",
+    ),
+    "create_relationship": (
+        {"a": "resource", "b": "resource"},
+        "relationship",
+        ("created", "relationship"),
+        f"UNWIND $rows AS row \
+        MATCH (a:{_resource}) WHERE id(a)=row.a \
+        MATCH (b:{_resource}) WHERE id(b)=row.b \
+        CREATE (a)-[e:{_prereq}]->(b) \
+        SET e = row.properties \
+        RETURN row.index AS index, e AS entity",
+    ),
+    "edit_relationship": (
+        {"relationship": "relationship"},
+        None,
+        ("updated", "relationship"),
+        f"UNWIND $rows AS row \
+        MATCH ()-[e:{_prereq}]->() WHERE id(e)=row.relationship \
+        SET e += row.properties \
+        RETURN row.index AS index, e AS entity",
+    ),
+    "delete_relationship": (
+        {"relationship": "relationship"},
+        None,
+        ("deleted", "relationship"),
+        f"UNWIND $rows AS row \
+        MATCH ()-[e:{_prereq}]->() WHERE id(e)=row.relationship \
+        WITH row, e, id(e) AS uid \
+        DELETE e \
+        RETURN row.index AS index, uid",
+    ),
+    "create_tag": (
+        {},
+        "tag",
+        ("created", "tag"),
+        _project_match
+        + f"UNWIND $rows AS row \
+        CREATE (p)-[:{Tag._label_project_relationship}]->(t:{_tag}) \
+        SET t = row.properties \
+        RETURN row.index AS index, t AS entity",
+    ),
+    "update_tag": (
+        {"tag": "tag"},
+        None,
+        ("updated", "tag"),
+        f"UNWIND $rows AS row \
+        MATCH (t:{_tag}) WHERE id(t)=row.tag \
+        SET t += row.properties \
+        RETURN row.index AS index, t AS entity",
+    ),
+    "delete_tag": (
+        {"tag": "tag"},
+        None,
+        ("deleted", "tag"),
+        f"UNWIND $rows AS row \
+        MATCH (t:{_tag}) WHERE id(t)=row.tag \
+        WITH row, t, id(t) AS uid \
+        DETACH DELETE t \
+        RETURN row.index AS index, uid",
+    ),
+    "add_tag": (
+        {"resource": "resource", "tag": "tag"},
+        None,
+        ("created", "tag_link"),
+        f"UNWIND $rows AS row \
+        MATCH (r:{_resource}) WHERE id(r)=row.resource \
+        MATCH (t:{_tag}) WHERE id(t)=row.tag \
+        MERGE (r)-[e:{_tag_link}]->(t) \
+        RETURN row.index AS index, id(e) AS uid",
+    ),
+    "dissociate_tag": (
+        {"resource": "resource", "tag": "tag"},
+        None,
+        ("deleted", "tag_link"),
+        f"UNWIND $rows AS row \
+        MATCH (r:{_resource})-[e:{_tag_link}]->(t:{_tag}) \
+        WHERE id(r)=row.resource AND id(t)=row.tag \
+        WITH row, e, id(e) AS uid \
+        DELETE e \
+        RETURN row.index AS index, uid",
+    ),
+}
+
+# properties a create starts with, as the single item routes do
+DEFAULTS: Dict[str, Dict[str, Any]] = {
+    "create_node": {
+        "name": "Untitled Resource",
+        "description": "default description",
+    },
+    "create_tag": {
+        "name": "Empty Tag",
+        "description": "default tag description",
+        "color": "pink",
+        "priority": 0,
+    },
+    "create_relationship": {},
+}
+
+
+class ProjectBatch:
+    def __init__(
+        self,
+        conn: Neo4jConnection,
+        project: Project,
+        prereq_graphs: Optional[PrereqGraphs] = None,
+    ) -> None:
+        """Runs operations on an (authorized) project, see `run`
+        :param conn:
+            Neo4J connection
+        :param prereq_graphs:
+            graphs to check new prereqs for cycles against, without them
+            prereqs are not checked
+        """
+        self.conn = conn
+        self.project = project
+        self.prereq_graphs = prereq_graphs
+        # uid -> (operation, a, b) of created prereqs, uids of deleted
+        # ones and of deleted resources
+        self.new_prereqs: Dict[int, Tuple[int, int, int]] = {}
+        self.removed_prereqs: List[int] = []
+        self.removed_resources: List[int] = []
+        self.refs: Dict[str, Any] = {}  # ref -> (kind, uid)
+        self.results: List[Optional[Dict[str, Any]]] = []
+        self.changes: List[Dict[str, Any]] = []
+        self.statements: int = 0
+        self.pending_op: Optional[str] = None
+        self.pending_rows: List[Dict[str, Any]] = []
+        self.pending_refs: Set[str] = set()
+
+    def run(self, operations: List[Any]) -> None:
+        """Checks every operation, then runs them in order
+        :raises BatchError:
+            the caller has to roll back the unit of work
+        """
+        refs: Set[str] = set()
+        for index, operation in enumerate(operations):
+            self.check(index, operation, refs)
+        self.check_uids(operations)
+        graph = None
+        if self.prereq_graphs is not None and any(
+            operation["op"] == "create_relationship"
+            for operation in operations
+        ):
+            # locked so concurrent prereqs cannot both pass the check, and
+            # read before the batch writes, so the cached graph never
+            # holds prereqs of a batch that is rolled back
+            self.project.lock()
+            graph = self.prereq_graphs.get(self.project)
+        self.results = [None] * len(operations)
+        for index, operation in enumerate(operations):
+            self.add(index, operation)
+        self.flush()
+        if graph is not None:
+            new_prereqs = list(self.new_prereqs.values())
+            closing = graph.check_edges(
+                [(a, b) for _, a, b in new_prereqs],
+                self.removed_prereqs,
+                self.removed_resources,
+            )
+            if closing is not None:
+                raise BatchError(
+                    new_prereqs[closing][0], "would close a prereq cycle"
+                )
+
+    def check(self, index: int, operation: Any, refs: Set[str]) -> None:
+        if (
+            not isinstance(operation, dict)
+            or operation.get("op") not in OPERATIONS
+        ):
+            raise BatchError(index, "unknown op")
+        fields, creates, _, _ = OPERATIONS[operation["op"]]
+        for field in fields:
+            value = operation.get(field)
+            if type(value) not in (int, str):
+                raise BatchError(index, f"{field} must be a uid or a ref")
+        ref = operation.get("ref")
+        if ref is not None:
+            if creates is None or not isinstance(ref, str):
+                raise BatchError(index, "only creates take a ref")
+            if ref in refs:
+                raise BatchError(index, f"ref {ref!r} is used twice")
+            refs.add(ref)
+        properties = operation.get("properties", {})
+        if not isinstance(properties, dict) or "uid" in properties:
+            raise BatchError(index, "properties must be an object without uid")
+        try:
+            Node.check_patch(properties)
+        except ValueError as e:
+            raise BatchError(index, str(e))
+
+    def check_uids(self, operations: List[Any]) -> None:
+        """One statement checking that every uid (not ref) in the batch
+        belongs to the project
+        """
+        wanted: Dict[Any, int] = {}  # (kind, uid) -> first operation
+        for index, operation in enumerate(operations):
+            fields = OPERATIONS[operation["op"]][0]
+            for field, kind in fields.items():
+                value = operation[field]
+                if isinstance(value, int):
+                    wanted.setdefault((kind, value), index)
+        if not wanted:
+            return
+        # one row per uid, so each is looked up by id rather than by
+        # expanding the whole project
+        queryStr = (
+            _project_match
+            + f"UNWIND $wanted AS w \
+            OPTIONAL MATCH (p)-[:{Resource._label_project_relationship}]->\
+                (r:{_resource}) \
+            WHERE w.kind = 'resource' AND id(r) = w.uid \
+            OPTIONAL MATCH (p)-[:{Tag._label_project_relationship}]->(t:{_tag}) \
+            WHERE w.kind = 'tag' AND id(t) = w.uid \
+            OPTIONAL MATCH (p)-[:{Resource._label_project_relationship}]->\
+                (:{_resource})-[e:{_prereq}]->(:{_resource}) \
+            WHERE w.kind = 'relationship' AND id(e) = w.uid \
+            WITH w, r, t, e WHERE r IS NULL AND t IS NULL AND e IS NULL \
+            RETURN w.kind AS kind, w.uid AS uid"
+        )
+        assert self.project.uid is not None
+        with self.conn.session() as session:
+            missing = [
+                (row["kind"], row["uid"])
+                for row in session.run(
+                    queryStr,
+                    {
+                        "uid": int(self.project.uid),
+                        "wanted": [
+                            {"kind": kind, "uid": uid} for kind, uid in wanted
+                        ],
+                    },
+                )
+            ]
+        self.statements += 1
+        if missing:
+            kind, uid = min(missing, key=lambda key: wanted[key])
+            raise BatchError(
+                wanted[(kind, uid)], f"{kind} {uid} not in project", 401
+            )
+
+    def resolve(self, index: int, kind: str, value: Any) -> int:
+        if isinstance(value, int):
+            return value
+        if value in self.pending_refs:
+            # created by the statement being assembled
+            self.flush()
+        if value not in self.refs:
+            raise BatchError(index, f"unknown ref {value!r}")
+        ref_kind, uid = self.refs[value]
+        if ref_kind != kind:
+            raise BatchError(index, f"ref {value!r} is a {ref_kind}")
+        return uid
+
+    def add(self, index: int, operation: Dict[str, Any]) -> None:
+        op = operation["op"]
+        fields = OPERATIONS[op][0]
+        row: Dict[str, Any] = {"index": index}
+        for field, kind in fields.items():
+            row[field] = self.resolve(index, kind, operation[field])
+        properties = operation.get("properties", {})
+        if op in DEFAULTS:
+            properties = {**DEFAULTS[op], **properties}
+            properties = {
+                key: value
+                for key, value in properties.items()
+                if value is not None
+            }
+        row["properties"] = properties
+        row["ref"] = operation.get("ref")
+        if self.pending_op != op:
+            self.flush()
+            self.pending_op = op
+        self.pending_rows.append(row)
+        if row["ref"] is not None:
+            self.pending_refs.add(row["ref"])
+
+    def flush(self) -> None:
+        op, rows = self.pending_op, self.pending_rows
+        self.pending_op = None
+        self.pending_rows = []
+        self.pending_refs = set()
+        if op is None or not rows:
+            return
+        fields, creates, (change_op, change_kind), queryStr = OPERATIONS[op]
+        assert self.project.uid is not None
+        with self.conn.session() as session:
+            res = session.run(
+                queryStr, {"uid": int(self.project.uid), "rows": rows}
+            )
+            found = {record["index"]: record for record in res}
+        self.statements += 1
+        for row in rows:
+            record = found.get(row["index"])
+            if record is None:
+                raise BatchError(row["index"], "not found")
+            self.done(op, row, record, creates, change_op, change_kind)
+
+    def done(
+        self,
+        op: str,
+        row: Dict[str, Any],
+        record: Any,
+        creates: Optional[str],
+        change_op: str,
+        change_kind: str,
+    ) -> None:
+        """Stores the result of the operation in `row` and its change entry"""
+        entity = record.get("entity") if "entity" in record.keys() else None
+        if entity is None:
+            result: Dict[str, Any] = {"uid": record["uid"]}
+        elif op in ("create_relationship", "edit_relationship"):
+            result = Relationship.extract_properties(entity)
+        else:
+            result = Node.extract_properties(entity)
+        if creates is not None and row["ref"] is not None:
+            self.refs[row["ref"]] = (creates, result["uid"])
+        self.results[row["index"]] = result
+        if op == "create_relationship":
+            self.new_prereqs[result["uid"]] = (
+                row["index"],
+                row["a"],
+                row["b"],
+            )
+        elif op == "delete_relationship":
+            if self.new_prereqs.pop(result["uid"], None) is None:
+                self.removed_prereqs.append(result["uid"])
+        elif op == "delete_resource":
+            self.removed_resources.append(result["uid"])
+        if change_kind == "tag_link":
+            data: Optional[Dict[str, Any]] = {
+                "resource": row["resource"],
+                "tag": row["tag"],
+            }
+        elif op == "create_relationship":
+            data = {"a": row["a"], "b": row["b"], "properties": result}
+        elif change_op == "deleted":
+            data = None
+        else:
+            data = result
+        self.changes.append(
+            Project.change_entry(change_op, change_kind, result["uid"], data)
+        )
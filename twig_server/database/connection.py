@@ -1,20 +1,328 @@
 import os
-from typing import Optional
+import threading
+import time
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
 
-from neo4j import GraphDatabase, Neo4jDriver
+from neo4j import GraphDatabase, Neo4jDriver, Result, ResultSummary
 import twig_server.app as app
 
+
+class PoolStatistics:
+    def __init__(self) -> None:
+        """Counts connection acquisitions from a driver's connection pool"""
+        self.lock = threading.Lock()
+        self.acquisitions: int = 0
+        self.acquisition_failures: int = 0
+        self.acquisition_time_total: float = 0.0  # seconds
+        self.acquisition_time_max: float = 0.0  # seconds
+
+    def record(self, seconds: float, failed: bool = False) -> None:
+        with self.lock:
+            if failed:
+                self.acquisition_failures += 1
+            else:
+                self.acquisitions += 1
+            self.acquisition_time_total += seconds
+            self.acquisition_time_max = max(self.acquisition_time_max, seconds)
+
+    def instrument(self, pool: Any) -> bool:
+        """Wraps `pool.acquire` to time every acquisition. `acquire` is not
+        public driver API, pools without it are left alone.
+        :returns:
+            whether the pool is instrumented
+        """
+        acquire = getattr(pool, "acquire", None)
+        if not callable(acquire):
+            return False
+
+        def timed_acquire(*args: Any, **kwargs: Any) -> Any:
+            start = time.perf_counter()
+            try:
+                connection = acquire(*args, **kwargs)
+            except Exception:
+                self.record(time.perf_counter() - start, failed=True)
+                raise
+            self.record(time.perf_counter() - start)
+            return connection
+
+        pool.acquire = timed_acquire
+        return True
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            attempts = self.acquisitions + self.acquisition_failures
+            return {
+                "acquisitions": self.acquisitions,
+                "acquisition_failures": self.acquisition_failures,
+                "acquisition_time_avg_ms": (
+                    1000 * self.acquisition_time_total / attempts
+                    if attempts else 0.0
+                ),
+                "acquisition_time_max_ms": 1000 * self.acquisition_time_max,
+            }
+
+
+# called after every statement with
+# (query, parameters, seconds, result or None, exception or None)
+QueryListener = Callable[
+    [str, Mapping[str, Any], float, Any, Optional[BaseException]], None
+]
+
+
+# called once the statement's result is consumed with
+# (query, parameters, seconds until consumed, rows handed out, summary)
+SummaryListener = Callable[
+    [str, Mapping[str, Any], float, int, Optional[ResultSummary]], None
+]
+
+
+class TrackedResult:
+    def __init__(self, result: Result, start: float) -> None:
+        """Wraps a neo4j `Result`, counting the records handed out and
+        noting when the result was exhausted
+        :param start:
+            `time.perf_counter()` when the statement was sent
+        """
+        self.result = result
+        self.start = start
+        self.finished: Optional[float] = None
+        self.rows: int = 0
+
+    def finish(self) -> float:
+        """Notes when the result was exhausted, the first call counts"""
+        if self.finished is None:
+            self.finished = time.perf_counter()
+        return self.finished
+
+    def __iter__(self):
+        for record in self.result:
+            self.rows += 1
+            yield record
+        self.finish()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.result, name)
+
+    def single(self):
+        record = self.result.single()
+        if record is not None:
+            self.rows += 1
+        self.finish()
+        return record
+
+    def data(self, *keys: Any):
+        records = self.result.data(*keys)
+        self.rows += len(records)
+        self.finish()
+        return records
+
+    def values(self, *keys: Any):
+        records = self.result.values(*keys)
+        self.rows += len(records)
+        self.finish()
+        return records
+
+    def consume(self) -> ResultSummary:
+        summary = self.result.consume()
+        self.finish()
+        return summary
+
+
+class InstrumentedSession:
+    def __init__(
+        self,
+        session: Any,
+        listeners: List[QueryListener],
+        summary_listeners: List[SummaryListener],
+    ) -> None:
+        """Wraps a neo4j session (or unit of work session) and reports every
+        `run` to `listeners`. Everything else is passed through.
+        If there are `summary_listeners`, results are tracked and consumed
+        when the `with` block ends so their summaries can be reported.
+        """
+        self.session = session
+        self.listeners = listeners
+        self.summary_listeners = summary_listeners
+        self.tracked: List[Tuple[str, Mapping[str, Any], TrackedResult]] = []
+
+    def __enter__(self) -> "InstrumentedSession":
+        self.session.__enter__()
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        try:
+            self.report_summaries()
+        finally:
+            suppress = self.session.__exit__(
+                exception_type, exception_value, traceback
+            )
+        return suppress
+
+    def report_summaries(self) -> None:
+        for query, parameters, result in self.tracked:
+            try:
+                summary = result.consume()
+            except Exception:
+                summary = None
+            seconds = result.finish() - result.start
+            for listener in self.summary_listeners:
+                listener(query, parameters, seconds, result.rows, summary)
+        self.tracked = []
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.session, name)
+
+    def run(
+        self,
+        query: str,
+        parameters: Optional[Mapping[str, Any]] = None,
+        **kwparameters: Any
+    ) -> Any:
+        parameters = dict(parameters or {}, **kwparameters)
+        result = None
+        error = None
+        start = time.perf_counter()
+        try:
+            result = self.session.run(query, parameters)
+            if self.summary_listeners:
+                result = TrackedResult(result, start)
+                self.tracked.append((query, parameters, result))
+            return result
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            for listener in self.listeners:
+                listener(query, parameters, seconds, result, error)
+
+
 class Neo4jConnection:
-    def __init__(self, username: str, password: str, url: str) -> None:
+    def __init__(
+        self,
+        username: str,
+        password: str,
+        url: str,
+        routing: Optional[bool] = None,
+        **driver_config: Any
+    ) -> None:
+        """
+        :param routing:
+            `True` connects with the routing `neo4j://` scheme, so reads
+            can go to followers and read replicas, `False` with the direct
+            `bolt://` scheme. `None` keeps the scheme of `url`.
+        :param driver_config:
+            passed on to `GraphDatabase.driver`, e.g. `max_connection_pool_size`,
+            `connection_acquisition_timeout`, `max_connection_lifetime`,
+            `keep_alive` and `fetch_size`. `None` values keep the driver default.
+        """
         self.username: str = username
         self.password: str = password
         self.url: str = url
+        self.routing: Optional[bool] = routing
+        self.driver_config: Dict[str, Any] = {
+            key: value
+            for key, value in driver_config.items()
+            if value is not None
+        }
         self.conn: Optional[Neo4jDriver] = None
+        self.pool_statistics: PoolStatistics = PoolStatistics()
+        self.query_listeners: List[QueryListener] = []
+        self.summary_listeners: List[SummaryListener] = []
+        # UserCache, see twig_server/database/user_cache.py
+        self.user_cache: Optional[Any] = None
+
+    def add_query_listener(self, listener: QueryListener) -> None:
+        self.query_listeners.append(listener)
+
+    def remove_query_listener(self, listener: QueryListener) -> None:
+        self.query_listeners.remove(listener)
+
+    def add_summary_listener(self, listener: SummaryListener) -> None:
+        self.summary_listeners.append(listener)
 
     def connect(self) -> None:
+        if not self.url:
+            raise ValueError(
+                "NEO4J_SERVER_URL is not set, e.g. bolt://localhost:7687, "
+                "or memory:// for the in-memory graph"
+            )
+        if self.url.startswith("memory://"):
+            # imported here since memory is only needed without a server
+            from twig_server.database.memory import MemoryDriver
+
+            self.conn = MemoryDriver()
+            return
         self.conn = GraphDatabase.driver(
-            self.url, auth=(self.username, self.password)
+            self.driver_url(), auth=(self.username, self.password), **self.driver_config
         )
+        pool = getattr(self.conn, "_pool", None)
+        if pool is not None:
+            self.pool_statistics.instrument(pool)
+
+    def driver_url(self) -> str:
+        """`url` with the scheme `routing` asks for, `+s`/`+ssc` kept"""
+        scheme, sep, rest = self.url.partition("://")
+        base, plus, security = scheme.partition("+")
+        if self.routing is None or base not in ("bolt", "neo4j"):
+            return self.url
+        base = "neo4j" if self.routing else "bolt"
+        return f"{base}{plus}{security}{sep}{rest}"
+
+    def session(self):
+        """Session to run queries with. While handling a request this is
+        the request's unit of work, otherwise a new driver session.
+        """
+        # imported here since unit_of_work depends on this module
+        from twig_server.database.unit_of_work import current_unit_of_work
+
+        unit_of_work = current_unit_of_work()
+        if unit_of_work is None or unit_of_work.conn is not self:
+            return self.driver_session()
+        return self.instrument(unit_of_work.session())
+
+    def driver_session(self, **config: Any):
+        """New driver session outside any unit of work, e.g. to stream a
+        response after the request's transaction has committed
+        :param config:
+            passed on to the driver's `session`, e.g. `default_access_mode`
+        """
+        assert self.conn is not None
+        return self.instrument(self.conn.session(**config))
+
+    def instrument(self, session: Any) -> Any:
+        if not self.query_listeners and not self.summary_listeners:
+            return session
+        return InstrumentedSession(
+            session, self.query_listeners, self.summary_listeners
+        )
+
+    def pool_status(self) -> Dict[str, Any]:
+        """In use and idle connections per server, plus acquisition timings.
+        The pool internals read here are not public driver API, `servers`
+        stays empty when they are missing.
+        """
+        servers = {}
+        pool = getattr(self.conn, "_pool", None)
+        lock = getattr(pool, "lock", None)
+        pool_connections = getattr(pool, "connections", None)
+        if lock is not None and isinstance(pool_connections, dict):
+            with lock:
+                for address, connections in pool_connections.items():
+                    in_use = sum(
+                        1 for c in connections if getattr(c, "in_use", False)
+                    )
+                    servers[str(address)] = {
+                        "in_use": in_use,
+                        "idle": len(connections) - in_use,
+                    }
+        return {
+            "config": self.driver_config,
+            "in_use": sum(s["in_use"] for s in servers.values()),
+            "idle": sum(s["idle"] for s in servers.values()),
+            "servers": servers,
+            **self.pool_statistics.snapshot(),
+        }
 
     def verify_connectivity(self):
         self.conn.verify_connectivity()
@@ -0,0 +1,2246 @@
+# in-memory stand-in for a Neo4j server, selected with NEO4J_SERVER_URL=memory://
+# holds a property graph with indexed adjacency and interprets the cypher
+# subset this server issues, so the python side can be tested and profiled
+# without a database. Transactions can be rolled back but are not isolated
+# from each other; every statement runs under one lock. Like a server,
+# READ_ACCESS sessions and read transaction functions refuse writes.
+
+import re
+import threading
+import time
+from collections import deque
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    NoReturn,
+    Optional,
+    Tuple,
+)
+
+from neo4j import READ_ACCESS, Record
+from neo4j.exceptions import ClientError, ConstraintError, CypherSyntaxError
+from neo4j.graph import Graph
+from neo4j.work.summary import SummaryCounters
+
+READ_ACCESS_ERROR = "Writing in read access mode not allowed"
+
+AGGREGATES = {"count", "collect", "sum", "min", "max", "avg"}
+
+
+class MemoryNode:
+    __slots__ = ("id", "labels", "properties")
+
+    def __init__(self, id: int, labels: set, properties: dict) -> None:
+        self.id = id
+        self.labels = labels
+        self.properties = properties
+
+
+class MemoryRelationship:
+    __slots__ = ("id", "type", "start", "end", "properties")
+
+    def __init__(
+        self, id: int, type: str, start: int, end: int, properties: dict
+    ) -> None:
+        self.id = id
+        self.type = type
+        self.start = start
+        self.end = end
+        self.properties = properties
+
+
+class Changes:
+    def __init__(self) -> None:
+        """Undo log and update counters of one statement or transaction"""
+        self.undo: List[Callable[[], None]] = []
+        self.stats: Dict[str, int] = {}
+
+    def count(self, key: str, n: int = 1) -> None:
+        self.stats[key] = self.stats.get(key, 0) + n
+
+    def extend(self, other: "Changes") -> None:
+        self.undo.extend(other.undo)
+        for key, n in other.stats.items():
+            self.count(key, n)
+
+    def rollback(self) -> None:
+        while self.undo:
+            self.undo.pop()()
+
+
+class MemoryGraph:
+    def __init__(self) -> None:
+        """Property graph. Dicts with `None` values are used as ordered sets,
+        so scans return entities in creation order.
+        """
+        self.lock = threading.RLock()
+        self.nodes: Dict[int, MemoryNode] = {}
+        self.relationships: Dict[int, MemoryRelationship] = {}
+        # node id -> relationship type -> relationship ids
+        self.outgoing: Dict[int, Dict[str, Dict[int, None]]] = {}
+        self.incoming: Dict[int, Dict[str, Dict[int, None]]] = {}
+        # label -> node ids
+        self.labels: Dict[str, Dict[int, None]] = {}
+        # (label, property) -> index key of the value -> node ids
+        self.indexes: Dict[Tuple[str, str], Dict[Any, Dict[int, None]]] = {}
+        self.unique: set = set()  # (label, property) with a constraint
+        self.schema_names: Dict[str, Tuple[str, str]] = {}
+        self.next_id: int = 0
+
+    def allocate_id(self) -> int:
+        self.next_id += 1
+        return self.next_id - 1
+
+    def create_node(
+        self, labels: List[str], properties: dict, changes: Changes
+    ) -> MemoryNode:
+        node = MemoryNode(self.allocate_id(), set(), {})
+        self.nodes[node.id] = node
+        self.outgoing[node.id] = {}
+        self.incoming[node.id] = {}
+        changes.undo.append(lambda: self.remove_node(node))
+        changes.count("nodes-created")
+        for label in labels:
+            self.add_label(node, label, changes)
+        for key, value in properties.items():
+            self.set_property(node, key, value, changes)
+        return node
+
+    def remove_node(self, node: MemoryNode) -> None:
+        self.unindex(node, node.labels, node.properties)
+        del self.nodes[node.id]
+        del self.outgoing[node.id]
+        del self.incoming[node.id]
+        for label in node.labels:
+            del self.labels[label][node.id]
+
+    def restore_node(self, node: MemoryNode) -> None:
+        self.nodes[node.id] = node
+        self.outgoing[node.id] = {}
+        self.incoming[node.id] = {}
+        for label in node.labels:
+            self.labels.setdefault(label, {})[node.id] = None
+        self.index(node, node.labels, node.properties)
+
+    def delete_node(
+        self, node: MemoryNode, detach: bool, changes: Changes
+    ) -> None:
+        if node.id not in self.nodes:
+            return  # already deleted by an earlier row
+        attached = [
+            rel_id
+            for adjacency in (self.outgoing[node.id], self.incoming[node.id])
+            for rel_ids in adjacency.values()
+            for rel_id in rel_ids
+        ]
+        if attached and not detach:
+            raise ClientError(
+                f"Cannot delete node<{node.id}>, because it still has "
+                "relationships. To delete this node, you must first delete "
+                "its relationships."
+            )
+        for rel_id in attached:
+            if rel_id in self.relationships:
+                self.delete_relationship(self.relationships[rel_id], changes)
+        self.remove_node(node)
+        changes.undo.append(lambda: self.restore_node(node))
+        changes.count("nodes-deleted")
+
+    def create_relationship(
+        self,
+        type: str,
+        start: MemoryNode,
+        end: MemoryNode,
+        properties: dict,
+        changes: Changes,
+    ) -> MemoryRelationship:
+        rel = MemoryRelationship(
+            self.allocate_id(), type, start.id, end.id, {}
+        )
+        self.link(rel)
+        changes.undo.append(lambda: self.unlink(rel))
+        changes.count("relationships-created")
+        for key, value in properties.items():
+            self.set_property(rel, key, value, changes)
+        return rel
+
+    def link(self, rel: MemoryRelationship) -> None:
+        self.relationships[rel.id] = rel
+        self.outgoing[rel.start].setdefault(rel.type, {})[rel.id] = None
+        self.incoming[rel.end].setdefault(rel.type, {})[rel.id] = None
+
+    def unlink(self, rel: MemoryRelationship) -> None:
+        del self.relationships[rel.id]
+        del self.outgoing[rel.start][rel.type][rel.id]
+        del self.incoming[rel.end][rel.type][rel.id]
+
+    def delete_relationship(
+        self, rel: MemoryRelationship, changes: Changes
+    ) -> None:
+        if rel.id not in self.relationships:
+            return
+        self.unlink(rel)
+        changes.undo.append(lambda: self.link(rel))
+        changes.count("relationships-deleted")
+
+    def set_property(
+        self, entity: Any, key: str, value: Any, changes: Changes
+    ) -> None:
+        values = value if isinstance(value, list) else [value]
+        if any(isinstance(item, (dict, list)) for item in values):
+            # neo4j only stores scalars and homogeneous lists of them
+            raise ClientError(
+                f"Property values can only be of primitive types or arrays "
+                f"thereof. Encountered: {value!r}."
+            )
+        old = entity.properties.get(key)
+        if value is None and old is None:
+            return
+        if isinstance(entity, MemoryNode):
+            if value is not None:
+                self.check_unique(entity, entity.labels, {key: value})
+            self.write_property(entity, key, value)
+            changes.undo.append(lambda: self.write_property(entity, key, old))
+        else:
+            self.write_relationship_property(entity, key, value)
+            changes.undo.append(
+                lambda: self.write_relationship_property(entity, key, old)
+            )
+        changes.count("properties-set")
+
+    def write_property(self, node: MemoryNode, key: str, value: Any) -> None:
+        old = node.properties.get(key)
+        if old is not None:
+            self.unindex(node, node.labels, {key: old})
+            del node.properties[key]
+        if value is not None:
+            node.properties[key] = value
+            self.index(node, node.labels, {key: value})
+
+    def write_relationship_property(
+        self, rel: MemoryRelationship, key: str, value: Any
+    ) -> None:
+        if value is None:
+            rel.properties.pop(key, None)
+        else:
+            rel.properties[key] = value
+
+    def add_label(
+        self, node: MemoryNode, label: str, changes: Changes
+    ) -> None:
+        if label in node.labels:
+            return
+        self.check_unique(node, {label}, node.properties)
+        self.write_label(node, label, True)
+        changes.undo.append(lambda: self.write_label(node, label, False))
+        changes.count("labels-added")
+
+    def remove_label(
+        self, node: MemoryNode, label: str, changes: Changes
+    ) -> None:
+        if label not in node.labels:
+            return
+        self.write_label(node, label, False)
+        changes.undo.append(lambda: self.write_label(node, label, True))
+        changes.count("labels-removed")
+
+    def write_label(self, node: MemoryNode, label: str, present: bool) -> None:
+        if present:
+            node.labels.add(label)
+            self.labels.setdefault(label, {})[node.id] = None
+            self.index(node, {label}, node.properties)
+        else:
+            self.unindex(node, {label}, node.properties)
+            node.labels.discard(label)
+            self.labels[label].pop(node.id, None)
+
+    # schema
+    def index(self, node: MemoryNode, labels: Any, properties: dict) -> None:
+        for label in labels:
+            for key, value in properties.items():
+                index = self.indexes.get((label, key))
+                if index is not None:
+                    index.setdefault(index_key(value), {})[node.id] = None
+
+    def unindex(self, node: MemoryNode, labels: Any, properties: dict) -> None:
+        for label in labels:
+            for key, value in properties.items():
+                index = self.indexes.get((label, key))
+                if index is not None:
+                    index.get(index_key(value), {}).pop(node.id, None)
+
+    def lookup(self, label: str, key: str, value: Any) -> Optional[List[int]]:
+        """Ids of `label` nodes whose `key` may equal `value`,
+        `None` without an index
+        """
+        index = self.indexes.get((label, key))
+        if index is None:
+            return None
+        return list(index.get(index_key(value), ()))
+
+    def check_unique(
+        self, node: MemoryNode, labels: Any, properties: dict
+    ) -> None:
+        for label in labels:
+            for key, value in properties.items():
+                if (label, key) not in self.unique:
+                    continue
+                owners = self.indexes[(label, key)].get(index_key(value), {})
+                if any(uid != node.id for uid in owners):
+                    raise ConstraintError(
+                        f"Node({next(iter(owners))}) already exists with "
+                        f"label `{label}` and property `{key}` = {value!r}"
+                    )
+
+    def create_index(
+        self,
+        name: Optional[str],
+        label: str,
+        key: str,
+        unique: bool,
+        if_not_exists: bool,
+    ) -> bool:
+        """Returns whether the index or constraint was added"""
+        exists = (label, key) in (self.unique if unique else self.indexes)
+        if name is not None and name in self.schema_names:
+            exists = True
+        if exists:
+            if if_not_exists:
+                return False
+            raise ClientError(
+                f"An equivalent {'constraint' if unique else 'index'} "
+                f"already exists for :{label}({key})"
+            )
+        index: Dict[Any, Dict[int, None]] = {}
+        for uid in self.labels.get(label, {}):
+            value = self.nodes[uid].properties.get(key)
+            if value is None:
+                continue
+            owners = index.setdefault(index_key(value), {})
+            if unique and owners:
+                raise ConstraintError(
+                    f"Unable to create constraint, Node({next(iter(owners))}) "
+                    f"and Node({uid}) have the same `{key}` {value!r}"
+                )
+            owners[uid] = None
+        self.indexes.setdefault((label, key), index)
+        if unique:
+            self.unique.add((label, key))
+        if name is not None:
+            self.schema_names[name] = (label, key)
+        return True
+
+    def expand(
+        self, node_id: int, direction: str, types: List[str]
+    ) -> Iterator[MemoryRelationship]:
+        """Relationships of a node, `direction` is "out", "in" or "both" """
+        adjacencies = []
+        if direction in ("out", "both"):
+            adjacencies.append(self.outgoing.get(node_id, {}))
+        if direction in ("in", "both"):
+            adjacencies.append(self.incoming.get(node_id, {}))
+        seen = set()
+        for adjacency in adjacencies:
+            for type in types or list(adjacency):
+                for rel_id in list(adjacency.get(type, ())):
+                    if rel_id in seen:  # self loops in "both"
+                        continue
+                    seen.add(rel_id)
+                    yield self.relationships[rel_id]
+
+
+def index_key(value: Any) -> Any:
+    """Hashable key of a property value, keeping `true` apart from `1`"""
+    if isinstance(value, bool):
+        return ("boolean", value)
+    if isinstance(value, (int, float)):
+        return ("number", value)
+    return hashable(value)
+
+
+# ---------------------------------------------------------------- parsing
+
+TOKEN_RE = re.compile(
+    r"""
+    (?P<space>\s+)
+  | (?P<comment>//[^\n]*)
+  | (?P<number>\d+\.\d+|\d+)
+  | (?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")
+  | (?P<param>\$[A-Za-z_][A-Za-z_0-9]*)
+  | (?P<quoted>`[^`]*`)
+  | (?P<ident>[A-Za-z_][A-Za-z_0-9]*)
+  | (?P<op>->|<-|<>|<=|>=|\+=|\.\.|[()\[\]{}:,.=<>+\-*/%|;])
+    """,
+    re.VERBOSE,
+)
+
+
+SCHEMA_RE = re.compile(
+    r"""
+    \s*CREATE\s+(?P<kind>CONSTRAINT|INDEX)
+    (?:\s+(?!IF\b|FOR\b|ON\b)(?P<name>\w+))?
+    (?P<exists>\s+IF\s+NOT\s+EXISTS)?
+    \s+(?:FOR|ON)\s*\(\s*(?P<var>\w+)\s*:\s*(?P<label>\w+)\s*\)
+    \s+(?:REQUIRE|ASSERT|ON)\s*\(?\s*(?P<target>\w+)\.(?P<key>\w+)\s*\)?
+    (?P<unique>\s+IS\s+UNIQUE)?
+    \s*;?\s*$
+    """,
+    re.VERBOSE | re.IGNORECASE,
+)
+
+
+class Token:
+    __slots__ = ("kind", "value", "start", "end")
+
+    def __init__(self, kind: str, value: Any, start: int, end: int) -> None:
+        self.kind = kind
+        self.value = value
+        self.start = start
+        self.end = end
+
+    def keyword(self) -> Optional[str]:
+        return self.value.upper() if self.kind == "ident" else None
+
+
+def tokenize(query: str) -> List[Token]:
+    tokens = []
+    pos = 0
+    while pos < len(query):
+        match = TOKEN_RE.match(query, pos)
+        if match is None:
+            raise CypherSyntaxError(
+                f"Invalid input '{query[pos]}' at position {pos}"
+            )
+        kind = match.lastgroup
+        text = match.group()
+        if kind == "number":
+            tokens.append(
+                Token(
+                    kind,
+                    float(text) if "." in text else int(text),
+                    pos,
+                    match.end(),
+                )
+            )
+        elif kind == "string":
+            value = re.sub(r"\\(.)", r"\1", text[1:-1])
+            tokens.append(Token(kind, value, pos, match.end()))
+        elif kind == "param":
+            tokens.append(Token(kind, text[1:], pos, match.end()))
+        elif kind == "quoted":
+            tokens.append(Token("name", text[1:-1], pos, match.end()))
+        elif kind in ("ident", "op"):
+            tokens.append(Token(kind, text, pos, match.end()))
+        pos = match.end()
+    tokens.append(Token("eof", None, len(query), len(query)))
+    return tokens
+
+
+class NodePattern:
+    __slots__ = ("var", "labels", "properties")
+
+    def __init__(self, var: str, labels: List[str], properties: Any) -> None:
+        self.var = var
+        self.labels = labels
+        self.properties = properties
+
+
+class RelationshipPattern:
+    __slots__ = ("var", "types", "properties", "direction")
+
+    def __init__(
+        self, var: str, types: List[str], properties: Any, direction: str
+    ) -> None:
+        self.var = var
+        self.types = types
+        self.properties = properties
+        self.direction = direction  # "out", "in" or "both"
+
+
+class PathPattern:
+    def __init__(
+        self,
+        nodes: List[NodePattern],
+        relationships: List[RelationshipPattern],
+    ) -> None:
+        """relationships[i] connects nodes[i] and nodes[i + 1]"""
+        self.nodes = nodes
+        self.relationships = relationships
+
+    def variables(self) -> List[str]:
+        return [n.var for n in self.nodes] + [
+            r.var for r in self.relationships
+        ]
+
+
+class Projection:
+    def __init__(self) -> None:
+        self.distinct: bool = False
+        self.items: List[Tuple[Any, str]] = []
+        self.order: List[Tuple[Any, bool]] = []  # (expression, descending)
+        self.skip: Any = None
+        self.limit: Any = None
+        self.where: Any = None
+
+
+ANONYMOUS = " anonymous "
+
+
+def is_anonymous(var: str) -> bool:
+    return var.startswith(ANONYMOUS)
+
+
+class Parser:
+    def __init__(self, query: str) -> None:
+        self.query = query
+        self.tokens = tokenize(query)
+        self.pos = 0
+        self.anonymous = 0
+
+    # token helpers
+    def peek(self, offset: int = 0) -> Token:
+        return self.tokens[min(self.pos + offset, len(self.tokens) - 1)]
+
+    def next(self) -> Token:
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
+
+    def at_keyword(self, *words: str) -> bool:
+        return all(
+            self.peek(i).keyword() == word for i, word in enumerate(words)
+        )
+
+    def accept_keyword(self, *words: str) -> bool:
+        if self.at_keyword(*words):
+            self.pos += len(words)
+            return True
+        return False
+
+    def expect_keyword(self, *words: str) -> None:
+        if not self.accept_keyword(*words):
+            self.error(" ".join(words))
+
+    def at_op(self, op: str) -> bool:
+        token = self.peek()
+        return token.kind == "op" and token.value == op
+
+    def accept_op(self, op: str) -> bool:
+        if self.at_op(op):
+            self.pos += 1
+            return True
+        return False
+
+    def expect_op(self, op: str) -> None:
+        if not self.accept_op(op):
+            self.error(op)
+
+    def name(self) -> str:
+        token = self.next()
+        if token.kind not in ("ident", "name"):
+            self.pos -= 1
+            self.error("a name")
+        return token.value
+
+    def error(self, expected: str) -> NoReturn:
+        token = self.peek()
+        raise CypherSyntaxError(
+            f"Invalid input '{token.value}' at position {token.start}, "
+            f"expected {expected}: {self.query}"
+        )
+
+    def anonymous_var(self) -> str:
+        self.anonymous += 1
+        return f"{ANONYMOUS}{self.anonymous}"
+
+    # statements
+    def parse(self) -> List[tuple]:
+        if self.at_keyword("PROFILE") or self.at_keyword("EXPLAIN"):
+            self.pos += 1
+        clauses = []
+        while self.peek().kind != "eof":
+            if self.accept_op(";"):
+                continue
+            clauses.append(self.clause())
+        return clauses
+
+    def clause(self) -> tuple:
+        if self.accept_keyword("OPTIONAL", "MATCH"):
+            return self.match_clause(optional=True)
+        if self.accept_keyword("MATCH"):
+            return self.match_clause(optional=False)
+        if self.accept_keyword("CREATE"):
+            return ("create", self.patterns())
+        if self.accept_keyword("MERGE"):
+            return self.merge_clause()
+        if self.accept_keyword("SET"):
+            return ("set", self.set_items())
+        if self.accept_keyword("REMOVE"):
+            return ("remove", self.remove_items())
+        if self.accept_keyword("DETACH", "DELETE"):
+            return ("delete", True, self.expressions())
+        if self.accept_keyword("DELETE"):
+            return ("delete", False, self.expressions())
+        if self.accept_keyword("FOREACH"):
+            self.expect_op("(")
+            var = self.name()
+            self.expect_keyword("IN")
+            expr = self.expression()
+            self.expect_op("|")
+            clauses = []
+            while not self.accept_op(")"):
+                clauses.append(self.clause())
+            return ("foreach", var, expr, clauses)
+        if self.accept_keyword("UNWIND"):
+            expr = self.expression()
+            self.expect_keyword("AS")
+            return ("unwind", expr, self.name())
+        if self.accept_keyword("WITH"):
+            return ("with", self.projection(with_clause=True))
+        if self.accept_keyword("RETURN"):
+            return ("return", self.projection(with_clause=False))
+        self.error("a clause")
+
+    def match_clause(self, optional: bool) -> tuple:
+        patterns = self.patterns()
+        where = self.expression() if self.accept_keyword("WHERE") else None
+        return ("match", optional, patterns, where)
+
+    def merge_clause(self) -> tuple:
+        pattern = self.path_pattern()
+        on_create: List[tuple] = []
+        on_match: List[tuple] = []
+        while self.at_keyword("ON"):
+            if self.accept_keyword("ON", "CREATE", "SET"):
+                on_create.extend(self.set_items())
+            elif self.accept_keyword("ON", "MATCH", "SET"):
+                on_match.extend(self.set_items())
+            else:
+                self.error("ON CREATE SET or ON MATCH SET")
+        return ("merge", pattern, on_create, on_match)
+
+    def patterns(self) -> List[PathPattern]:
+        patterns = [self.path_pattern()]
+        while self.accept_op(","):
+            patterns.append(self.path_pattern())
+        return patterns
+
+    def path_pattern(self) -> PathPattern:
+        nodes = [self.node_pattern()]
+        relationships = []
+        while self.at_op("-") or self.at_op("<-"):
+            relationships.append(self.relationship_pattern())
+            nodes.append(self.node_pattern())
+        return PathPattern(nodes, relationships)
+
+    def node_pattern(self) -> NodePattern:
+        self.expect_op("(")
+        var = None
+        if self.peek().kind in ("ident", "name"):
+            var = self.name()
+        labels = []
+        while self.accept_op(":"):
+            labels.append(self.name())
+        properties = self.pattern_properties()
+        self.expect_op(")")
+        return NodePattern(var or self.anonymous_var(), labels, properties)
+
+    def relationship_pattern(self) -> RelationshipPattern:
+        incoming = self.accept_op("<-")
+        if not incoming:
+            self.expect_op("-")
+        var = None
+        types: List[str] = []
+        properties = None
+        if self.accept_op("["):
+            if self.peek().kind in ("ident", "name"):
+                var = self.name()
+            if self.accept_op(":"):
+                types.append(self.name())
+                while self.accept_op("|"):
+                    self.accept_op(":")
+                    types.append(self.name())
+            properties = self.pattern_properties()
+            self.expect_op("]")
+        outgoing = self.accept_op("->")
+        if not outgoing:
+            self.expect_op("-")
+        if incoming and outgoing:
+            self.error("a single direction")
+        direction = "in" if incoming else "out" if outgoing else "both"
+        return RelationshipPattern(
+            var or self.anonymous_var(), types, properties, direction
+        )
+
+    def pattern_properties(self) -> Any:
+        if self.at_op("{"):
+            return self.atom()
+        if self.peek().kind == "param":
+            return ("param", self.next().value)
+        return None
+
+    def set_items(self) -> List[tuple]:
+        items = [self.set_item()]
+        while self.accept_op(","):
+            items.append(self.set_item())
+        return items
+
+    def set_item(self) -> tuple:
+        var = self.name()
+        if self.accept_op(":"):
+            labels = [self.name()]
+            while self.accept_op(":"):
+                labels.append(self.name())
+            return ("labels", var, labels)
+        if self.accept_op("."):
+            key = self.name()
+            self.expect_op("=")
+            return ("property", var, key, self.expression())
+        if self.accept_op("+="):
+            return ("merge", var, self.expression())
+        self.expect_op("=")
+        return ("replace", var, self.expression())
+
+    def remove_items(self) -> List[tuple]:
+        items: List[tuple] = []
+        while True:
+            var = self.name()
+            if self.accept_op(":"):
+                items.append(("labels", var, [self.name()]))
+            else:
+                self.expect_op(".")
+                items.append(("property", var, self.name(), ("lit", None)))
+            if not self.accept_op(","):
+                return items
+
+    def expressions(self) -> List[Any]:
+        exprs = [self.expression()]
+        while self.accept_op(","):
+            exprs.append(self.expression())
+        return exprs
+
+    def projection(self, with_clause: bool) -> Projection:
+        projection = Projection()
+        projection.distinct = self.accept_keyword("DISTINCT")
+        while True:
+            start = self.peek().start
+            expr = self.expression()
+            end = self.tokens[self.pos - 1].end
+            if self.accept_keyword("AS"):
+                alias = self.name()
+            else:
+                alias = self.query[start:end].strip()
+            projection.items.append((expr, alias))
+            if not self.accept_op(","):
+                break
+        if self.accept_keyword("ORDER", "BY"):
+            while True:
+                expr = self.expression()
+                descending = False
+                if self.accept_keyword("DESC") or self.accept_keyword(
+                    "DESCENDING"
+                ):
+                    descending = True
+                elif not self.accept_keyword("ASC"):
+                    self.accept_keyword("ASCENDING")
+                projection.order.append((expr, descending))
+                if not self.accept_op(","):
+                    break
+        if self.accept_keyword("SKIP"):
+            projection.skip = self.expression()
+        if self.accept_keyword("LIMIT"):
+            projection.limit = self.expression()
+        if with_clause and self.accept_keyword("WHERE"):
+            projection.where = self.expression()
+        return projection
+
+    # expressions, lowest precedence first
+    def expression(self) -> Any:
+        return self.or_expression()
+
+    def or_expression(self) -> Any:
+        left = self.xor_expression()
+        while self.accept_keyword("OR"):
+            left = ("or", left, self.xor_expression())
+        return left
+
+    def xor_expression(self) -> Any:
+        left = self.and_expression()
+        while self.accept_keyword("XOR"):
+            left = ("xor", left, self.and_expression())
+        return left
+
+    def and_expression(self) -> Any:
+        left = self.not_expression()
+        while self.accept_keyword("AND"):
+            left = ("and", left, self.not_expression())
+        return left
+
+    def not_expression(self) -> Any:
+        if self.accept_keyword("NOT"):
+            return ("not", self.not_expression())
+        return self.comparison()
+
+    def comparison(self) -> Any:
+        left = self.additive()
+        while True:
+            token = self.peek()
+            if token.kind == "op" and token.value in (
+                "=",
+                "<>",
+                "<",
+                ">",
+                "<=",
+                ">=",
+            ):
+                self.pos += 1
+                left = ("cmp", token.value, left, self.additive())
+            elif self.accept_keyword("IS", "NOT", "NULL"):
+                left = ("isnull", left, True)
+            elif self.accept_keyword("IS", "NULL"):
+                left = ("isnull", left, False)
+            elif self.accept_keyword("IN"):
+                left = ("in", left, self.additive())
+            elif self.accept_keyword("STARTS", "WITH"):
+                left = ("startswith", left, self.additive())
+            elif self.accept_keyword("ENDS", "WITH"):
+                left = ("endswith", left, self.additive())
+            elif self.accept_keyword("CONTAINS"):
+                left = ("contains", left, self.additive())
+            else:
+                return left
+
+    def additive(self) -> Any:
+        left = self.multiplicative()
+        while self.at_op("+") or self.at_op("-"):
+            op = self.next().value
+            left = ("bin", op, left, self.multiplicative())
+        return left
+
+    def multiplicative(self) -> Any:
+        left = self.unary()
+        while self.at_op("*") or self.at_op("/") or self.at_op("%"):
+            op = self.next().value
+            left = ("bin", op, left, self.unary())
+        return left
+
+    def unary(self) -> Any:
+        if self.accept_op("-"):
+            return ("neg", self.unary())
+        if self.accept_op("+"):
+            return self.unary()
+        return self.postfix()
+
+    def postfix(self) -> Any:
+        expr = self.atom()
+        while True:
+            if self.accept_op("."):
+                expr = ("prop", expr, self.name())
+            elif self.accept_op("["):
+                index = self.expression()
+                self.expect_op("]")
+                expr = ("index", expr, index)
+            else:
+                return expr
+
+    def atom(self) -> Any:
+        token = self.peek()
+        if token.kind in ("number", "string"):
+            self.pos += 1
+            return ("lit", token.value)
+        if token.kind == "param":
+            self.pos += 1
+            return ("param", token.value)
+        if self.accept_op("("):
+            expr = self.expression()
+            self.expect_op(")")
+            return expr
+        if self.accept_op("["):
+            items = []
+            if not self.at_op("]"):
+                items = self.expressions()
+            self.expect_op("]")
+            return ("list", items)
+        if self.accept_op("{"):
+            entries = []
+            while not self.at_op("}"):
+                token = self.next()
+                if token.kind not in ("ident", "name", "string"):
+                    self.pos -= 1
+                    self.error("a map key")
+                self.expect_op(":")
+                entries.append((token.value, self.expression()))
+                if not self.accept_op(","):
+                    break
+            self.expect_op("}")
+            return ("map", entries)
+        keyword = token.keyword()
+        if keyword in ("TRUE", "FALSE", "NULL"):
+            self.pos += 1
+            return (
+                "lit",
+                {"TRUE": True, "FALSE": False, "NULL": None}[keyword],
+            )
+        if keyword == "CASE":
+            return self.case()
+        if token.kind in ("ident", "name"):
+            self.pos += 1
+            if token.kind == "ident" and self.at_op("("):
+                return self.call(token.value.lower())
+            return ("var", token.value)
+        self.error("an expression")
+
+    def call(self, name: str) -> Any:
+        self.expect_op("(")
+        distinct = self.accept_keyword("DISTINCT")
+        if self.accept_op("*"):
+            self.expect_op(")")
+            return ("call", name, distinct, [], True)
+        args = []
+        if not self.at_op(")"):
+            args = self.expressions()
+        self.expect_op(")")
+        return ("call", name, distinct, args, False)
+
+    def case(self) -> Any:
+        self.expect_keyword("CASE")
+        operand = None
+        if not self.at_keyword("WHEN"):
+            operand = self.expression()
+        branches = []
+        while self.accept_keyword("WHEN"):
+            condition = self.expression()
+            self.expect_keyword("THEN")
+            branches.append((condition, self.expression()))
+        default = (
+            self.expression() if self.accept_keyword("ELSE") else ("lit", None)
+        )
+        self.expect_keyword("END")
+        return ("case", operand, branches, default)
+
+
+PARSED: Dict[str, List[tuple]] = {}
+
+
+def parse(query: str) -> List[tuple]:
+    """Parses a statement, caching the result per query text"""
+    clauses = PARSED.get(query)
+    if clauses is None:
+        clauses = Parser(query).parse()
+        if len(PARSED) > 1024:
+            PARSED.clear()
+        PARSED[query] = clauses
+    return clauses
+
+
+# -------------------------------------------------------------- execution
+
+
+class Unbound(Exception):
+    """Raised when an expression uses a variable that is not bound yet"""
+
+
+def contains_aggregate(expr: Any) -> bool:
+    if not isinstance(expr, tuple):
+        return False
+    if expr[0] == "call" and expr[1] in AGGREGATES:
+        return True
+    return any(
+        contains_aggregate(part)
+        for part in expr[1:]
+        if isinstance(part, (tuple, list))
+        for part in (part if isinstance(part, list) else [part])
+    )
+
+
+def aggregate_calls(expr: Any) -> List[tuple]:
+    if not isinstance(expr, tuple):
+        if isinstance(expr, list):
+            return [call for part in expr for call in aggregate_calls(part)]
+        return []
+    if expr[0] == "call" and expr[1] in AGGREGATES:
+        return [expr]
+    return [call for part in expr[1:] for call in aggregate_calls(part)]
+
+
+def hashable(value: Any) -> Any:
+    if isinstance(value, list):
+        return tuple(hashable(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, hashable(v)) for k, v in value.items()))
+    return value
+
+
+def cypher_equals(a: Any, b: Any) -> Optional[bool]:
+    if a is None or b is None:
+        return None
+    if isinstance(a, bool) != isinstance(b, bool):
+        return False
+    if isinstance(a, (MemoryNode, MemoryRelationship)) or isinstance(
+        b, (MemoryNode, MemoryRelationship)
+    ):
+        return type(a) is type(b) and a.id == b.id
+    if isinstance(a, list) and isinstance(b, list):
+        if len(a) != len(b):
+            return False
+        result: Optional[bool] = True
+        for x, y in zip(a, b):
+            equal = cypher_equals(x, y)
+            if equal is False:
+                return False
+            if equal is None:
+                result = None
+        return result
+    if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+        return a == b
+    if type(a) is not type(b):
+        return False
+    return a == b
+
+
+def sort_key(value: Any) -> tuple:
+    """Orders nulls last and groups values of the same kind"""
+    if value is None:
+        return (3, 0)
+    if isinstance(value, (MemoryNode, MemoryRelationship)):
+        return (0, value.id)
+    if isinstance(value, bool):
+        return (1, int(value))
+    if isinstance(value, (int, float)):
+        return (1, value)
+    if isinstance(value, str):
+        return (2, value)
+    return (2, str(value))
+
+
+class Execution:
+    def __init__(
+        self, graph: MemoryGraph, parameters: Dict[str, Any], changes: Changes
+    ) -> None:
+        self.graph = graph
+        self.parameters = parameters
+        self.changes = changes
+        self.reads = False
+        self.writes = False
+
+    def run(
+        self, clauses: List[tuple]
+    ) -> Tuple[List[str], List[Dict[str, Any]]]:
+        rows: List[Dict[str, Any]] = [{}]
+        for clause in clauses:
+            if clause[0] == "return":
+                return self.project(rows, clause[1])
+            rows = self.apply(clause, rows)
+        return [], []
+
+    def apply(
+        self, clause: tuple, rows: List[Dict[str, Any]]
+    ) -> List[Dict[str, Any]]:
+        kind = clause[0]
+        if kind == "match":
+            self.reads = True
+            rows = self.match(rows, *clause[1:])
+        elif kind == "create":
+            self.writes = True
+            rows = [self.create(row, clause[1]) for row in rows]
+        elif kind == "merge":
+            self.reads = self.writes = True
+            rows = self.merge(rows, *clause[1:])
+        elif kind == "set":
+            self.writes = True
+            for row in rows:
+                self.set(row, clause[1])
+        elif kind == "remove":
+            self.writes = True
+            for row in rows:
+                self.remove(row, clause[1])
+        elif kind == "delete":
+            self.writes = True
+            for row in rows:
+                self.delete(row, clause[1], clause[2])
+        elif kind == "unwind":
+            rows = self.unwind(rows, clause[1], clause[2])
+        elif kind == "foreach":
+            for row in rows:
+                self.foreach(row, *clause[1:])
+        elif kind == "with":
+            _, rows = self.project(rows, clause[1])
+        return rows
+
+    def foreach(
+        self, row: Dict[str, Any], var: str, expr: Any, clauses: List[tuple]
+    ) -> None:
+        for value in self.evaluate(expr, row) or []:
+            scope = [dict(row, **{var: value})]
+            for clause in clauses:
+                scope = self.apply(clause, scope)
+
+    # expressions
+    def evaluate(
+        self,
+        expr: Any,
+        row: Dict[str, Any],
+        aggregated: Optional[Dict[int, Any]] = None,
+    ) -> Any:
+        kind = expr[0]
+        if kind == "lit":
+            return expr[1]
+        if kind == "param":
+            if expr[1] not in self.parameters:
+                raise ClientError(f"Expected parameter(s): {expr[1]}")
+            return self.parameters[expr[1]]
+        if kind == "var":
+            if expr[1] not in row:
+                raise Unbound(expr[1])
+            return row[expr[1]]
+        if kind == "prop":
+            target = self.evaluate(expr[1], row, aggregated)
+            if target is None:
+                return None
+            if isinstance(target, (MemoryNode, MemoryRelationship)):
+                return target.properties.get(expr[2])
+            if isinstance(target, dict):
+                return target.get(expr[2])
+            raise ClientError(f"Type mismatch: cannot access '{expr[2]}'")
+        if kind == "cmp":
+            left = self.evaluate(expr[2], row, aggregated)
+            right = self.evaluate(expr[3], row, aggregated)
+            return self.compare(expr[1], left, right)
+        if kind == "and":
+            left = self.evaluate(expr[1], row, aggregated)
+            if left is False:
+                return False
+            right = self.evaluate(expr[2], row, aggregated)
+            if right is False:
+                return False
+            if left is None or right is None:
+                return None
+            return True
+        if kind == "or":
+            left = self.evaluate(expr[1], row, aggregated)
+            if left is True:
+                return True
+            right = self.evaluate(expr[2], row, aggregated)
+            if right is True:
+                return True
+            if left is None or right is None:
+                return None
+            return False
+        if kind == "xor":
+            left = self.evaluate(expr[1], row, aggregated)
+            right = self.evaluate(expr[2], row, aggregated)
+            if left is None or right is None:
+                return None
+            return left != right
+        if kind == "not":
+            value = self.evaluate(expr[1], row, aggregated)
+            return None if value is None else not value
+        if kind == "isnull":
+            value = self.evaluate(expr[1], row, aggregated)
+            return (value is not None) if expr[2] else (value is None)
+        if kind == "in":
+            value = self.evaluate(expr[1], row, aggregated)
+            values = self.evaluate(expr[2], row, aggregated)
+            if values is None:
+                return None
+            found: Optional[bool] = False
+            for candidate in values:
+                equal = cypher_equals(value, candidate)
+                if equal:
+                    return True
+                if equal is None:
+                    found = None
+            return found
+        if kind in ("startswith", "endswith", "contains"):
+            left = self.evaluate(expr[1], row, aggregated)
+            right = self.evaluate(expr[2], row, aggregated)
+            if not isinstance(left, str) or not isinstance(right, str):
+                return None
+            if kind == "startswith":
+                return left.startswith(right)
+            if kind == "endswith":
+                return left.endswith(right)
+            return right in left
+        if kind == "bin":
+            left = self.evaluate(expr[2], row, aggregated)
+            right = self.evaluate(expr[3], row, aggregated)
+            return self.arithmetic(expr[1], left, right)
+        if kind == "neg":
+            value = self.evaluate(expr[1], row, aggregated)
+            return None if value is None else -value
+        if kind == "index":
+            target = self.evaluate(expr[1], row, aggregated)
+            index = self.evaluate(expr[2], row, aggregated)
+            if target is None or index is None:
+                return None
+            if isinstance(target, dict):
+                return target.get(index)
+            if isinstance(target, (MemoryNode, MemoryRelationship)):
+                return target.properties.get(index)
+            if -len(target) <= index < len(target):
+                return target[index]
+            return None
+        if kind == "list":
+            return [self.evaluate(item, row, aggregated) for item in expr[1]]
+        if kind == "map":
+            return {
+                key: self.evaluate(value, row, aggregated)
+                for key, value in expr[1]
+            }
+        if kind == "case":
+            operand = expr[1]
+            if operand is not None:
+                operand = self.evaluate(operand, row, aggregated)
+            for condition, value in expr[2]:
+                test = self.evaluate(condition, row, aggregated)
+                if operand is not None or expr[1] is not None:
+                    test = cypher_equals(operand, test)
+                if test is True:
+                    return self.evaluate(value, row, aggregated)
+            return self.evaluate(expr[3], row, aggregated)
+        if kind == "call":
+            if expr[1] in AGGREGATES:
+                if aggregated is None or id(expr) not in aggregated:
+                    raise ClientError(
+                        f"Invalid use of aggregating function {expr[1]}(...)"
+                    )
+                return aggregated[id(expr)]
+            args = [self.evaluate(arg, row, aggregated) for arg in expr[3]]
+            return self.function(expr[1], args)
+        raise ClientError(f"Unsupported expression {kind}")
+
+    def compare(self, op: str, left: Any, right: Any) -> Optional[bool]:
+        if op == "=":
+            return cypher_equals(left, right)
+        if op == "<>":
+            equal = cypher_equals(left, right)
+            return None if equal is None else not equal
+        if left is None or right is None:
+            return None
+        if isinstance(left, (int, float)) != isinstance(right, (int, float)):
+            return None
+        if op == "<":
+            return left < right
+        if op == ">":
+            return left > right
+        if op == "<=":
+            return left <= right
+        return left >= right
+
+    def arithmetic(self, op: str, left: Any, right: Any) -> Any:
+        if left is None or right is None:
+            return None
+        if op == "+":
+            if isinstance(left, list):
+                return left + (right if isinstance(right, list) else [right])
+            if isinstance(right, list):
+                return [left] + right
+            if isinstance(left, str) or isinstance(right, str):
+                return str(left) + str(right)
+            return left + right
+        if op == "-":
+            return left - right
+        if op == "*":
+            return left * right
+        if op == "/":
+            if isinstance(left, int) and isinstance(right, int):
+                if right == 0:
+                    raise ClientError("/ by zero")
+                quotient = abs(left) // abs(right)
+                return quotient if (left >= 0) == (right >= 0) else -quotient
+            return left / right
+        if op == "%":
+            return left % right
+        raise ClientError(f"Unsupported operator {op}")
+
+    def function(self, name: str, args: List[Any]) -> Any:
+        if name == "id":
+            return None if args[0] is None else args[0].id
+        if name == "type":
+            return None if args[0] is None else args[0].type
+        if name == "labels":
+            return None if args[0] is None else sorted(args[0].labels)
+        if name == "properties":
+            if args[0] is None:
+                return None
+            if isinstance(args[0], dict):
+                return dict(args[0])
+            return dict(args[0].properties)
+        if name == "keys":
+            if args[0] is None:
+                return None
+            if isinstance(args[0], dict):
+                return list(args[0])
+            return list(args[0].properties)
+        if name == "coalesce":
+            return next((arg for arg in args if arg is not None), None)
+        if name == "size":
+            return None if args[0] is None else len(args[0])
+        if name == "head":
+            return args[0][0] if args[0] else None
+        if name == "last":
+            return args[0][-1] if args[0] else None
+        if name == "range":
+            step = args[2] if len(args) > 2 else 1
+            return list(
+                range(args[0], args[1] + (1 if step > 0 else -1), step)
+            )
+        if name == "tointeger":
+            try:
+                return None if args[0] is None else int(args[0])
+            except (TypeError, ValueError):
+                return None
+        if name == "tostring":
+            return None if args[0] is None else str(args[0])
+        if name == "timestamp":
+            return int(time.time() * 1000)
+        if name == "startnode":
+            return (
+                None
+                if args[0] is None
+                else self.graph.nodes.get(args[0].start)
+            )
+        if name == "endnode":
+            return (
+                None if args[0] is None else self.graph.nodes.get(args[0].end)
+            )
+        raise ClientError(f"Unknown function '{name}'")
+
+    def aggregate(self, call: tuple, rows: List[Dict[str, Any]]) -> Any:
+        _, name, distinct, args, star = call
+        if star:
+            return len(rows)
+        values = [self.evaluate(args[0], row) for row in rows]
+        values = [value for value in values if value is not None]
+        if distinct:
+            seen = set()
+            unique = []
+            for value in values:
+                key = hashable(value)
+                if key not in seen:
+                    seen.add(key)
+                    unique.append(value)
+            values = unique
+        if name == "count":
+            return len(values)
+        if name == "collect":
+            return values
+        if not values:
+            return 0 if name == "sum" else None
+        if name == "sum":
+            return sum(values)
+        if name == "min":
+            return min(values, key=sort_key)
+        if name == "max":
+            return max(values, key=sort_key)
+        return sum(values) / len(values)
+
+    # reading
+    def match(
+        self,
+        rows: List[Dict[str, Any]],
+        optional: bool,
+        patterns: List[PathPattern],
+        where: Any,
+    ) -> List[Dict[str, Any]]:
+        hints = self.hints(where)
+        variables = [var for p in patterns for var in p.variables()]
+        ret = []
+        for row in rows:
+            found = False
+            for binding in self.match_patterns(row, patterns, 0, set(), hints):
+                if (
+                    where is not None
+                    and self.evaluate(where, binding) is not True
+                ):
+                    continue
+                found = True
+                ret.append(self.strip(binding))
+            if optional and not found:
+                binding = dict(row)
+                for var in variables:
+                    binding.setdefault(var, None)
+                ret.append(self.strip(binding))
+        return ret
+
+    def strip(self, row: Dict[str, Any]) -> Dict[str, Any]:
+        return {k: v for k, v in row.items() if not is_anonymous(k)}
+
+    def hints(self, where: Any) -> Dict[Any, List[Any]]:
+        """Equality conjuncts of a WHERE usable as lookup seeds:
+        `id(var) = expr` under `var`, `var.key = expr` under `(var, key)`
+        """
+        hints: Dict[Any, List[Any]] = {}
+        conjuncts = []
+        stack = [where] if where is not None else []
+        while stack:
+            expr = stack.pop()
+            if expr[0] == "and":
+                stack.extend(expr[1:])
+            else:
+                conjuncts.append(expr)
+        for expr in conjuncts:
+            if expr[0] != "cmp" or expr[1] != "=":
+                continue
+            for left, right in ((expr[2], expr[3]), (expr[3], expr[2])):
+                if (
+                    left[0] == "call"
+                    and left[1] == "id"
+                    and len(left[3]) == 1
+                    and left[3][0][0] == "var"
+                ):
+                    hints.setdefault(left[3][0][1], []).append(right)
+                if left[0] == "prop" and left[1][0] == "var":
+                    hints.setdefault((left[1][1], left[2]), []).append(right)
+        return hints
+
+    def hinted_id(
+        self, var: Any, row: Dict[str, Any], hints: Dict[Any, List[Any]]
+    ) -> Tuple[bool, Any]:
+        for expr in hints.get(var, ()):
+            try:
+                return True, self.evaluate(expr, row)
+            except Unbound:
+                continue
+        return False, None
+
+    def match_patterns(
+        self,
+        row: Dict[str, Any],
+        patterns: List[PathPattern],
+        index: int,
+        used: set,
+        hints: Dict[Any, List[Any]],
+    ) -> Iterator[Dict[str, Any]]:
+        if index == len(patterns):
+            yield row
+            return
+        for binding, rels in self.match_path(
+            row, patterns[index], used, hints
+        ):
+            yield from self.match_patterns(
+                binding, patterns, index + 1, used | rels, hints
+            )
+
+    def node_matches(
+        self,
+        pattern: NodePattern,
+        node: Optional[MemoryNode],
+        row: Dict[str, Any],
+    ) -> bool:
+        if node is None:
+            return False
+        if pattern.var in row and not (
+            isinstance(row[pattern.var], MemoryNode)
+            and row[pattern.var].id == node.id
+        ):
+            return False
+        for label in pattern.labels:
+            if label not in node.labels:
+                return False
+        return self.properties_match(pattern.properties, node, row)
+
+    def properties_match(
+        self, expr: Any, entity: Any, row: Dict[str, Any]
+    ) -> bool:
+        if expr is None:
+            return True
+        for key, value in (self.evaluate(expr, row) or {}).items():
+            if cypher_equals(entity.properties.get(key), value) is not True:
+                return False
+        return True
+
+    def relationship_matches(
+        self,
+        pattern: RelationshipPattern,
+        rel: MemoryRelationship,
+        row: Dict[str, Any],
+        used: set,
+    ) -> bool:
+        if rel.id in used:
+            return False
+        if pattern.var in row and not (
+            isinstance(row[pattern.var], MemoryRelationship)
+            and row[pattern.var].id == rel.id
+        ):
+            return False
+        if pattern.types and rel.type not in pattern.types:
+            return False
+        return self.properties_match(pattern.properties, rel, row)
+
+    def seed(
+        self,
+        path: PathPattern,
+        row: Dict[str, Any],
+        hints: Dict[Any, List[Any]],
+    ) -> Tuple[str, int, List[Any]]:
+        """Cheapest element to start matching a path from:
+        ("node" or "relationship", index, candidates). A bound or
+        `id()` hinted relationship wins, then the bound or hinted node
+        with the fewest relationships, then the smallest label scan.
+        """
+        for i, rel_pattern in enumerate(path.relationships):
+            if rel_pattern.var in row:
+                value = row[rel_pattern.var]
+                return (
+                    "relationship",
+                    i,
+                    [value] if isinstance(value, MemoryRelationship) else [],
+                )
+            hinted, uid = self.hinted_id(rel_pattern.var, row, hints)
+            if hinted:
+                rel = (
+                    self.graph.relationships.get(uid)
+                    if isinstance(uid, int)
+                    else None
+                )
+                return ("relationship", i, [rel] if rel else [])
+        best: Optional[Tuple[int, List[Any]]] = None
+        best_cost = None
+        scan: Optional[Tuple[int, Any]] = None
+        scan_cost = None
+        for i, pattern in enumerate(path.nodes):
+            if pattern.var in row:
+                value = row[pattern.var]
+                node = value if isinstance(value, MemoryNode) else None
+            else:
+                hinted, uid = self.hinted_id(pattern.var, row, hints)
+                if not hinted:
+                    cost = len(self.graph.nodes)
+                    candidates: Any = None
+                    for label in pattern.labels:
+                        labelled = self.graph.labels.get(label, {})
+                        if len(labelled) <= cost:
+                            cost = len(labelled)
+                            candidates = labelled
+                        for key, value in self.property_hints(
+                            pattern, row, hints
+                        ):
+                            indexed = self.graph.lookup(label, key, value)
+                            if indexed is not None and len(indexed) <= cost:
+                                cost = len(indexed)
+                                candidates = indexed
+                    if scan_cost is None or cost < scan_cost:
+                        scan_cost = cost
+                        scan = (i, candidates)
+                    continue
+                node = (
+                    self.graph.nodes.get(uid) if isinstance(uid, int) else None
+                )
+            if node is None:
+                return ("node", i, [])
+            cost = self.degree(node.id)
+            if best_cost is None or cost < best_cost:
+                best_cost = cost
+                best = (i, [node])
+        if best is not None:
+            return ("node", best[0], best[1])
+        assert scan is not None
+        i, candidates = scan
+        if candidates is None:
+            candidates = self.graph.nodes
+        return ("node", i, [self.graph.nodes[uid] for uid in list(candidates)])
+
+    def property_hints(
+        self,
+        pattern: NodePattern,
+        row: Dict[str, Any],
+        hints: Dict[Any, List[Any]],
+    ) -> Iterator[Tuple[str, Any]]:
+        """(key, value) pairs a match of `pattern` must have, from its
+        property map and the WHERE, as far as they can be evaluated yet
+        """
+        if pattern.properties is not None:
+            try:
+                properties = self.evaluate(pattern.properties, row)
+            except Unbound:
+                properties = None
+            for key, value in (properties or {}).items():
+                yield key, value
+        for name in hints:
+            if not isinstance(name, tuple) or name[0] != pattern.var:
+                continue
+            hinted, value = self.hinted_id(name, row, hints)
+            if hinted:
+                yield name[1], value
+
+    def degree(self, node_id: int) -> int:
+        return sum(
+            len(rel_ids)
+            for adjacency in (
+                self.graph.outgoing[node_id],
+                self.graph.incoming[node_id],
+            )
+            for rel_ids in adjacency.values()
+        )
+
+    def match_path(
+        self,
+        row: Dict[str, Any],
+        path: PathPattern,
+        used: set,
+        hints: Dict[Any, List[Any]],
+    ) -> Iterator[Tuple[Dict[str, Any], set]]:
+        kind, i, candidates = self.seed(path, row, hints)
+        if kind == "node":
+            for node in candidates:
+                if not self.node_matches(path.nodes[i], node, row):
+                    continue
+                binding = dict(row)
+                binding[path.nodes[i].var] = node
+                yield from self.extend(path, binding, i, i, set())
+            return
+        for rel in candidates:
+            pattern = path.relationships[i]
+            if not self.relationship_matches(pattern, rel, row, used):
+                continue
+            ends = []
+            if pattern.direction in ("out", "both"):
+                ends.append((rel.start, rel.end))
+            if pattern.direction in ("in", "both") and (
+                pattern.direction == "in" or rel.start != rel.end
+            ):
+                ends.append((rel.end, rel.start))
+            for left_id, right_id in ends:
+                left = self.graph.nodes.get(left_id)
+                right = self.graph.nodes.get(right_id)
+                binding = dict(row)
+                binding[pattern.var] = rel
+                if not self.node_matches(path.nodes[i], left, binding):
+                    continue
+                binding[path.nodes[i].var] = left
+                if not self.node_matches(path.nodes[i + 1], right, binding):
+                    continue
+                binding[path.nodes[i + 1].var] = right
+                yield from self.extend(
+                    path, binding, i, i + 1, {rel.id} | used
+                )
+
+    def extend(
+        self,
+        path: PathPattern,
+        binding: Dict[str, Any],
+        low: int,
+        high: int,
+        rels: set,
+    ) -> Iterator[Tuple[Dict[str, Any], set]]:
+        """Extends a match covering nodes[low..high] to the whole path,
+        rightwards first. `rels` are the relationships used so far.
+        """
+        if high < len(path.nodes) - 1:
+            pattern = path.relationships[high]
+            source = binding[path.nodes[high].var]
+            target_pattern = path.nodes[high + 1]
+            for rel, other in self.neighbours(
+                source, pattern.direction, pattern.types
+            ):
+                if not self.relationship_matches(pattern, rel, binding, rels):
+                    continue
+                if not self.node_matches(target_pattern, other, binding):
+                    continue
+                extended = dict(binding)
+                extended[pattern.var] = rel
+                extended[target_pattern.var] = other
+                yield from self.extend(
+                    path, extended, low, high + 1, rels | {rel.id}
+                )
+            return
+        if low > 0:
+            pattern = path.relationships[low - 1]
+            source = binding[path.nodes[low].var]
+            target_pattern = path.nodes[low - 1]
+            reverse = {"out": "in", "in": "out", "both": "both"}[
+                pattern.direction
+            ]
+            for rel, other in self.neighbours(source, reverse, pattern.types):
+                if not self.relationship_matches(pattern, rel, binding, rels):
+                    continue
+                if not self.node_matches(target_pattern, other, binding):
+                    continue
+                extended = dict(binding)
+                extended[pattern.var] = rel
+                extended[target_pattern.var] = other
+                yield from self.extend(
+                    path, extended, low - 1, high, rels | {rel.id}
+                )
+            return
+        yield binding, rels
+
+    def neighbours(
+        self, node: MemoryNode, direction: str, types: List[str]
+    ) -> Iterator[Tuple[MemoryRelationship, Optional[MemoryNode]]]:
+        for rel in self.graph.expand(node.id, direction, types):
+            other_id = rel.end if rel.start == node.id else rel.start
+            yield rel, self.graph.nodes.get(other_id)
+
+    def unwind(
+        self, rows: List[Dict[str, Any]], expr: Any, var: str
+    ) -> List[Dict[str, Any]]:
+        ret = []
+        for row in rows:
+            values = self.evaluate(expr, row)
+            if values is None:
+                continue
+            if not isinstance(values, list):
+                values = [values]
+            for value in values:
+                unwound = dict(row)
+                unwound[var] = value
+                ret.append(unwound)
+        return ret
+
+    def project(
+        self, rows: List[Dict[str, Any]], projection: Projection
+    ) -> Tuple[List[str], List[Dict[str, Any]]]:
+        keys = [alias for _, alias in projection.items]
+        aggregating = any(
+            contains_aggregate(expr) for expr, _ in projection.items
+        )
+        if aggregating:
+            projected = self.project_aggregates(rows, projection)
+            scopes = projected
+        else:
+            projected = []
+            scopes = []
+            for row in rows:
+                values = {
+                    alias: self.evaluate(expr, row)
+                    for expr, alias in projection.items
+                }
+                projected.append(values)
+                scopes.append({**row, **values})
+        if projection.distinct:
+            seen = set()
+            unique = []
+            unique_scopes = []
+            for values, scope in zip(projected, scopes):
+                key = hashable([values[k] for k in keys])
+                if key not in seen:
+                    seen.add(key)
+                    unique.append(values)
+                    unique_scopes.append(scope)
+            projected, scopes = unique, unique_scopes
+        if projection.order:
+            order = list(range(len(projected)))
+            for expr, descending in reversed(projection.order):
+                order.sort(
+                    key=lambda i: sort_key(self.evaluate(expr, scopes[i])),
+                    reverse=descending,
+                )
+            projected = [projected[i] for i in order]
+        if projection.skip is not None:
+            projected = projected[int(self.evaluate(projection.skip, {})) :]
+        if projection.limit is not None:
+            projected = projected[: int(self.evaluate(projection.limit, {}))]
+        if projection.where is not None:
+            projected = [
+                row
+                for row in projected
+                if self.evaluate(projection.where, row) is True
+            ]
+        return keys, projected
+
+    def project_aggregates(
+        self, rows: List[Dict[str, Any]], projection: Projection
+    ) -> List[Dict[str, Any]]:
+        grouping = [
+            (expr, alias)
+            for expr, alias in projection.items
+            if not contains_aggregate(expr)
+        ]
+        groups: Dict[Any, Tuple[Dict[str, Any], List[Dict[str, Any]]]] = {}
+        for row in rows:
+            values = {
+                alias: self.evaluate(expr, row) for expr, alias in grouping
+            }
+            key = hashable([values[alias] for _, alias in grouping])
+            if key not in groups:
+                groups[key] = (values, [])
+            groups[key][1].append(row)
+        if not groups and not grouping:
+            groups[()] = ({}, [])
+        ret = []
+        for values, members in groups.values():
+            projected = {}
+            for expr, alias in projection.items:
+                if alias in values:
+                    projected[alias] = values[alias]
+                    continue
+                aggregated = {
+                    id(call): self.aggregate(call, members)
+                    for call in aggregate_calls(expr)
+                }
+                row = members[0] if members else {}
+                projected[alias] = self.evaluate(expr, row, aggregated)
+            ret.append(projected)
+        return ret
+
+    # writing
+    def create(
+        self, row: Dict[str, Any], patterns: List[PathPattern]
+    ) -> Dict[str, Any]:
+        row = dict(row)
+        for path in patterns:
+            for pattern in path.nodes:
+                if pattern.var in row:
+                    if pattern.labels or pattern.properties is not None:
+                        raise ClientError(
+                            f"Can't create node `{pattern.var}` that already exists"
+                        )
+                    continue
+                properties = self.creation_properties(pattern.properties, row)
+                row[pattern.var] = self.graph.create_node(
+                    pattern.labels, properties, self.changes
+                )
+            for i, rel_pattern in enumerate(path.relationships):
+                if (
+                    len(rel_pattern.types) != 1
+                    or rel_pattern.direction == "both"
+                ):
+                    raise ClientError(
+                        "Exactly one relationship type and a direction "
+                        "must be specified for CREATE"
+                    )
+                start = row[path.nodes[i].var]
+                end = row[path.nodes[i + 1].var]
+                if start is None or end is None:
+                    raise ClientError(
+                        "Failed to create relationship, node is null"
+                    )
+                if rel_pattern.direction == "in":
+                    start, end = end, start
+                row[rel_pattern.var] = self.graph.create_relationship(
+                    rel_pattern.types[0],
+                    start,
+                    end,
+                    self.creation_properties(rel_pattern.properties, row),
+                    self.changes,
+                )
+        return self.strip(row)
+
+    def creation_properties(self, expr: Any, row: Dict[str, Any]) -> dict:
+        if expr is None:
+            return {}
+        properties = self.evaluate(expr, row) or {}
+        return {k: v for k, v in properties.items() if v is not None}
+
+    def merge(
+        self,
+        rows: List[Dict[str, Any]],
+        path: PathPattern,
+        on_create: List[tuple],
+        on_match: List[tuple],
+    ) -> List[Dict[str, Any]]:
+        ret = []
+        for row in rows:
+            matches = [
+                self.strip(binding)
+                for binding, _ in self.match_path(row, path, set(), {})
+            ]
+            if matches:
+                for binding in matches:
+                    self.set(binding, on_match)
+                ret.extend(matches)
+            else:
+                binding = self.create(row, [path])
+                self.set(binding, on_create)
+                ret.append(binding)
+        return ret
+
+    def set(self, row: Dict[str, Any], items: List[tuple]) -> None:
+        for item in items:
+            target = row.get(item[1])
+            if target is None:
+                continue  # SET on null is a no-op
+            if item[0] == "labels":
+                for label in item[2]:
+                    self.graph.add_label(target, label, self.changes)
+            elif item[0] == "property":
+                value = self.evaluate(item[3], row)
+                self.graph.set_property(target, item[2], value, self.changes)
+            else:
+                value = self.evaluate(item[2], row)
+                if isinstance(value, (MemoryNode, MemoryRelationship)):
+                    value = dict(value.properties)
+                value = value or {}
+                if item[0] == "replace":
+                    for key in list(target.properties):
+                        if key not in value:
+                            self.graph.set_property(
+                                target, key, None, self.changes
+                            )
+                for key, v in value.items():
+                    self.graph.set_property(target, key, v, self.changes)
+
+    def remove(self, row: Dict[str, Any], items: List[tuple]) -> None:
+        for item in items:
+            target = row.get(item[1])
+            if target is None:
+                continue
+            if item[0] == "labels":
+                for label in item[2]:
+                    self.graph.remove_label(target, label, self.changes)
+            else:
+                self.graph.set_property(target, item[2], None, self.changes)
+
+    def delete(
+        self, row: Dict[str, Any], detach: bool, exprs: List[Any]
+    ) -> None:
+        for expr in exprs:
+            value = self.evaluate(expr, row)
+            for entity in value if isinstance(value, list) else [value]:
+                if entity is None:
+                    continue
+                if isinstance(entity, MemoryNode):
+                    self.graph.delete_node(entity, detach, self.changes)
+                elif isinstance(entity, MemoryRelationship):
+                    self.graph.delete_relationship(entity, self.changes)
+                else:
+                    raise ClientError(
+                        "Expected a node or relationship to delete"
+                    )
+
+
+# ---------------------------------------------------------------- results
+
+
+class MemorySummary:
+    def __init__(
+        self,
+        query: str,
+        parameters: Dict[str, Any],
+        query_type: str,
+        stats: Dict[str, int],
+        available_after: int,
+    ) -> None:
+        """Mirrors the attributes of `neo4j.ResultSummary` that are used"""
+        self.query = query
+        self.parameters = parameters
+        self.query_type = query_type
+        self.counters = SummaryCounters(stats)
+        self.result_available_after = available_after
+        self.result_consumed_after = 0
+        self.plan = None
+        self.profile = None
+        self.notifications = None
+        self.database = None
+        self.server = None
+
+
+def hydrate(value: Any, graph: MemoryGraph, hydrator: Graph.Hydrator) -> Any:
+    """Converts stored entities into neo4j driver graph objects"""
+    if isinstance(value, MemoryNode):
+        return hydrator.hydrate_node(
+            value.id, frozenset(value.labels), dict(value.properties)
+        )
+    if isinstance(value, MemoryRelationship):
+        rel = hydrator.hydrate_relationship(
+            value.id,
+            value.start,
+            value.end,
+            value.type,
+            dict(value.properties),
+        )
+        for node_id in (value.start, value.end):
+            node = graph.nodes.get(node_id)
+            if node is not None:
+                hydrator.hydrate_node(node.id, frozenset(node.labels), {})
+        return rel
+    if isinstance(value, list):
+        return [hydrate(v, graph, hydrator) for v in value]
+    if isinstance(value, dict):
+        return {k: hydrate(v, graph, hydrator) for k, v in value.items()}
+    return value
+
+
+class MemoryResult:
+    def __init__(
+        self, keys: List[str], records: List[Record], summary: MemorySummary
+    ) -> None:
+        self._keys = tuple(keys)
+        self._records = deque(records)
+        self._summary = summary
+
+    def __iter__(self) -> Iterator[Record]:
+        while self._records:
+            yield self._records.popleft()
+
+    def keys(self) -> tuple:
+        return self._keys
+
+    def single(self) -> Optional[Record]:
+        record = self._records.popleft() if self._records else None
+        self._records.clear()
+        return record
+
+    def peek(self) -> Optional[Record]:
+        return self._records[0] if self._records else None
+
+    def consume(self) -> MemorySummary:
+        self._records.clear()
+        return self._summary
+
+    def value(self, key: Any = 0, default: Any = None) -> List[Any]:
+        return [record.value(key, default) for record in self]
+
+    def values(self, *keys: Any) -> List[List[Any]]:
+        return [record.values(*keys) for record in self]
+
+    def data(self, *keys: Any) -> List[Dict[str, Any]]:
+        return [record.data(*keys) for record in self]
+
+
+# ------------------------------------------------------- driver interface
+
+
+class MemoryTransaction:
+    def __init__(
+        self, driver: "MemoryDriver", read_only: bool = False
+    ) -> None:
+        self.driver = driver
+        self.read_only = read_only
+        self.changes = Changes()
+        self._closed = False
+        self._failed: Optional[Exception] = None
+
+    def __enter__(self) -> "MemoryTransaction":
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback) -> None:
+        if self._closed:
+            return
+        if exception_type is None:
+            self.commit()
+        else:
+            self.rollback()
+
+    def run(
+        self,
+        query: str,
+        parameters: Optional[Dict[str, Any]] = None,
+        **kwparameters: Any,
+    ) -> MemoryResult:
+        if self._closed:
+            raise ClientError("Transaction closed")
+        if self._failed is not None:
+            raise ClientError("Transaction failed") from self._failed
+        try:
+            return self.driver.execute(
+                query,
+                dict(parameters or {}, **kwparameters),
+                self.changes,
+                self.read_only,
+            )
+        except Exception as e:
+            self._failed = e
+            raise
+
+    def commit(self) -> None:
+        if self._closed:
+            raise ClientError("Transaction closed")
+        self._closed = True
+        if self._failed is not None:
+            with self.driver.graph.lock:
+                self.changes.rollback()
+            raise ClientError("Transaction failed") from self._failed
+        self.changes = Changes()
+
+    def rollback(self) -> None:
+        if self._closed:
+            raise ClientError("Transaction closed")
+        self._closed = True
+        with self.driver.graph.lock:
+            self.changes.rollback()
+
+    def close(self) -> None:
+        if not self._closed:
+            self.rollback()
+
+    def closed(self) -> bool:
+        return self._closed
+
+
+class MemorySession:
+    def __init__(self, driver: "MemoryDriver", **config: Any) -> None:
+        self.driver = driver
+        self.config = config
+        self.read_only = config.get("default_access_mode") == READ_ACCESS
+        self.transaction: Optional[MemoryTransaction] = None
+
+    def __enter__(self) -> "MemorySession":
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback) -> None:
+        self.close()
+
+    def run(
+        self,
+        query: str,
+        parameters: Optional[Dict[str, Any]] = None,
+        **kwparameters: Any,
+    ) -> MemoryResult:
+        changes = Changes()
+        return self.driver.execute(
+            query,
+            dict(parameters or {}, **kwparameters),
+            changes,
+            self.read_only,
+        )
+
+    def begin_transaction(
+        self,
+        metadata: Any = None,
+        timeout: Any = None,
+        read_only: Optional[bool] = None,
+    ) -> MemoryTransaction:
+        if self.transaction is not None and not self.transaction.closed():
+            raise ClientError(
+                "Explicit transaction already open in this session"
+            )
+        self.transaction = MemoryTransaction(
+            self.driver, self.read_only if read_only is None else read_only
+        )
+        return self.transaction
+
+    def run_transaction(
+        self, read_only: bool, function: Callable, *args: Any, **kwargs: Any
+    ) -> Any:
+        tx = self.begin_transaction(read_only=read_only)
+        try:
+            ret = function(tx, *args, **kwargs)
+        except Exception:
+            tx.close()
+            raise
+        tx.commit()
+        return ret
+
+    def read_transaction(
+        self, function: Callable, *args: Any, **kwargs: Any
+    ) -> Any:
+        return self.run_transaction(True, function, *args, **kwargs)
+
+    def write_transaction(
+        self, function: Callable, *args: Any, **kwargs: Any
+    ) -> Any:
+        return self.run_transaction(False, function, *args, **kwargs)
+
+    execute_read = read_transaction
+    execute_write = write_transaction
+
+    def last_bookmark(self) -> None:
+        return None
+
+    def close(self) -> None:
+        if self.transaction is not None:
+            self.transaction.close()
+            self.transaction = None
+
+
+class MemoryDriver:
+    def __init__(self) -> None:
+        """Drop-in for `neo4j.Neo4jDriver` backed by a `MemoryGraph`"""
+        self.graph = MemoryGraph()
+
+    def session(self, **config: Any) -> MemorySession:
+        return MemorySession(self, **config)
+
+    def execute(
+        self,
+        query: str,
+        parameters: Dict[str, Any],
+        changes: Changes,
+        read_only: bool = False,
+    ) -> MemoryResult:
+        """Runs one statement. On error its own changes are undone,
+        otherwise they are added to `changes`.
+        :param read_only:
+            refuse the statement if it writes, as in a READ_ACCESS session
+        """
+        start = time.perf_counter()
+        schema = SCHEMA_RE.match(query)
+        if schema is not None:
+            if read_only:
+                raise ClientError(READ_ACCESS_ERROR)
+            return self.execute_schema(query, parameters, schema, start)
+        clauses = parse(query)
+        statement = Changes()
+        execution = Execution(self.graph, parameters, statement)
+        with self.graph.lock:
+            try:
+                keys, rows = execution.run(clauses)
+            except Unbound as e:
+                statement.rollback()
+                raise CypherSyntaxError(f"Variable `{e}` not defined") from e
+            except Exception:
+                statement.rollback()
+                raise
+            if read_only and execution.writes:
+                statement.rollback()
+                raise ClientError(READ_ACCESS_ERROR)
+            graph = Graph()
+            hydrator = Graph.Hydrator(graph)
+            records = [
+                Record(
+                    (key, hydrate(row[key], self.graph, hydrator))
+                    for key in keys
+                )
+                for row in rows
+            ]
+        changes.extend(statement)
+        if execution.writes:
+            query_type = "rw" if execution.reads else "w"
+        else:
+            query_type = "r"
+        summary = MemorySummary(
+            query,
+            parameters,
+            query_type,
+            statement.stats,
+            int(1000 * (time.perf_counter() - start)),
+        )
+        return MemoryResult(keys, records, summary)
+
+    def execute_schema(
+        self,
+        query: str,
+        parameters: Dict[str, Any],
+        schema: "re.Match",
+        start: float,
+    ) -> MemoryResult:
+        """CREATE CONSTRAINT/INDEX on one node property. Not undone by a
+        rollback, as with a server they cannot share a transaction with
+        data changes.
+        """
+        unique = schema.group("kind").upper() == "CONSTRAINT"
+        if schema.group("var") != schema.group("target") or unique != bool(
+            schema.group("unique")
+        ):
+            raise CypherSyntaxError(f"Unsupported schema statement: {query}")
+        with self.graph.lock:
+            added = self.graph.create_index(
+                schema.group("name"),
+                schema.group("label"),
+                schema.group("key"),
+                unique,
+                bool(schema.group("exists")),
+            )
+        stats = {}
+        if added:
+            stats["constraints-added" if unique else "indexes-added"] = 1
+        summary = MemorySummary(
+            query,
+            parameters,
+            "s",
+            stats,
+            int(1000 * (time.perf_counter() - start)),
+        )
+        return MemoryResult([], [], summary)
+
+    def verify_connectivity(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
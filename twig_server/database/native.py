@@ -2,29 +2,106 @@
 # mostly holds helper classes
 
 
-from typing import Any, List, Mapping, Optional
+from typing import Any, Dict, List, Mapping, Optional, Tuple, Type, TypeVar
+from flask import g, has_request_context
 from twig_server.database.connection import Neo4jConnection
 from neo4j import Neo4jDriver, Result, Record
 
 import twig_server.app as app
 
+NodeType = TypeVar("NodeType", bound="Node")
+
+
+def identity_map() -> Optional[Dict[Tuple[type, int], "Node"]]:
+    """Nodes loaded during the current request, keyed by (class, uid).
+    Outside of a request there is no identity map and `None` is returned.
+    """
+    if not has_request_context():
+        return None
+    if "identity_map" not in g:
+        g.identity_map = {}
+    return g.identity_map
+
+
 class Node:
     def __init__(
         self, conn: Neo4jConnection, uid: Optional[int] = None
     ) -> None:
-        """Initialize a new Node in Neo4J"""
+        """Initialize a new Node in Neo4J
+        Nothing is read from the database until `properties` or `db_obj`
+        is accessed (or `query_uid` is called explicitly).
+        """
 
         # represents properties locally
-        self.properties: Mapping[str, Any] = {}
+        self._properties: Dict[str, Any] = {"uid": uid}
 
         # represents the data in the database
-        self.db_obj: Optional[Record] = None
+        self._db_obj: Optional[Record] = None
+
+        # whether _properties/_db_obj reflect the database yet
+        self._loaded: bool = False
 
-        self.properties["uid"] = uid
         self.conn: Neo4jConnection = conn
         self.db_conn: Neo4jDriver = conn.conn
 
-        self.query_uid()  # try to retrieve existing database info for EXISTING UID
+        # relationship from the parent given to `create`, if any
+        self.parent_rls: Optional[Relationship] = None
+
+    @classmethod
+    def lookup(
+        cls: Type[NodeType], conn: Neo4jConnection, uid: int
+    ) -> NodeType:
+        """Returns the instance of this class for `uid`. Within a request
+        the same instance is returned every time, so it is loaded at most once.
+        """
+        objects = identity_map()
+        key = (cls, int(uid))
+        if objects is not None and key in objects:
+            node = objects[key]
+            assert isinstance(node, cls)  # keyed by class
+            return node
+        node = cls(conn, uid=int(uid))
+        if objects is not None:
+            objects[key] = node
+        return node
+
+    def register(self) -> None:
+        """Adds this (loaded) node to the identity map of the request"""
+        objects = identity_map()
+        uid = self._properties.get("uid")
+        if objects is not None and uid is not None:
+            objects[(type(self), int(uid))] = self
+
+    @property
+    def properties(self) -> Dict[str, Any]:
+        if not self._loaded:
+            self.load()
+        return self._properties
+
+    @properties.setter
+    def properties(self, properties: Dict[str, Any]) -> None:
+        self._properties = properties
+        self._loaded = True
+
+    @property
+    def db_obj(self) -> Optional[Record]:
+        if not self._loaded:
+            self.load()
+        return self._db_obj
+
+    @db_obj.setter
+    def db_obj(self, db_obj: Optional[Record]) -> None:
+        self._db_obj = db_obj
+        self._loaded = True
+
+    @property
+    def uid(self) -> Optional[int]:
+        """uid known locally, does not trigger a load"""
+        return self._properties.get("uid", None)
+
+    def load(self) -> None:
+        """Retrieves existing database info, called on first access"""
+        self.query_uid()
 
     # sync local properties with database data
     @classmethod
@@ -37,46 +114,92 @@ class Node:
         return properties
     def sync_properties(self) -> None:
         self.properties = {}
-        if self.db_obj == None:
+        if self._db_obj == None:
             return  # if no response, properties will be empty
-        assert self.db_obj is not None  # for type checking
-        self.properties = Node.extract_properties(self.db_obj)
+        assert self._db_obj is not None  # for type checking
+        self.properties = Node.extract_properties(self._db_obj)
 
     def query_uid(self, label_name: Optional[str] = None) -> Optional[Record]:
-        if "uid" not in self.properties:  # querying for this UID
+        self._loaded = True
+        if "uid" not in self._properties:  # querying for this UID
+            return None
+        try:
+            num_uid = int(self._properties["uid"])
+        except:
+            num_uid = None
+        if num_uid is None:  # nothing can match, skip the round trip
+            self.db_obj = None
+            self.sync_properties()
             return None
         queryStr = f"MATCH (n{(':'+label_name) if label_name else ''}) WHERE id(n)=$uid RETURN n"
-        with self.db_conn.session() as session:
-            try:
-                num_uid = int(self.properties["uid"])
-            except:
-                num_uid = None
+        with self.conn.session() as session:
             res = session.run(queryStr, {"uid": num_uid})
             self.db_obj = self.extract_node(res)
             self.sync_properties()
-        return self.db_obj
+        return self._db_obj
 
     def delete(self) -> None:
-        if "uid" not in self.properties:
+        if "uid" not in self._properties:
             raise Exception("No UID to delete")
         queryStr = f"MATCH (n) WHERE id(n)=$uid DETACH DELETE n"
-        with self.db_conn.session() as session:
-            res = session.run(queryStr, {"uid": self.properties["uid"]})
+        with self.conn.session() as session:
+            res = session.run(queryStr, {"uid": self._properties["uid"]})
             self.db_obj = self.extract_node(res)
 
             self.sync_properties()
 
-    def create(self, label_name: str) -> Record:
+    def create(
+        self,
+        label_name: str,
+        properties: Optional[Mapping[str, Any]] = None,
+        parent: Optional["Node"] = None,
+        parent_rls_label: Optional[str] = None,
+    ) -> Record:
+        """Creates the node with its initial properties in one statement
+        :param label_name:
+            label of the new node
+        :param properties:
+            initial properties, `None` values are skipped
+        :param parent:
+            existing node that gets a `parent_rls_label` relationship
+            pointing to the new node, created in the same transaction.
+            If the parent does not exist, nothing is created.
+        """
         if "uid" in self.properties:
             if self.properties["uid"] is not None:
                 return self.db_obj
-        queryStr = (
-            f"CREATE (n{(':'+label_name) if label_name else ''}) RETURN n"
-        )
-        with self.db_conn.session() as session:
-            res: Result = session.run(queryStr)
-            self.db_obj = self.extract_node(res)
+        props = {
+            key: value
+            for key, value in (properties or {}).items()
+            if value is not None
+        }
+        label = (':'+label_name) if label_name else ''
+        if parent is None:
+            queryStr = f"CREATE (n{label} $props) RETURN n"
+            params: Dict[str, Any] = {"props": props}
+        else:
+            rls_label = (':'+parent_rls_label) if parent_rls_label else ''
+            queryStr = f"MATCH (p) WHERE id(p)=$parent_id \
+                CREATE (p)-[e{rls_label}]->(n{label} $props) RETURN n, e"
+            assert parent.uid is not None
+            params = {
+                "props": props,
+                "parent_id": int(parent.uid),
+            }
+        with self.conn.session() as session:
+            res: Result = session.run(queryStr, params)
+            row = res.single()
+            self.db_obj = row[0] if row else None
             self.sync_properties()
+            if row and parent is not None:
+                self.parent_rls = Relationship(
+                    self.conn,
+                    a_id=parent.uid,
+                    b_id=self.uid,
+                )
+                self.parent_rls.db_obj = row[1]
+                self.parent_rls.sync_properties()
+        self.register()
         return self.db_obj
 
     def extract_node(self, res: Result) -> Optional[Record]:
@@ -89,20 +212,82 @@ class Node:
         return row
 
     def set(self, name: str, value: str) -> Optional[Record]:
-        if "uid" not in self.properties:
+        if "uid" not in self._properties:
             return None
         queryStr = (
             f"MATCH (n) WHERE id(n)=$uid SET n.`{name}` = $value RETURN n"
         )
-        with self.db_conn.session() as session:
+        with self.conn.session() as session:
             res = session.run(
                 queryStr,
-                {"uid": self.properties["uid"], "name": name, "value": value},
+                {"uid": self._properties["uid"], "name": name, "value": value},
             )
             self.db_obj = self.extract_node(res)
             self.sync_properties()
         return self.db_obj
 
+    @staticmethod
+    def check_patch(properties: Mapping[str, Any]) -> None:
+        """
+        :raises ValueError:
+            if `properties` cannot be stored as they are: keys have to be
+            non empty strings other than `uid`, values scalars or lists
+            of scalars
+        """
+        for key, value in properties.items():
+            if not isinstance(key, str) or key == "" or key == "uid":
+                raise ValueError(f"cannot set property {key!r}")
+            values = value if isinstance(value, list) else [value]
+            for item in values:
+                if isinstance(item, (dict, list)):
+                    raise ValueError(f"{key} must be a scalar or a list of scalars")
+
+    def patch(self, properties: Mapping[str, Any]) -> Optional[Record]:
+        """Sets every property of `properties` in one statement, instead of
+        a `set` per key, and reloads the node once. `None` removes the key.
+        :raises ValueError:
+            see `check_patch`, nothing is written then
+        """
+        if "uid" not in self._properties:
+            return None
+        return self.patch_matched(
+            ("MATCH (n) WHERE id(n)=$uid ",
+             {"uid": self._properties["uid"]}),
+            properties,
+        )
+
+    def patch_matched(
+        self, match: Tuple[str, Dict[str, Any]], properties: Mapping[str, Any]
+    ) -> Optional[Record]:
+        """`patch` through `match`, a MATCH clause binding this node as `n`
+        and its parameters. Nothing is written if it does not match.
+        :returns: the node, `None` if `match` did not match
+        :raises ValueError:
+            see `check_patch`
+        """
+        Node.check_patch(properties)
+        queryStr, params = match
+        queryStr += "SET n += $props RETURN n"
+        with self.conn.session() as session:
+            res = session.run(
+                queryStr, {**params, "props": dict(properties)})
+            self.db_obj = self.extract_node(res)
+            self.sync_properties()
+        return self.db_obj
+
+    def delete_matched(self, match: Tuple[str, Dict[str, Any]]) -> bool:
+        """Deletes this node and its relationships through `match`, see
+        `patch_matched`
+        :returns: whether `match` matched
+        """
+        queryStr, params = match
+        queryStr += "WITH n, id(n) AS uid DETACH DELETE n RETURN uid"
+        with self.conn.session() as session:
+            row = session.run(queryStr, params).single()
+        self.db_obj = None
+        self.sync_properties()
+        return row is not None
+
     def get(self, name: str) -> Optional[str]:
         if name not in self.properties:
             return None
@@ -139,7 +324,7 @@ class Relationship:
         queryStr = f"MATCH (a),(b) \
               WHERE id(a)=$a_id AND id(b)=$b_id \
               CREATE (a)-[n{(':'+label_name) if label_name else ''}]->(b) RETURN n"
-        with self.db_conn.session() as session:
+        with self.conn.session() as session:
             res: Result = session.run(
                 queryStr, {"a_id": int(self.a_id), "b_id": int(self.b_id)}
             )
@@ -175,7 +360,7 @@ class Relationship:
         assert self.a_id is not None
         assert self.b_id is not None
         queryStr: str = f"MATCH (a)-[n{(':'+label_name) if label_name else ''}]->(b) WHERE id(a)=$a_id AND id(b)=$b_id RETURN n"
-        with self.db_conn.session() as session:
+        with self.conn.session() as session:
             res = session.run(queryStr, 
                             {
                                 "a_id": int(self.a_id),
@@ -186,7 +371,7 @@ class Relationship:
         return self.db_obj
     def query_uid(self, label_name: Optional[str] = None) -> Optional[Result]:
         queryStr: str = f"MATCH (a)-[n{(':'+label_name) if label_name else ''}]->(b) WHERE id(n)=$uid RETURN n"
-        with self.db_conn.session() as session:
+        with self.conn.session() as session:
             res = session.run(queryStr, {"uid": self.properties["uid"]})
             self.db_obj = Relationship.extract_relationship(res)
             self.sync_properties()
@@ -197,7 +382,7 @@ class Relationship:
         if "uid" not in self.properties:
             raise Exception("No UID to delete")
         queryStr = f"MATCH (a)-[n]->(b) WHERE id(n)=$uid DELETE n"
-        with self.db_conn.session() as session:
+        with self.conn.session() as session:
             res = session.run(queryStr, {"uid": self.properties["uid"]})
             self.db_obj = Relationship.extract_relationship(res)
 
@@ -205,7 +390,7 @@ class Relationship:
 
     @classmethod
     # TODO fix some circular imports
-    def list_relationships(cls, db_conn: Neo4jDriver, project: Any) -> List[Record]:
+    def list_relationships(cls, db_conn: Neo4jConnection, project: Any) -> List[Record]:
         # queryStr = f"MATCH (n:{Project._label_name})\
         #             -[{Resource._label_project_relationship}]->\
         #             (m:{Resource._label_name}) \
@@ -214,7 +399,7 @@ class Relationship:
         #         WHERE id(n)=$uid \
         #         RETURN m,e,a"
         queryStr = f"MATCH (n:Project)\
-                    -[Has_Resource]->\
+                    -[:Has_Resource]->\
                     (m:Resource) \
                     -[e]-> \
                     (a:Resource) \
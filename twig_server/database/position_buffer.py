@@ -0,0 +1,161 @@
+# write-behind buffer for resource positions. Dragging nodes sends
+# /positions/update many times a second; with POSITION_WRITE_BEHIND the
+# positions are kept per project in memory, the last one per resource
+# wins, and a flusher thread writes them in one statement per project
+# every POSITION_FLUSH_INTERVAL seconds, or sooner once
+# POSITION_FLUSH_SIZE positions are pending, and when the process exits.
+
+import atexit
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from flask import Flask
+
+from twig_server.database.connection import Neo4jConnection
+from twig_server.database.Project import Project
+from twig_server.database.unit_of_work import unit_of_work_scope
+
+buffer_logger = logging.getLogger("twig_server.position_buffer")
+
+# resource uid -> (x, y)
+Positions = Dict[int, Tuple[int, int]]
+
+
+class PositionBuffer:
+    def __init__(
+        self,
+        conn: Neo4jConnection,
+        interval: float = 0.5,
+        flush_size: int = 1000,
+        start: bool = True,
+    ) -> None:
+        """
+        :param interval:
+            seconds between flushes
+        :param flush_size:
+            pending positions, over all projects, that trigger a flush
+            before the interval is up
+        :param start:
+            whether to start the flusher thread, without it only `flush`
+            writes
+        """
+        self.conn = conn
+        self.interval = interval
+        self.flush_size = max(1, flush_size)
+        self.lock = threading.Lock()
+        # project uid -> positions not written yet
+        self.pending: Dict[int, Positions] = {}
+        # positions being written, still shown to readers until they are
+        self.flushing: Dict[int, Positions] = {}
+        self.flush_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stopped = False
+        self.thread: Optional[threading.Thread] = None
+        if start:
+            self.thread = threading.Thread(
+                target=self.run, name="twig-position-flusher", daemon=True
+            )
+            self.thread.start()
+
+    def add(self, project_id: int, positions: Dict[str, Any]) -> List[str]:
+        """Buffers `positions` (resource uid -> `{'x': ..., 'y': ...}`).
+        Whether the resources belong to the project is only checked when
+        they are flushed, positions of other resources are dropped then.
+        :returns:
+            the malformed uids, which were not buffered
+        """
+        parsed: Positions = {}
+        skipped = []
+        for uid in positions:
+            try:
+                pos = positions[uid]
+                parsed[int(uid)] = (round(pos["x"]), round(pos["y"]))
+            except (KeyError, TypeError, ValueError, OverflowError):
+                skipped.append(uid)
+        with self.lock:
+            self.pending.setdefault(int(project_id), {}).update(parsed)
+            size = sum(len(p) for p in self.pending.values())
+        if size >= self.flush_size:
+            self.wake.set()
+        return skipped
+
+    def positions(self, project_id: int) -> Positions:
+        """Positions of the project not in the database yet"""
+        with self.lock:
+            ret = dict(self.flushing.get(int(project_id), {}))
+            ret.update(self.pending.get(int(project_id), {}))
+        return ret
+
+    def flush(self) -> int:
+        """Writes every pending position, one unit of work per project.
+        Positions of a project whose write failed are pending again,
+        unless newer ones arrived in the meantime.
+        :returns:
+            how many positions were written, not counting those of
+            resources that are no longer in the project
+        """
+        with self.flush_lock:
+            with self.lock:
+                self.flushing, self.pending = self.pending, {}
+            written = 0
+            for project_id, positions in list(self.flushing.items()):
+                try:
+                    with unit_of_work_scope(self.conn):
+                        skipped = Project(
+                            self.conn, uid=project_id
+                        ).update_positions(
+                            {
+                                str(uid): {"x": x, "y": y}
+                                for uid, (x, y) in positions.items()
+                            }
+                        )
+                    # e.g. resources deleted while their positions waited
+                    written += len(positions) - len(skipped)
+                except Exception:
+                    buffer_logger.exception(
+                        "writing %d positions of project %d failed",
+                        len(positions),
+                        project_id,
+                    )
+                    with self.lock:
+                        newer = self.pending.setdefault(project_id, {})
+                        for uid, pos in positions.items():
+                            newer.setdefault(uid, pos)
+                with self.lock:
+                    del self.flushing[project_id]
+            return written
+
+    def run(self) -> None:
+        while not self.stopped:
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            if not self.stopped:
+                self.flush()
+
+    def close(self) -> None:
+        """Stops the flusher and writes what is left"""
+        self.stopped = True
+        self.wake.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.flush()
+
+
+def init_app(app: Flask) -> Optional[PositionBuffer]:
+    """With POSITION_WRITE_BEHIND, a buffer stored as
+    `app.config["position_buffer"]` and flushed when the process exits.
+    Otherwise `None`, and positions are written by the request.
+    """
+    if not app.config.get("POSITION_WRITE_BEHIND"):
+        app.config["position_buffer"] = None
+        return None
+    interval = app.config.get("POSITION_FLUSH_INTERVAL")
+    buffer = PositionBuffer(
+        app.config["driver"],
+        0.5 if interval is None else interval,
+        app.config.get("POSITION_FLUSH_SIZE") or 1000,
+    )
+    atexit.register(buffer.close)
+    app.config["position_buffer"] = buffer
+    return buffer
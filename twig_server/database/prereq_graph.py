@@ -0,0 +1,516 @@
+# prerequisite graph of a project for the analytics routes. `(a)-[:prereq]->(b)`
+# means a has to be learnt before b. The graph is read in one query into
+# integer-indexed adjacency lists and kept per project. A newer project
+# version replays the change log onto it instead of reading it again, and
+# computed results are kept until a resource or prereq changes.
+# A topological order is kept along with it and repaired locally when a
+# prereq is added (Pearce and Kelly), so checking whether a new prereq
+# closes a cycle only searches the resources between its two ends.
+
+import heapq
+import threading
+from collections import Counter, OrderedDict
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
+
+from flask import Flask
+
+from twig_server.database.connection import Neo4jConnection
+from twig_server.database.Project import Project
+from twig_server.database.Resource import Resource
+
+# per project, results for single resources beyond this are evicted
+RESULTS_KEPT = 256
+
+
+class PrereqGraph:
+    def __init__(self, version: int) -> None:
+        """Empty graph of a project at `version`, see `load`"""
+        self.version: int = version
+        # index -> resource uid, None once the resource was deleted
+        self.uids: List[Optional[int]] = []
+        self.index: Dict[int, int] = {}
+        # index -> indices of the resources it is a prereq of, and back
+        self.succ: List[List[int]] = []
+        self.pred: List[List[int]] = []
+        # relationship uid -> (a, b) indices
+        self.edges: Dict[int, Tuple[int, int]] = {}
+        # index -> slot in a topological order, prereqs in lower slots.
+        # Only meaningful while the graph is `acyclic`.
+        self.ord: List[int] = []
+        self.acyclic: bool = True
+        # held while the graph is updated or a result computed
+        self.lock = threading.RLock()
+        # set when a change could not be replayed, the graph is reloaded
+        self.stale: bool = False
+        self.results: "OrderedDict[Tuple[Any, ...], Any]" = OrderedDict()
+
+    @classmethod
+    def load(
+        cls, db_conn: Neo4jConnection, project: Project
+    ) -> Optional["PrereqGraph"]:
+        """
+        reads the resources of `project` and the prereqs between them in one
+        query, loading the project node into `project`
+        :returns:
+            the graph, `None` if the project does not exist
+        """
+        queryStr = f"MATCH (p:{Project._label_name}) WHERE id(p)=$uid \
+              OPTIONAL MATCH (p)\
+                    -[:{Resource._label_project_relationship}]->\
+                    (r:{Resource._label_name}) \
+              OPTIONAL MATCH (r)\
+                    -[e:{Resource._label_prereq_relationship}]->\
+                    (b:{Resource._label_name}) \
+              WITH p, r, collect({{uid: id(e), b: id(b)}}) AS edges \
+              RETURN p, collect({{uid: id(r), edges: edges}}) AS resources"
+        assert project.uid is not None
+        with db_conn.session() as session:
+            res = session.run(queryStr, {"uid": int(project.uid)})
+            row = res.single()
+        project.db_obj = row["p"] if row else None
+        project.sync_properties()
+        if row is None:
+            return None
+        graph = cls(project.properties.get(Project._version_property, 0))
+        resources = [x for x in row["resources"] if x["uid"] is not None]
+        for uid in sorted(x["uid"] for x in resources):
+            graph.add_node(uid)
+        for x in resources:
+            for e in x["edges"]:
+                if e["uid"] is not None:
+                    graph.link(e["uid"], x["uid"], e["b"])
+        graph.reset_order()
+        return graph
+
+    def add_node(self, uid: int) -> None:
+        if uid in self.index:
+            return
+        self.index[uid] = len(self.uids)
+        # no prereqs yet, so last is as good as anywhere
+        self.ord.append(len(self.uids))
+        self.uids.append(uid)
+        self.succ.append([])
+        self.pred.append([])
+
+    def remove_node(self, uid: int) -> None:
+        i = self.index.pop(uid, None)
+        if i is None:
+            return
+        for edge in [e for e, (a, b) in self.edges.items() if i in (a, b)]:
+            self.remove_edge(edge)
+        self.uids[i] = None
+
+    def add_edge(self, edge: int, a: int, b: int) -> None:
+        """Prereq `edge` from resource `a` to `b`, repairing the order.
+        Edges to or from resources outside the project are left out.
+        """
+        if self.link(edge, a, b) and self.acyclic:
+            self.repair_order(*self.edges[edge])
+
+    def link(self, edge: int, a: int, b: int) -> bool:
+        """`add_edge` without touching the order
+        :returns: whether the edge was added
+        """
+        if a not in self.index or b not in self.index or edge in self.edges:
+            return False
+        i, j = self.index[a], self.index[b]
+        self.edges[edge] = (i, j)
+        self.succ[i].append(j)
+        self.pred[j].append(i)
+        return True
+
+    def remove_edge(self, edge: int) -> None:
+        if edge not in self.edges:
+            return
+        i, j = self.edges.pop(edge)
+        self.succ[i].remove(j)
+        self.pred[j].remove(i)
+
+    def catch_up(self, changes: List[Dict[str, Any]], version: int) -> bool:
+        """Replays the change log entries (see `Project.list_changes`)
+        after `self.version` up to `version`
+        :returns:
+            `False` if an entry cannot be replayed, the graph is stale then
+        """
+        if self.stale:
+            return False
+        structural = False
+        for change in changes:
+            if change["seq"] <= self.version:
+                continue
+            kind, op = change["kind"], change["op"]
+            if kind == "resource" and op == "created":
+                self.add_node(change["uid"])
+            elif kind == "resource" and op == "deleted":
+                self.remove_node(change["uid"])
+            elif kind == "relationship" and op == "created":
+                data = change["data"] or {}
+                if "a" not in data or "b" not in data:
+                    self.stale = True
+                    return False
+                self.add_edge(change["uid"], int(data["a"]), int(data["b"]))
+            elif kind == "relationship" and op == "deleted":
+                self.remove_edge(change["uid"])
+            else:
+                continue
+            structural = True
+        if structural:
+            self.results.clear()
+            if not self.acyclic:
+                # removals may have broken the cycles
+                self.reset_order()
+        self.version = max(self.version, version)
+        return True
+
+    def reset_order(self) -> None:
+        """Orders the whole graph again"""
+        order, cyclic = self.topological_order()
+        for slot, uid in enumerate(order + cyclic):
+            self.ord[self.index[uid]] = slot
+        self.acyclic = not cyclic
+
+    def search(
+        self,
+        start: int,
+        adjacency: List[List[int]],
+        keep: Callable[[int], bool],
+    ) -> Dict[int, int]:
+        """Indices reachable from `start` over `adjacency` through
+        indices `keep(index)` accepts
+        :returns: each of them -> the index it was reached from
+        """
+        parent = {start: -1}
+        stack = [start]
+        while stack:
+            i = stack.pop()
+            for j in adjacency[i]:
+                if j not in parent and keep(j):
+                    parent[j] = i
+                    stack.append(j)
+        return parent
+
+    def repair_order(self, i: int, j: int) -> None:
+        """Restores the order after a prereq from `i` to `j` was added.
+        Only the resources between the two slots that `j` leads to or that
+        lead to `i` are moved, keeping the slots they had between them.
+        """
+        low, high = self.ord[j], self.ord[i]
+        if low > high:
+            return
+        after = self.search(j, self.succ, lambda k: self.ord[k] <= high)
+        if i in after:
+            self.acyclic = False
+            return
+        before = self.search(i, self.pred, lambda k: self.ord[k] >= low)
+        moved = sorted(before, key=self.ord.__getitem__) + sorted(
+            after, key=self.ord.__getitem__
+        )
+        slots = sorted(self.ord[k] for k in moved)
+        for k, slot in zip(moved, slots):
+            self.ord[k] = slot
+
+    def check_edge(self, a: int, b: int) -> Optional[List[int]]:
+        """Whether a prereq from resource `a` to `b` would close a cycle.
+        With the graph in order only resources ordered between `b` and `a`
+        are searched. Resources outside the project close nothing.
+        :returns:
+            the path of uids from `b` to `a` the prereq would close, `None`
+            if there is none
+        """
+        with self.lock:
+            if a not in self.index or b not in self.index:
+                return None
+            i, j = self.index[a], self.index[b]
+            if self.acyclic:
+                high = self.ord[i]
+                if self.ord[j] > high:
+                    return None
+                parent = self.search(
+                    j, self.succ, lambda k: self.ord[k] <= high
+                )
+            else:
+                parent = self.search(j, self.succ, lambda k: True)
+            if i not in parent:
+                return None
+            path = []
+            while i != -1:
+                path.append(i)
+                i = parent[i]
+            return self.to_uids(path[::-1])
+
+    def check_edges(
+        self,
+        added: Sequence[Tuple[int, int]],
+        removed: Iterable[int] = (),
+        removed_nodes: Iterable[int] = (),
+    ) -> Optional[int]:
+        """Whether adding the prereqs `added`, as (a, b) resource uids,
+        and removing the prereqs `removed` and the resources
+        `removed_nodes` at once would close a cycle, in one pass over the
+        graph. Resources the graph does not know, e.g. new ones, are added.
+        Cycles the graph already had are not held against `added`.
+        :returns:
+            the index in `added` of the last prereq on a new cycle, `None`
+            if there is none
+        """
+        with self.lock:
+            extra: Dict[int, int] = {}
+
+            def node(uid: int) -> int:
+                if uid in self.index:
+                    return self.index[uid]
+                return extra.setdefault(uid, len(self.uids) + len(extra))
+
+            dead = set(removed_nodes)
+            pairs = [
+                (-1, -1) if a in dead or b in dead else (node(a), node(b))
+                for a, b in added
+            ]
+            gone = {self.index[uid] for uid in dead if uid in self.index}
+            dropped = Counter(
+                self.edges[e] for e in removed if e in self.edges
+            )
+            succ: List[List[int]] = [
+                [] for _ in range(len(self.uids) + len(extra))
+            ]
+            for i, targets in enumerate(self.succ):
+                if i in gone:
+                    continue
+                for j in targets:
+                    if dropped[(i, j)]:
+                        dropped[(i, j)] -= 1
+                    elif j not in gone:
+                        succ[i].append(j)
+            for i, j in pairs:
+                if i != -1:
+                    succ[i].append(j)
+            core = cycle_core(succ)
+            if not core:
+                return None
+            old = set() if self.acyclic else cycle_core(self.succ)
+            # the last one on it is the one that closes it
+            for n in range(len(pairs) - 1, -1, -1):
+                i, j = pairs[n]
+                if i in core and j in core and not (i in old and j in old):
+                    return n
+            return None
+
+    def cached(self, key: Tuple[Any, ...], compute: Any) -> Any:
+        """`compute()`, kept under `key` until the graph changes"""
+        with self.lock:
+            if key in self.results:
+                self.results.move_to_end(key)
+                return self.results[key]
+            ret = compute()
+            self.results[key] = ret
+            if len(self.results) > RESULTS_KEPT:
+                self.results.popitem(last=False)
+            return ret
+
+    def topological_order(self) -> Tuple[List[int], List[int]]:
+        """
+        :returns:
+            every resource after its prereqs, ties going to the resource
+            read or created first, and the resources that cannot be ordered because they are on or after
+            a prereq cycle
+        """
+
+        def compute() -> Tuple[List[int], List[int]]:
+            indegree = [len(p) for p in self.pred]
+            ready = [
+                i
+                for i, uid in enumerate(self.uids)
+                if uid is not None and indegree[i] == 0
+            ]
+            heapq.heapify(ready)
+            order = []
+            while ready:
+                i = heapq.heappop(ready)
+                order.append(i)
+                for j in self.succ[i]:
+                    indegree[j] -= 1
+                    if indegree[j] == 0:
+                        heapq.heappush(ready, j)
+            cyclic = [
+                i
+                for i, uid in enumerate(self.uids)
+                if uid is not None and indegree[i] > 0
+            ]
+            return self.to_uids(order), self.to_uids(cyclic)
+
+        return self.cached(("order",), compute)
+
+    def positions(self) -> Dict[int, int]:
+        """resource uid -> its position in `topological_order`"""
+
+        def compute() -> Dict[int, int]:
+            order, cyclic = self.topological_order()
+            return {uid: n for n, uid in enumerate(order + cyclic)}
+
+        return self.cached(("positions",), compute)
+
+    def reachable(self, uid: int, adjacency: List[List[int]]) -> List[int]:
+        """uids reachable from `uid` over `adjacency`, in learning order"""
+        start = self.index[uid]
+        seen = bytearray(len(self.uids))
+        seen[start] = 1
+        stack = [start]
+        found = []
+        while stack:
+            for j in adjacency[stack.pop()]:
+                if not seen[j]:
+                    seen[j] = 1
+                    found.append(j)
+                    stack.append(j)
+        positions = self.positions()
+        return sorted(self.to_uids(found), key=positions.__getitem__)
+
+    def prereqs(self, uid: int) -> List[int]:
+        """every resource that has to be learnt before `uid`
+        :raises KeyError: if `uid` is not a resource of the project
+        """
+        if uid not in self.index:
+            raise KeyError(uid)
+        return self.cached(
+            ("prereqs", uid), lambda: self.reachable(uid, self.pred)
+        )
+
+    def unlocks(self, uid: int) -> List[int]:
+        """every resource `uid` is a direct or indirect prereq of
+        :raises KeyError: if `uid` is not a resource of the project
+        """
+        if uid not in self.index:
+            raise KeyError(uid)
+        return self.cached(
+            ("unlocks", uid), lambda: self.reachable(uid, self.succ)
+        )
+
+    def longest_chain(self) -> List[int]:
+        """the longest path of prereqs, first prereq first; resources on
+        cycles are left out
+        """
+
+        def compute() -> List[int]:
+            order, _ = self.topological_order()
+            length = [0] * len(self.uids)
+            parent = [-1] * len(self.uids)
+            end = -1
+            for uid in order:
+                i = self.index[uid]
+                for j in self.succ[i]:
+                    if length[i] + 1 > length[j]:
+                        length[j] = length[i] + 1
+                        parent[j] = i
+                if end == -1 or length[i] > length[end]:
+                    end = i
+            chain = []
+            while end != -1:
+                chain.append(end)
+                end = parent[end]
+            return self.to_uids(chain[::-1])
+
+        return self.cached(("chain",), compute)
+
+    def to_uids(self, indices: List[int]) -> List[int]:
+        return [self.uids[i] for i in indices]  # type: ignore[misc]
+
+
+def cycle_core(succ: List[List[int]]) -> Set[int]:
+    """Indices that are both on or after and on or before a cycle of
+    `succ`, every cycle runs through them only
+    """
+    indegree = [0] * len(succ)
+    for targets in succ:
+        for j in targets:
+            indegree[j] += 1
+    ready = [i for i, n in enumerate(indegree) if n == 0]
+    while ready:
+        for j in succ[ready.pop()]:
+            indegree[j] -= 1
+            if indegree[j] == 0:
+                ready.append(j)
+    core = {i for i, n in enumerate(indegree) if n > 0}
+    # peel off what only comes after a cycle
+    outdegree = {i: 0 for i in core}
+    pred: Dict[int, List[int]] = {i: [] for i in core}
+    for i in core:
+        for j in succ[i]:
+            if j in core:
+                outdegree[i] += 1
+                pred[j].append(i)
+    done = [i for i, n in outdegree.items() if n == 0]
+    while done:
+        j = done.pop()
+        core.discard(j)
+        for i in pred[j]:
+            outdegree[i] -= 1
+            if outdegree[i] == 0:
+                done.append(i)
+    return core
+
+
+class PrereqGraphs:
+    def __init__(self, conn: Neo4jConnection, size: int = 32) -> None:
+        """Prereq graphs of the `size` most recently analysed projects"""
+        self.conn = conn
+        self.size = max(1, size)
+        self.lock = threading.Lock()
+        self.graphs: "OrderedDict[int, PrereqGraph]" = OrderedDict()
+
+    def get(self, project: Project) -> Optional[PrereqGraph]:
+        """The graph of `project` at its current version, loading the
+        project. One query: the change log since the cached version, or the
+        whole graph when nothing usable is cached.
+        :returns: `None` if the project does not exist
+        """
+        assert project.uid is not None
+        uid = int(project.uid)
+        with self.lock:
+            graph = self.graphs.get(uid)
+            if graph is not None:
+                self.graphs.move_to_end(uid)
+        if graph is not None:
+            changes = project.list_changes(graph.version)
+            if project.db_obj is None:
+                self.discard(uid)
+                return None
+            if changes is not None:
+                version = project.properties.get(Project._version_property, 0)
+                with graph.lock:
+                    if graph.catch_up(changes, version):
+                        return graph
+        graph = PrereqGraph.load(self.conn, project)
+        if graph is None:
+            self.discard(uid)
+            return None
+        with self.lock:
+            self.graphs[uid] = graph
+            self.graphs.move_to_end(uid)
+            while len(self.graphs) > self.size:
+                self.graphs.popitem(last=False)
+        return graph
+
+    def discard(self, project_id: int) -> None:
+        with self.lock:
+            self.graphs.pop(int(project_id), None)
+
+
+def init_app(app: Flask) -> PrereqGraphs:
+    """Graphs of PREREQ_GRAPH_CACHE_SIZE projects, stored as
+    `app.config["prereq_graphs"]`
+    """
+    graphs = PrereqGraphs(
+        app.config["driver"], app.config.get("PREREQ_GRAPH_CACHE_SIZE") or 32
+    )
+    app.config["prereq_graphs"] = graphs
+    return graphs
@@ -0,0 +1,160 @@
+# opt-in query log: every statement at DEBUG, slow ones as structured
+# records, optionally re-running a sample of slow reads with PROFILE
+
+import json
+import logging
+import queue
+import random
+import threading
+from collections import deque
+from typing import Any, Dict, List, Mapping, Optional
+
+from flask import Flask
+from neo4j import READ_ACCESS, ResultSummary
+
+from twig_server.database.connection import Neo4jConnection
+
+query_logger = logging.getLogger("twig_server.queries")
+slow_query_logger = logging.getLogger("twig_server.slow_queries")
+
+
+def parameter_shape(value: Any) -> Any:
+    """Types and sizes of query parameters, without their values"""
+    if isinstance(value, Mapping):
+        return {key: parameter_shape(v) for key, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        if not value:
+            return "list[0]"
+        return [f"list[{len(value)}]", parameter_shape(value[0])]
+    return type(value).__name__
+
+
+def total_db_hits(profile: Optional[Mapping[str, Any]]) -> Optional[int]:
+    """Sum of dbHits over a PROFILE plan tree"""
+    if profile is None:
+        return None
+    hits = profile.get("dbHits", 0) or 0
+    for child in profile.get("children", []):
+        hits += total_db_hits(child) or 0
+    return hits
+
+
+class QueryLog:
+    def __init__(
+        self,
+        conn: Neo4jConnection,
+        slow_ms: float,
+        profile_sample_rate: float = 0.0,
+        keep: int = 100,
+    ) -> None:
+        """
+        :param conn:
+            Neo4J connection, used to re-run sampled queries with PROFILE
+        :param slow_ms:
+            statements taking at least this long are slow
+        :param profile_sample_rate:
+            fraction of slow read statements re-run with PROFILE
+        :param keep:
+            number of recent slow statements kept in memory
+        """
+        self.conn: Neo4jConnection = conn
+        self.slow_ms: float = slow_ms
+        self.profile_sample_rate: float = profile_sample_rate
+        self.slow: deque = deque(maxlen=keep)
+        self.lock = threading.Lock()
+        self.profile_queue: queue.Queue = queue.Queue(maxsize=keep)
+        self.profile_worker: Optional[threading.Thread] = None
+
+    def observe(
+        self,
+        query: str,
+        parameters: Mapping[str, Any],
+        seconds: float,
+        rows: int,
+        summary: Optional[ResultSummary],
+    ) -> None:
+        record: Dict[str, Any] = {
+            "query": " ".join(query.split()),
+            "parameters": parameter_shape(parameters),
+            "wall_ms": round(1000 * seconds, 3),
+            "rows": rows,
+        }
+        if summary is not None:
+            record["query_type"] = summary.query_type
+            record["available_after_ms"] = summary.result_available_after
+            record["consumed_after_ms"] = summary.result_consumed_after
+            record["counters"] = {
+                key: value
+                for key, value in vars(summary.counters).items()
+                if value and not key.startswith("_")
+            }
+        query_logger.debug(json.dumps(record, default=str))
+        if record["wall_ms"] < self.slow_ms:
+            return
+        slow_query_logger.warning(json.dumps(record, default=str))
+        with self.lock:
+            self.slow.append(record)
+        if (
+            summary is not None
+            and summary.query_type == "r"
+            and random.random() < self.profile_sample_rate
+        ):
+            self.sample_profile(record, query, parameters)
+
+    def sample_profile(
+        self, record: Dict[str, Any], query: str, parameters: Mapping[str, Any]
+    ) -> None:
+        """Queues a PROFILE run, dropped if the worker is behind"""
+        try:
+            self.profile_queue.put_nowait((record, query, dict(parameters)))
+        except queue.Full:
+            return
+        with self.lock:
+            if self.profile_worker is None:
+                self.profile_worker = threading.Thread(
+                    target=self.run_profiles,
+                    name="query-profiler",
+                    daemon=True,
+                )
+                self.profile_worker.start()
+
+    def run_profiles(self) -> None:
+        while True:
+            record, query, parameters = self.profile_queue.get()
+            try:
+                # straight on the driver so the PROFILE run is not logged again
+                assert self.conn.conn is not None
+                with self.conn.conn.session(
+                    default_access_mode=READ_ACCESS
+                ) as session:
+                    summary = session.run(
+                        "PROFILE " + query, parameters
+                    ).consume()
+                with self.lock:
+                    record["profile"] = summary.profile
+                    record["db_hits"] = total_db_hits(summary.profile)
+                slow_query_logger.info(json.dumps(record, default=str))
+            except Exception as e:
+                slow_query_logger.warning("PROFILE failed: %s", e)
+
+    def recent(self) -> List[Dict[str, Any]]:
+        with self.lock:
+            return [dict(record) for record in self.slow]
+
+
+def init_app(app: Flask) -> Optional[QueryLog]:
+    """Installs the query log if NEO4J_QUERY_LOG is set, stored as
+    `app.config["query_log"]` (`None` when disabled)
+    """
+    app.config["query_log"] = None
+    if not app.config.get("NEO4J_QUERY_LOG"):
+        return None
+    query_log = QueryLog(
+        app.config["driver"],
+        slow_ms=app.config.get("NEO4J_SLOW_QUERY_MS") or 100.0,
+        profile_sample_rate=app.config.get("NEO4J_PROFILE_SAMPLE_RATE") or 0.0,
+        keep=app.config.get("NEO4J_SLOW_QUERY_KEEP") or 100,
+    )
+    app.config["driver"].add_summary_listener(query_log.observe)
+    app.config["query_log"] = query_log
+    return query_log
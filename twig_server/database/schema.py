@@ -0,0 +1,155 @@
+# versioned schema migrations, applied in order at startup. Each applied
+# version is recorded as a (:SchemaMigration) node so it only runs once.
+# Add new migrations at the end with the next version, never edit old ones.
+
+import logging
+import re
+from typing import Any, List, Optional, Set, Tuple
+
+from flask import Flask
+
+from twig_server.database.connection import Neo4jConnection
+
+schema_logger = logging.getLogger("twig_server.schema")
+
+# (version, description, statements)
+Migration = Tuple[int, str, List[str]]
+
+MIGRATIONS: List[Migration] = [
+    (
+        1,
+        "unique User.kratos_user_id, index on User.username",
+        [
+            "CREATE CONSTRAINT user_kratos_user_id IF NOT EXISTS "
+            "FOR (n:User) REQUIRE n.kratos_user_id IS UNIQUE",
+            # usernames can be changed to a taken one by /user/update,
+            # so this is an index rather than a constraint
+            "CREATE INDEX user_username IF NOT EXISTS "
+            "FOR (n:User) ON (n.username)",
+        ],
+    ),
+]
+
+_label_name = "SchemaMigration"
+
+UNIQUE_RE = re.compile(
+    r"FOR \((?P<var>\w+):(?P<label>\w+)\) "
+    r"REQUIRE (?P=var)\.(?P<key>\w+) IS UNIQUE",
+    re.IGNORECASE,
+)
+
+# duplicates listed when a unique constraint cannot be created
+DUPLICATES_SHOWN = 20
+
+
+class DuplicateValuesError(RuntimeError):
+    """A unique constraint cannot be created, nodes share the value.
+    Nothing of the migration is applied.
+    """
+
+    def __init__(
+        self, version: int, label: str, key: str, duplicates: List[Any]
+    ) -> None:
+        listed = ", ".join(
+            f"{value!r} (nodes {', '.join(map(str, nodes))})"
+            for value, nodes in duplicates[:DUPLICATES_SHOWN]
+        )
+        if len(duplicates) > DUPLICATES_SHOWN:
+            listed += f" and {len(duplicates) - DUPLICATES_SHOWN} more"
+        super().__init__(
+            f"schema migration {version} makes {label}.{key} unique, but "
+            f"these values are shared by several {label} nodes: {listed}. "
+            "Merge or delete the duplicates and restart."
+        )
+        self.duplicates = duplicates
+
+
+def applied_versions(conn: Neo4jConnection) -> Set[int]:
+    queryStr = f"MATCH (m:{_label_name}) RETURN m.version AS version"
+    with conn.session() as session:
+        return {record["version"] for record in session.run(queryStr)}
+
+
+def duplicates(
+    conn: Neo4jConnection, label: str, key: str
+) -> List[Tuple[Any, List[int]]]:
+    """Values of `key` that more than one `label` node has, with the ids
+    of those nodes
+    """
+    queryStr = f"MATCH (n:{label}) WHERE n.{key} IS NOT NULL \
+        WITH n.{key} AS value, collect(id(n)) AS nodes \
+        WHERE size(nodes) > 1 \
+        RETURN value, nodes ORDER BY value"
+    with conn.session() as session:
+        return [
+            (record["value"], record["nodes"])
+            for record in session.run(queryStr)
+        ]
+
+
+def check_unique(
+    conn: Neo4jConnection, version: int, statements: List[str]
+) -> None:
+    """Checks the data fits the unique constraints the statements create,
+    before any of them runs, so the migration fails with the duplicates
+    rather than the server's first conflict.
+    :raises DuplicateValuesError:
+    """
+    for statement in statements:
+        match = UNIQUE_RE.search(statement)
+        if match is None:
+            continue
+        label, key = match.group("label"), match.group("key")
+        found = duplicates(conn, label, key)
+        if found:
+            raise DuplicateValuesError(version, label, key, found)
+
+
+def migrate(
+    conn: Neo4jConnection, migrations: Optional[List[Migration]] = None
+) -> List[Migration]:
+    """Applies the migrations that are not recorded yet, in version order.
+    Schema statements cannot share a transaction with data changes, so each
+    runs on its own; they are all `IF NOT EXISTS`, so a migration that was
+    interrupted before being recorded is safe to run again.
+    :returns: the migrations applied
+    :raises DuplicateValuesError:
+        when existing nodes break a unique constraint to be created
+    """
+    if migrations is None:
+        migrations = MIGRATIONS
+    done = applied_versions(conn)
+    applied = []
+    for version, description, statements in sorted(migrations):
+        if version in done:
+            continue
+        check_unique(conn, version, statements)
+        with conn.session() as session:
+            for statement in statements:
+                session.run(statement).consume()
+            session.run(
+                f"MERGE (m:{_label_name} {{version: $version}}) "
+                "ON CREATE SET m.description = $description, "
+                "m.applied_at = timestamp()",
+                {"version": version, "description": description},
+            ).consume()
+        schema_logger.info(
+            "applied schema migration %d: %s", version, description
+        )
+        applied.append((version, description, statements))
+    return applied
+
+
+def init_app(app: Flask) -> List[Migration]:
+    """Migrates the schema unless NEO4J_MIGRATE_SCHEMA is false. The
+    versions applied by this start are stored as
+    `app.config["schema_migrations"]`.
+    """
+    app.config["schema_migrations"] = []
+    if app.config.get("NEO4J_MIGRATE_SCHEMA") is False:
+        return []
+    applied = migrate(app.config["driver"])
+    if not applied:
+        schema_logger.info("schema is up to date")
+    app.config["schema_migrations"] = [version for version, _, _ in applied]
+    return applied
@@ -0,0 +1,317 @@
+# export and import of whole project graphs as NDJSON, one JSON object
+# per line:
+#   {"type": "project", "uid": 1, "properties": {...}}
+#   {"type": "tag", "uid": 2, "properties": {...}}
+#   {"type": "resource", "uid": 3, "properties": {...}}
+#   {"type": "prereq", "uid": 4, "a": 3, "b": 5, "properties": {...}}
+#   {"type": "tag_link", "resource": 3, "tag": 2}
+# Exports list tags and resources before the prereqs and tag links that
+# refer to them, imports expect the same order. Imports whose prereqs form
+# a cycle are refused.
+
+import json
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+
+from neo4j import READ_ACCESS
+
+from twig_server.database.connection import Neo4jConnection
+from twig_server.database.native import Node
+from twig_server.database.prereq_graph import PrereqGraph
+from twig_server.database.Project import Project
+from twig_server.database.Resource import Resource
+from twig_server.database.Tag import Tag
+from twig_server.database.unit_of_work import UnitOfWork
+
+RECORD_TYPES = ("project", "tag", "resource", "prereq", "tag_link")
+
+
+class ImportLineError(ValueError):
+    """Malformed line in an import, nothing of the import is kept"""
+
+    def __init__(self, line: int, message: str) -> None:
+        super().__init__(f"line {line}: {message}")
+        self.line = line
+
+
+def _is_ref(value: Any, optional: bool = False) -> bool:
+    """Whether `value` can be the uid of a record in an import"""
+    if value is None:
+        return optional
+    return isinstance(value, (str, int, float)) and not isinstance(value, bool)
+
+
+def _properties(entity: Any) -> Dict[str, Any]:
+    return {key: entity[key] for key in entity.keys()}
+
+
+def export_project(conn: Neo4jConnection, project_uid: int) -> Iterator[str]:
+    """NDJSON lines of the project graph, read in its own transaction so it
+    can be streamed after the request's unit of work has finished. Records
+    are pulled from the result cursor as lines are consumed, so memory
+    stays bounded by the driver's fetch size and the uids kept.
+    Every query runs in that one read transaction, and prereqs and tag
+    links are only exported with the resources and tags they join, so the
+    export can always be imported again.
+    """
+    queries = [
+        (
+            "project",
+            f"MATCH (p:{Project._label_name}) WHERE id(p)=$uid \
+            RETURN id(p) AS uid, p AS entity",
+        ),
+        (
+            "tag",
+            f"MATCH (p:{Project._label_name})\
+                -[:{Tag._label_project_relationship}]->(t:{Tag._label_name}) \
+            WHERE id(p)=$uid \
+            RETURN id(t) AS uid, t AS entity",
+        ),
+        (
+            "resource",
+            f"MATCH (p:{Project._label_name})\
+                -[:{Resource._label_project_relationship}]->\
+                (r:{Resource._label_name}) \
+            WHERE id(p)=$uid \
+            RETURN id(r) AS uid, r AS entity",
+        ),
+        (
+            "prereq",
+            f"MATCH (p:{Project._label_name})\
+                -[:{Resource._label_project_relationship}]->\
+                (a:{Resource._label_name})\
+                -[e:{Resource._label_prereq_relationship}]->\
+                (b:{Resource._label_name}) \
+            WHERE id(p)=$uid \
+            RETURN id(e) AS uid, e AS entity, id(a) AS a, id(b) AS b",
+        ),
+        (
+            "tag_link",
+            f"MATCH (p:{Project._label_name})\
+                -[:{Resource._label_project_relationship}]->\
+                (r:{Resource._label_name})\
+                -[:{Tag._label_resource_relationship}]->(t:{Tag._label_name}) \
+            WHERE id(p)=$uid \
+            RETURN id(r) AS resource, id(t) AS tag",
+        ),
+    ]
+    unit_of_work = UnitOfWork(conn, READ_ACCESS)
+    exported: Dict[str, Set[int]] = {"tag": set(), "resource": set()}
+    try:
+        session = conn.instrument(unit_of_work.session())
+        for record_type, queryStr in queries:
+            for row in session.run(queryStr, {"uid": project_uid}):
+                if record_type in exported:
+                    exported[record_type].add(row["uid"])
+                elif record_type == "prereq" and not (
+                    row["a"] in exported["resource"]
+                    and row["b"] in exported["resource"]
+                ):
+                    continue  # created after the resources were read
+                elif record_type == "tag_link" and not (
+                    row["resource"] in exported["resource"]
+                    and row["tag"] in exported["tag"]
+                ):
+                    continue
+                if record_type == "tag_link":
+                    line = {
+                        "type": record_type,
+                        "resource": row["resource"],
+                        "tag": row["tag"],
+                    }
+                else:
+                    line = {"type": record_type, "uid": row["uid"]}
+                    if record_type == "prereq":
+                        line["a"] = row["a"]
+                        line["b"] = row["b"]
+                    line["properties"] = _properties(row["entity"])
+                yield json.dumps(line, default=str) + "\n"
+        unit_of_work.commit()
+    finally:
+        unit_of_work.close()
+
+
+class ProjectImport:
+    def __init__(
+        self,
+        conn: Neo4jConnection,
+        project: Project,
+        batch_size: int,
+        report: Optional[Callable[..., None]] = None,
+    ) -> None:
+        """Creates the tags, resources, prereqs and tag links of an export
+        in `project`, `batch_size` records per `UNWIND` statement.
+        Uids in the input are the client's, `ids` maps them to the uids
+        the new nodes and relationships got.
+        :param conn:
+            Neo4J connection
+        :param report:
+            called with `counts` after every batch
+        """
+        self.conn = conn
+        self.report = report
+        self.project = project
+        self.batch_size = max(1, batch_size)
+        self.ids: Dict[str, Dict[Any, int]] = {
+            "tag": {},
+            "resource": {},
+            "prereq": {},
+        }
+        self.counts: Dict[str, int] = {
+            "tag": 0,
+            "resource": 0,
+            "prereq": 0,
+            "tag_link": 0,
+        }
+        self.batches: int = 0
+        self.pending: Dict[str, List[Dict[str, Any]]] = {
+            "tag": [],
+            "resource": [],
+            "prereq": [],
+            "tag_link": [],
+        }
+        # (line, a, b) of every prereq, checked for cycles at the end
+        self.prereqs: List[Tuple[int, int, int]] = []
+
+    def read(self, lines: Iterable[Any]) -> None:
+        """Imports every line and flushes what is left
+        :raises ImportLineError:
+            on the first line that cannot be imported
+        """
+        for number, line in enumerate(lines, 1):
+            if isinstance(line, bytes):
+                line = line.decode("utf-8")
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                raise ImportLineError(number, "not JSON")
+            self.add(number, record)
+        self.check_prereqs()
+        self.flush()
+
+    def check_prereqs(self) -> None:
+        """Checks all prereqs for cycles at once. Imported prereqs only
+        join imported resources, so the project's own ones do not matter.
+        :raises ImportLineError:
+        """
+        closing = PrereqGraph(0).check_edges(
+            [(a, b) for _, a, b in self.prereqs]
+        )
+        if closing is not None:
+            raise ImportLineError(
+                self.prereqs[closing][0], "prereq closes a cycle"
+            )
+
+    def add(self, number: int, record: Any) -> None:
+        record_type = record.get("type") if isinstance(record, dict) else None
+        if record_type not in RECORD_TYPES:
+            raise ImportLineError(
+                number, f"unknown record type {record_type!r}"
+            )
+        if record_type == "project":
+            return  # the target project keeps its own properties
+        properties = record.get("properties") or {}
+        if not isinstance(properties, dict):
+            raise ImportLineError(number, "properties must be an object")
+        properties = {
+            key: value for key, value in properties.items() if key != "uid"
+        }
+        try:
+            Node.check_patch(properties)
+        except ValueError as e:
+            raise ImportLineError(number, str(e))
+        if not _is_ref(record.get("uid"), optional=True):
+            raise ImportLineError(number, "uid must be a string or a number")
+        if record_type in ("tag", "resource"):
+            if record.get("uid") is None:
+                raise ImportLineError(number, f"{record_type} without uid")
+            row = {"ref": record["uid"], "properties": properties}
+        elif record_type == "prereq":
+            # endpoints have to exist before they can be remapped
+            self.flush("resource")
+            row = {
+                "ref": record.get("uid"),
+                "a": self.remap(number, "resource", record.get("a")),
+                "b": self.remap(number, "resource", record.get("b")),
+                "properties": properties,
+            }
+            self.prereqs.append((number, row["a"], row["b"]))
+        else:
+            self.flush("tag")
+            self.flush("resource")
+            row = {
+                "resource": self.remap(
+                    number, "resource", record.get("resource")
+                ),
+                "tag": self.remap(number, "tag", record.get("tag")),
+            }
+        self.pending[record_type].append(row)
+        if len(self.pending[record_type]) >= self.batch_size:
+            self.flush(record_type)
+
+    def remap(self, number: int, record_type: str, ref: Any) -> int:
+        uid = self.ids[record_type].get(ref) if _is_ref(ref) else None
+        if uid is None:
+            raise ImportLineError(number, f"unknown {record_type} {ref!r}")
+        return uid
+
+    def flush(self, record_type: Optional[str] = None) -> None:
+        """Writes the pending rows of `record_type`, or of every type"""
+        if record_type is None:
+            for pending_type in self.pending:
+                self.flush(pending_type)
+            return
+        rows = self.pending[record_type]
+        if not rows:
+            return
+        self.pending[record_type] = []
+        assert self.project.uid is not None
+        with self.conn.session() as session:
+            res = session.run(
+                ProjectImport.queries[record_type],
+                {"uid": int(self.project.uid), "rows": rows},
+            )
+            for row in res:
+                if record_type in self.ids and row["ref"] is not None:
+                    self.ids[record_type][row["ref"]] = row["uid"]
+                self.counts[record_type] += 1
+        self.batches += 1
+        if self.report is not None:
+            self.report(**self.counts)
+
+    queries = {
+        "tag": f"MATCH (p:{Project._label_name}) WHERE id(p)=$uid \
+            UNWIND $rows AS row \
+            CREATE (p)-[:{Tag._label_project_relationship}]->\
+                (n:{Tag._label_name}) \
+            SET n = row.properties \
+            RETURN row.ref AS ref, id(n) AS uid",
+        "resource": f"MATCH (p:{Project._label_name}) WHERE id(p)=$uid \
+            UNWIND $rows AS row \
+            CREATE (p)-[:{Resource._label_project_relationship}]->\
+                (n:{Resource._label_name}) \
+            SET n = row.properties \
+            RETURN row.ref AS ref, id(n) AS uid",
+        "prereq": f"UNWIND $rows AS row \
+            MATCH (a:{Resource._label_name}) WHERE id(a)=row.a \
+            MATCH (b:{Resource._label_name}) WHERE id(b)=row.b \
+            CREATE (a)-[e:{Resource._label_prereq_relationship}]->(b) \
+            SET e = row.properties \
+            RETURN row.ref AS ref, id(e) AS uid",
+        "tag_link": f"UNWIND $rows AS row \
+            MATCH (r:{Resource._label_name}) WHERE id(r)=row.resource \
+            MATCH (t:{Tag._label_name}) WHERE id(t)=row.tag \
+            CREATE (r)-[e:{Tag._label_resource_relationship}]->(t) \
+            RETURN null AS ref, id(e) AS uid",
+    }
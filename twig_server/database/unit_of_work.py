@@ -0,0 +1,207 @@
+# request scoped unit of work: one session and one explicit transaction
+# shared by every query that runs while handling a Flask request.
+# Views marked `read_only` get a READ_ACCESS session, which a routing
+# driver (neo4j:// scheme) sends to followers and read replicas.
+
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, List, Mapping, Optional
+from flask import Flask, Response, g, has_request_context, request
+from neo4j import READ_ACCESS, WRITE_ACCESS, Result, Session, Transaction
+
+from twig_server.database.connection import Neo4jConnection
+
+
+class TransactionSession:
+    """Stands in for a neo4j `Session` inside a unit of work, so model code
+    can keep writing `with conn.session() as session: session.run(...)`.
+    Leaving the `with` block does not end the transaction.
+    """
+
+    def __init__(self, unit_of_work: "UnitOfWork") -> None:
+        self.unit_of_work = unit_of_work
+
+    def __enter__(self) -> "TransactionSession":
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback) -> None:
+        pass
+
+    def run(
+        self,
+        query: str,
+        parameters: Optional[Mapping[str, Any]] = None,
+        **kwparameters: Any
+    ) -> Result:
+        tx = self.unit_of_work.transaction()
+        return tx.run(query, parameters, **kwparameters)
+
+
+# response header with the bookmark of a committed write, sent back by
+# clients on reads so a lagging follower waits until it has the write
+BOOKMARK_HEADER = "X-Bookmark"
+
+
+def read_only(view: Callable) -> Callable:
+    """Marks a view that never writes, its unit of work reads with
+    READ_ACCESS. Writing from it fails.
+    """
+    view.read_only = True  # type: ignore[attr-defined]
+    return view
+
+
+class UnitOfWork:
+    def __init__(
+        self,
+        conn: Neo4jConnection,
+        access_mode: str = WRITE_ACCESS,
+        bookmarks: Optional[List[str]] = None,
+    ) -> None:
+        """Groups all queries of a request into one transaction
+        :param conn:
+            Neo4J connection
+        :param access_mode:
+            `READ_ACCESS` lets a cluster serve the transaction from a
+            follower or read replica
+        :param bookmarks:
+            writes the transaction has to see, see `BOOKMARK_HEADER`
+        The session and transaction are only opened by the first query,
+        so requests that never reach the database cost nothing.
+        """
+        self.conn: Neo4jConnection = conn
+        self.access_mode: str = access_mode
+        self.bookmarks: Optional[List[str]] = bookmarks
+        # of the committed transaction, if it wrote anything
+        self.bookmark: Optional[str] = None
+        self._session: Optional[Session] = None
+        self._tx: Optional[Transaction] = None
+        self._after_commit: List[Callable[[], None]] = []
+        self._after_rollback: List[Callable[[], None]] = []
+
+    def transaction(self) -> Transaction:
+        if self._tx is None:
+            config: dict = {"default_access_mode": self.access_mode}
+            if self.bookmarks:
+                config["bookmarks"] = self.bookmarks
+            assert self.conn.conn is not None
+            self._session = self.conn.conn.session(**config)
+            self._tx = self._session.begin_transaction()
+        return self._tx
+
+    def session(self) -> TransactionSession:
+        return TransactionSession(self)
+
+    @property
+    def active(self) -> bool:
+        return self._tx is not None and not self._tx.closed()
+
+    def after_commit(
+        self,
+        callback: Callable[[], None],
+        rolled_back: Optional[Callable[[], None]] = None,
+    ) -> None:
+        """Runs `callback` once the transaction committed, e.g. to start
+        work in another thread that has to see this request's writes.
+        If the unit of work rolls back instead, `rolled_back` runs.
+        """
+        self._after_commit.append(callback)
+        if rolled_back is not None:
+            self._after_rollback.append(rolled_back)
+
+    def commit(self) -> None:
+        if self.active:
+            assert self._tx is not None and self._session is not None
+            self._tx.commit()
+            if self.access_mode == WRITE_ACCESS:
+                self.bookmark = self._session.last_bookmark()
+        callbacks, self._after_commit = self._after_commit, []
+        self._after_rollback = []
+        for callback in callbacks:
+            callback()
+
+    def rollback(self) -> None:
+        callbacks, self._after_rollback = self._after_rollback, []
+        self._after_commit = []
+        try:
+            if self.active:
+                assert self._tx is not None
+                self._tx.rollback()
+        finally:
+            for callback in callbacks:
+                callback()
+
+    def close(self) -> None:
+        """Rolls back anything not committed and releases the session"""
+        try:
+            self.rollback()
+        finally:
+            if self._session is not None:
+                self._session.close()
+            self._session = None
+            self._tx = None
+
+
+_thread = threading.local()
+
+
+def current_unit_of_work() -> Optional[UnitOfWork]:
+    """The request's unit of work, or the `unit_of_work_scope` open on
+    this thread outside of requests
+    """
+    if not has_request_context():
+        return getattr(_thread, "unit_of_work", None)
+    return g.get("unit_of_work", None)
+
+
+@contextmanager
+def unit_of_work_scope(conn: Neo4jConnection) -> Iterator[UnitOfWork]:
+    """Unit of work for code running outside a request, e.g. a background
+    job, so its queries share one transaction like a request's do.
+    Commits when the block ends, rolls back if it raises.
+    """
+    unit_of_work = UnitOfWork(conn)
+    previous = getattr(_thread, "unit_of_work", None)
+    _thread.unit_of_work = unit_of_work
+    try:
+        yield unit_of_work
+        unit_of_work.commit()
+    finally:
+        _thread.unit_of_work = previous
+        unit_of_work.close()
+
+
+def init_app(app: Flask) -> None:
+    """Opens a unit of work for every request. It commits once after the
+    view returns a non-error response and rolls back otherwise.
+    """
+
+    @app.before_request
+    def begin_unit_of_work() -> None:
+        view = app.view_functions.get(request.endpoint or "")
+        if getattr(view, "read_only", False):
+            bookmark = request.headers.get(BOOKMARK_HEADER)
+            g.unit_of_work = UnitOfWork(
+                app.config["driver"],
+                READ_ACCESS,
+                [bookmark] if bookmark else None,
+            )
+        else:
+            g.unit_of_work = UnitOfWork(app.config["driver"])
+
+    @app.after_request
+    def commit_unit_of_work(response: Response) -> Response:
+        unit_of_work = current_unit_of_work()
+        if unit_of_work is not None and response.status_code < 500:
+            unit_of_work.commit()
+            if unit_of_work.bookmark:
+                response.headers[BOOKMARK_HEADER] = unit_of_work.bookmark
+        return response
+
+    @app.teardown_request
+    def close_unit_of_work(exception: Optional[BaseException]) -> None:
+        # nodes read by the transaction go with it, `g` can outlive the
+        # request when an app context was pushed around it, as in tests
+        g.pop("identity_map", None)
+        unit_of_work = g.pop("unit_of_work", None)
+        if unit_of_work is not None:
+            unit_of_work.close()
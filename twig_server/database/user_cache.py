@@ -0,0 +1,165 @@
+# process local cache of User nodes by kratos_user_id and username.
+# Nearly every request resolves its X-User, and users almost never change.
+# Writes through `User` invalidate their entries, writes made elsewhere
+# show up at the latest after USER_CACHE_TTL seconds.
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from flask import Flask
+
+from twig_server.database.unit_of_work import current_unit_of_work
+
+# the properties a user is looked up by
+KEYS: Tuple[str, ...] = ("kratos_user_id", "username")
+
+Key = Tuple[str, Any]
+
+
+class UserCache:
+    def __init__(
+        self,
+        maxsize: int = 10000,
+        ttl: float = 60.0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """Least recently used entries are evicted beyond `maxsize`, every
+        entry expires `ttl` seconds after it was stored
+        :param clock:
+            seconds, for tests
+        """
+        self.lock = threading.Lock()
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        # key -> (expires at, user node)
+        self.entries: "OrderedDict[Key, Tuple[float, Any]]" = OrderedDict()
+        # bumped by every invalidation, fills read before it are dropped
+        self.generation: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        # called with True on a hit and False on a miss
+        self.listeners: List[Callable[[bool], None]] = []
+
+    def get(self, field: str, value: Any) -> Optional[Any]:
+        """The cached user node whose `field` is `value`, `None` on a miss"""
+        now = self.clock()
+        with self.lock:
+            entry = self.entries.get((field, value))
+            if entry is not None and entry[0] <= now:
+                del self.entries[(field, value)]
+                entry = None
+            if entry is None:
+                self.misses += 1
+            else:
+                self.entries.move_to_end((field, value))
+                self.hits += 1
+        for listener in self.listeners:
+            listener(entry is not None)
+        return None if entry is None else entry[1]
+
+    def token(self) -> int:
+        """Taken before reading a user from the database, see `put`"""
+        with self.lock:
+            return self.generation
+
+    def put(self, node: Any, token: int) -> None:
+        """Stores a user node read from the database under every key it has,
+        unless an invalidation happened since `token` was taken
+        """
+        expires = self.clock() + self.ttl
+        with self.lock:
+            if token != self.generation:
+                return
+            for field in KEYS:
+                value = node.get(field)
+                if value is None:
+                    continue
+                self.entries[(field, value)] = (expires, node)
+                self.entries.move_to_end((field, value))
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def fill(self, node: Any, token: int) -> None:
+        """`put`, once the current unit of work committed if there is one,
+        so a user written by a transaction that rolls back is never cached
+        """
+        unit_of_work = current_unit_of_work()
+        if unit_of_work is None:
+            self.put(node, token)
+        else:
+            unit_of_work.after_commit(lambda: self.put(node, token))
+
+    def invalidate(
+        self, properties: Iterable[Dict[str, Any]], uid: Optional[int] = None
+    ) -> None:
+        """Drops the entries of a user, by the values it had and has and by
+        `uid`. Fills of reads that started before are dropped too.
+        """
+        keys = {
+            (field, props[field])
+            for props in properties
+            for field in KEYS
+            if props.get(field) is not None
+        }
+        with self.lock:
+            self.generation += 1
+            if uid is not None:
+                keys.update(
+                    key
+                    for key, (_, node) in self.entries.items()
+                    if int(node.id) == int(uid)
+                )
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+def init_app(app: Flask) -> Optional[UserCache]:
+    """Cache of USER_CACHE_SIZE entries (0 disables it) kept for
+    USER_CACHE_TTL seconds, used by `User` through `conn.user_cache`.
+    Hits and misses are counted in the metrics.
+    """
+    size = app.config.get("USER_CACHE_SIZE")
+    ttl = app.config.get("USER_CACHE_TTL")
+    if size == 0:
+        app.config["driver"].user_cache = None
+        return None
+    cache = UserCache(
+        10000 if size is None else size, 60.0 if ttl is None else ttl
+    )
+    metrics = app.config.get("metrics")
+    if metrics is not None:
+        metrics.describe_counter(
+            "twig_user_cache_hits_total", "User lookups served from the cache"
+        )
+        metrics.describe_counter(
+            "twig_user_cache_misses_total",
+            "User lookups that hit the database",
+        )
+        cache.listeners.append(
+            lambda hit: metrics.inc(
+                "twig_user_cache_hits_total"
+                if hit
+                else "twig_user_cache_misses_total"
+            )
+        )
+    app.config["driver"].user_cache = cache
+    return cache
@@ -0,0 +1,409 @@
+# background jobs for work too long for a request, run on a bounded thread
+# pool. Routes answer 202 with the job, clients poll GET /jobs/<job_id>.
+# Jobs are kept in a SQLite table (JOB_DATABASE), so their outcome can
+# still be polled after a restart; jobs a restart interrupted are failed.
+
+import json
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+try:
+    # newer SQLite than some python builds ship with
+    import pysqlite3 as sqlite3  # type: ignore
+except ImportError:  # pragma: no cover
+    import sqlite3
+
+from flask import Flask
+
+from twig_server.database.unit_of_work import current_unit_of_work
+
+jobs_logger = logging.getLogger("twig_server.jobs")
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class JobCancelled(Exception):
+    """Raised by `Job.report` once the job was asked to stop"""
+
+
+class JobLimitExceeded(Exception):
+    """The owner already has as many unfinished jobs as allowed"""
+
+
+class Job:
+    def __init__(
+        self,
+        kind: str,
+        owner: Optional[str],
+        target: Optional[Callable[["Job"], Any]],
+        cancellable: bool = True,
+    ) -> None:
+        """
+        :param kind:
+            what the job does, e.g. `delete_project`
+        :param owner:
+            kratos user id of whoever started it, only they can see it
+        :param target:
+            the work, called with the job so it can `report` progress.
+            What it returns is stored as `result`.
+        :param cancellable:
+            whether the job may be cancelled, while queued or at its next
+            `report` while running. Jobs finishing what the request
+            already committed, like deleting a hidden project, are not.
+        """
+        self.id: str = uuid.uuid4().hex
+        self.kind: str = kind
+        self.owner: Optional[str] = owner
+        self.target = target
+        self.cancellable: bool = cancellable
+        self.cancel_requested: bool = False
+        self.status: str = QUEUED
+        self.progress: Dict[str, Any] = {}
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.created_at: float = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.store: Optional["JobStore"] = None
+
+    def report(self, **progress: Any) -> None:
+        """Updates the progress, and the point where a cancelled job stops
+        :raises JobCancelled:
+        """
+        self.progress.update(progress)
+        if self.store is not None:
+            self.store.save(self)
+        if self.cancel_requested and self.cancellable:
+            raise JobCancelled()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "cancellable": self.cancellable,
+            "progress": dict(self.progress),
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobStore:
+    _columns = (
+        "id",
+        "kind",
+        "owner",
+        "status",
+        "cancellable",
+        "progress",
+        "result",
+        "error",
+        "created_at",
+        "started_at",
+        "finished_at",
+    )
+
+    def __init__(self, database: str = ":memory:") -> None:
+        """SQLite table of jobs, one connection shared under a lock
+        :param database:
+            path of the SQLite file, `:memory:` keeps jobs until exit
+        """
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(database, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        with self.lock, self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, kind TEXT NOT NULL, owner TEXT, "
+                "status TEXT NOT NULL, cancellable INTEGER NOT NULL, "
+                "progress TEXT, result TEXT, error TEXT, "
+                "created_at REAL NOT NULL, started_at REAL, finished_at REAL)"
+            )
+            self.db.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_owner "
+                "ON jobs (owner, created_at)"
+            )
+
+    def interrupted(self) -> int:
+        """Fails the jobs a previous process left unfinished
+        :returns: how many there were
+        """
+        with self.lock, self.db:
+            return self.db.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ? "
+                "WHERE status IN (?, ?)",
+                (
+                    FAILED,
+                    "interrupted by a restart",
+                    time.time(),
+                    QUEUED,
+                    RUNNING,
+                ),
+            ).rowcount
+
+    def save(self, job: Job) -> None:
+        values = (
+            job.id,
+            job.kind,
+            job.owner,
+            job.status,
+            int(job.cancellable),
+            json.dumps(job.progress, default=str),
+            json.dumps(job.result, default=str),
+            job.error,
+            job.created_at,
+            job.started_at,
+            job.finished_at,
+        )
+        with self.lock, self.db:
+            self.db.execute(
+                f"INSERT OR REPLACE INTO jobs ({', '.join(JobStore._columns)}) "
+                f"VALUES ({', '.join('?' * len(values))})",
+                values,
+            )
+
+    @staticmethod
+    def load(row: Any) -> Job:
+        job = Job(row["kind"], row["owner"], None, bool(row["cancellable"]))
+        job.id = row["id"]
+        job.status = row["status"]
+        job.progress = json.loads(row["progress"] or "{}")
+        job.result = json.loads(row["result"] or "null")
+        job.error = row["error"]
+        job.created_at = row["created_at"]
+        job.started_at = row["started_at"]
+        job.finished_at = row["finished_at"]
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self.lock:
+            row = self.db.execute(
+                "SELECT * FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return JobStore.load(row) if row else None
+
+    def list(self, owner: str, limit: int) -> List[Job]:
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT * FROM jobs WHERE owner = ? "
+                "ORDER BY created_at DESC LIMIT ?",
+                (owner, limit),
+            ).fetchall()
+        return [JobStore.load(row) for row in rows]
+
+
+class JobRunner:
+    def __init__(
+        self,
+        workers: int = 2,
+        database: str = ":memory:",
+        user_limit: Optional[int] = 1,
+        user_queue_limit: Optional[int] = 20,
+    ) -> None:
+        """Runs jobs on at most `workers` threads, recording them in a
+        `JobStore` at `database`
+        :param user_limit:
+            jobs of one owner running at the same time, the others wait
+            so one user cannot take every worker. `None` for no limit.
+        :param user_queue_limit:
+            unfinished jobs allowed per owner, `None` for no limit
+        """
+        self.lock = threading.Lock()
+        self.workers = max(1, workers)
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="twig-job"
+        )
+        self.store = JobStore(database)
+        interrupted = self.store.interrupted()
+        if interrupted:
+            jobs_logger.warning(
+                "%d jobs were interrupted by a restart", interrupted
+            )
+        self.user_limit = user_limit
+        self.user_queue_limit = user_queue_limit
+        # unfinished jobs, finished ones are only in the store
+        self.jobs: Dict[str, Job] = {}
+        self.finished: Dict[str, threading.Event] = {}
+        self.ready: List[Job] = []  # started, waiting for a worker
+        self.running: Dict[Optional[str], int] = {}  # owner -> jobs
+        self.idle = threading.Condition(self.lock)
+        self.active: int = 0  # started and not finished
+
+    def submit(self, job: Job) -> Job:
+        """Queues `job`. While handling a request, only once the request's
+        unit of work committed, so the job sees what the request wrote.
+        :raises JobLimitExceeded:
+        """
+        with self.lock:
+            if self.user_queue_limit is not None and job.owner is not None:
+                unfinished = sum(
+                    1
+                    for other in self.jobs.values()
+                    if other.owner == job.owner
+                )
+                if unfinished >= self.user_queue_limit:
+                    raise JobLimitExceeded(
+                        f"at most {self.user_queue_limit} unfinished jobs "
+                        "per user"
+                    )
+            self.jobs[job.id] = job
+            self.finished[job.id] = threading.Event()
+        job.store = self.store
+        self.store.save(job)
+        unit_of_work = current_unit_of_work()
+        if unit_of_work is None:
+            self.start(job)
+        else:
+            unit_of_work.after_commit(
+                lambda: self.start(job),
+                lambda: self.discard(job, "the request was rolled back"),
+            )
+        return job
+
+    def start(self, job: Job) -> None:
+        with self.lock:
+            self.active += 1
+            self.ready.append(job)
+            self.dispatch()
+
+    def dispatch(self) -> None:
+        """Hands ready jobs to free workers in order, skipping owners at
+        their `user_limit`. Called with the lock held.
+        """
+        for job in list(self.ready):
+            if sum(self.running.values()) >= self.workers:
+                return
+            running = self.running.get(job.owner, 0)
+            if (
+                self.user_limit is not None
+                and job.owner is not None
+                and running >= self.user_limit
+            ):
+                continue
+            self.ready.remove(job)
+            self.running[job.owner] = running + 1
+            self.executor.submit(self.execute, job)
+
+    def execute(self, job: Job) -> None:
+        try:
+            if job.cancel_requested:
+                job.status = CANCELLED
+                return
+            job.status = RUNNING
+            job.started_at = time.time()
+            self.store.save(job)
+            assert job.target is not None  # only restored jobs have none
+            job.result = job.target(job)
+            job.status = DONE
+        except JobCancelled:
+            job.status = CANCELLED
+        except Exception as e:
+            jobs_logger.exception("job %s (%s) failed", job.id, job.kind)
+            job.error = str(e)
+            job.status = FAILED
+        finally:
+            with self.idle:
+                self.running[job.owner] -= 1
+                self.finish(job, job.status)
+                self.dispatch()
+
+    def finish(
+        self, job: Job, status: str, error: Optional[str] = None
+    ) -> None:
+        """Records the job as finished. Called with the lock held."""
+        job.status = status
+        job.error = error if error is not None else job.error
+        job.finished_at = time.time()
+        self.store.save(job)
+        self.jobs.pop(job.id, None)
+        self.finished.pop(job.id).set()
+        self.active -= 1
+        self.idle.notify_all()
+
+    def discard(self, job: Job, error: str) -> None:
+        """Drops a job that was never started"""
+        with self.idle:
+            self.active += 1  # finish counts it as started
+            self.finish(job, CANCELLED, error)
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """Asks an unfinished cancellable job to stop: a queued one will
+        not start, a running one stops at its next `report`
+        :returns:
+            the job, `None` if it is not unfinished. `cancel_requested`
+            stays unset on jobs that are not cancellable.
+        """
+        with self.idle:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            if not job.cancellable:
+                return job
+            job.cancel_requested = True
+            if job in self.ready:
+                self.ready.remove(job)
+                self.finish(job, CANCELLED)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self.lock:
+            job = self.jobs.get(job_id)
+        return job if job is not None else self.store.get(job_id)
+
+    def list(self, owner: str, limit: int = 50) -> List[Job]:
+        """The owner's most recent jobs, newest first"""
+        with self.lock:
+            unfinished = {
+                job.id: job for job in self.jobs.values() if job.owner == owner
+            }
+        return [
+            unfinished.get(job.id, job)
+            for job in self.store.list(owner, limit)
+        ]
+
+    def wait(self, job_id: str, timeout: Optional[float] = None) -> bool:
+        """Blocks until the job finished, `False` on timeout"""
+        with self.lock:
+            event = self.finished.get(job_id)
+        return event is None or event.wait(timeout)
+
+    def wait_idle(self, timeout: Optional[float] = None) -> bool:
+        """Blocks until no started job is left, `False` on timeout"""
+        with self.idle:
+            return self.idle.wait_for(lambda: self.active == 0, timeout)
+
+
+def limit_setting(value: Optional[int], default: int) -> Optional[int]:
+    """A per-user limit from the config: unset keeps `default`, 0 means
+    no limit (`None` for the `JobRunner`)
+    """
+    if value is None:
+        return default
+    return value if value > 0 else None
+
+
+def init_app(app: Flask) -> JobRunner:
+    """Job runner with JOB_WORKERS threads, JOB_USER_LIMIT of them per
+    user, at most JOB_USER_QUEUE_LIMIT unfinished jobs per user and its
+    table in JOB_DATABASE, stored as `app.config["jobs"]`.
+    A limit of 0 turns it off.
+    """
+    runner = JobRunner(
+        app.config.get("JOB_WORKERS") or 2,
+        app.config.get("JOB_DATABASE") or ":memory:",
+        limit_setting(app.config.get("JOB_USER_LIMIT"), 1),
+        limit_setting(app.config.get("JOB_USER_QUEUE_LIMIT"), 20),
+    )
+    app.config["jobs"] = runner
+    return runner
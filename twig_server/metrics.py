@@ -0,0 +1,224 @@
+# request and cypher statement metrics, exported in the Prometheus text format
+
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from flask import Flask, Response, g, has_request_context, request
+
+# seconds
+LATENCY_BUCKETS: Sequence[float] = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+# statements per request
+COUNT_BUCKETS: Sequence[float] = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float]) -> None:
+        self.buckets: Sequence[float] = buckets
+        # counts[i] observations <= buckets[i], the last one is +Inf
+        self.counts: List[int] = [0] * (len(buckets) + 1)
+        self.sum: float = 0.0
+        self.count: int = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        ret = []
+        total = 0
+        for bound, count in zip(list(self.buckets) + ["+Inf"], self.counts):
+            total += count
+            ret.append((str(bound), total))
+        return ret
+
+
+def format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (
+            key,
+            value.replace("\\", "\\\\")
+            .replace('"', '\\"')
+            .replace("\n", "\\n"),
+        )
+        for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+class Metrics:
+    def __init__(self) -> None:
+        """Thread safe registry of counters and histograms"""
+        self.lock = threading.Lock()
+        # name -> (description, {labels: value})
+        self.counters: Dict[str, Tuple[str, Dict[Labels, float]]] = {}
+        # name -> (description, buckets, {labels: histogram})
+        self.histograms: Dict[
+            str, Tuple[str, Sequence[float], Dict[Labels, Histogram]]
+        ] = {}
+
+    def describe_counter(self, name: str, description: str) -> None:
+        self.counters.setdefault(name, (description, {}))
+
+    def describe_histogram(
+        self, name: str, description: str, buckets: Sequence[float]
+    ) -> None:
+        self.histograms.setdefault(name, (description, buckets, {}))
+
+    def inc(self, name: str, labels: Labels = (), value: float = 1) -> None:
+        with self.lock:
+            series = self.counters[name][1]
+            series[labels] = series.get(labels, 0) + value
+
+    def observe(self, name: str, value: float, labels: Labels = ()) -> None:
+        with self.lock:
+            _, buckets, series = self.histograms[name]
+            if labels not in series:
+                series[labels] = Histogram(buckets)
+            series[labels].observe(value)
+
+    def render(self) -> str:
+        lines = []
+        with self.lock:
+            for name, (description, series) in sorted(self.counters.items()):
+                lines.append(f"# HELP {name} {description}")
+                lines.append(f"# TYPE {name} counter")
+                for labels, value in sorted(series.items()):
+                    lines.append(f"{name}{format_labels(labels)} {value}")
+            for name, (description, _, histograms) in sorted(
+                self.histograms.items()
+            ):
+                lines.append(f"# HELP {name} {description}")
+                lines.append(f"# TYPE {name} histogram")
+                for labels, histogram in sorted(
+                    histograms.items(), key=lambda x: x[0]
+                ):
+                    for bound, count in histogram.cumulative():
+                        bucket_labels = labels + (("le", bound),)
+                        lines.append(
+                            f"{name}_bucket{format_labels(bucket_labels)} {count}"
+                        )
+                    lines.append(
+                        f"{name}_sum{format_labels(labels)} {histogram.sum}"
+                    )
+                    lines.append(
+                        f"{name}_count{format_labels(labels)} {histogram.count}"
+                    )
+        return "\n".join(lines) + "\n"
+
+
+def route_labels() -> Labels:
+    rule = request.url_rule.rule if request.url_rule else "unmatched"
+    return (("route", rule), ("method", request.method))
+
+
+def init_app(app: Flask) -> Metrics:
+    """Records latency, count and errors of every route, and the number
+    and duration of cypher statements, per request and overall.
+    The registry is stored as `app.config["metrics"]`.
+    """
+    metrics = Metrics()
+    metrics.describe_counter("twig_http_requests_total", "Requests handled")
+    metrics.describe_counter(
+        "twig_http_request_errors_total", "Requests that ended in a 5xx"
+    )
+    metrics.describe_histogram(
+        "twig_http_request_duration_seconds",
+        "Request latency",
+        LATENCY_BUCKETS,
+    )
+    metrics.describe_histogram(
+        "twig_http_request_db_statements",
+        "Cypher statements per request",
+        COUNT_BUCKETS,
+    )
+    metrics.describe_histogram(
+        "twig_http_request_db_seconds",
+        "Time spent in cypher per request",
+        LATENCY_BUCKETS,
+    )
+    metrics.describe_counter(
+        "twig_db_statements_total", "Cypher statements run"
+    )
+    metrics.describe_counter(
+        "twig_db_statement_errors_total", "Cypher statements that failed"
+    )
+    metrics.describe_histogram(
+        "twig_db_statement_duration_seconds",
+        "Cypher statement latency",
+        LATENCY_BUCKETS,
+    )
+    app.config["metrics"] = metrics
+
+    def observe_query(
+        query: str,
+        parameters: Mapping[str, Any],
+        seconds: float,
+        result: Any,
+        error: Optional[BaseException],
+    ) -> None:
+        metrics.inc("twig_db_statements_total")
+        if error is not None:
+            metrics.inc("twig_db_statement_errors_total")
+        metrics.observe("twig_db_statement_duration_seconds", seconds)
+        if has_request_context() and "metrics_start" in g:
+            g.metrics_db_statements += 1
+            g.metrics_db_seconds += seconds
+
+    app.config["driver"].add_query_listener(observe_query)
+
+    @app.before_request
+    def start_request_metrics() -> None:
+        g.metrics_start = time.perf_counter()
+        g.metrics_db_statements = 0
+        g.metrics_db_seconds = 0.0
+
+    @app.after_request
+    def capture_status(response: Response) -> Response:
+        g.metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def record_request_metrics(exception: Optional[BaseException]) -> None:
+        if "metrics_start" not in g:
+            return
+        labels = route_labels()
+        status = g.get("metrics_status", 500)
+        if exception is not None:
+            status = 500
+        metrics.inc(
+            "twig_http_requests_total", labels + (("status", str(status)),)
+        )
+        if status >= 500:
+            metrics.inc("twig_http_request_errors_total", labels)
+        metrics.observe(
+            "twig_http_request_duration_seconds",
+            time.perf_counter() - g.metrics_start,
+            labels,
+        )
+        metrics.observe(
+            "twig_http_request_db_statements", g.metrics_db_statements, labels
+        )
+        metrics.observe(
+            "twig_http_request_db_seconds", g.metrics_db_seconds, labels
+        )
+
+    return metrics
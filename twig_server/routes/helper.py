@@ -1,44 +1,116 @@
-import resource
-from flask import jsonify, current_app, request
+import functools
+import hmac
+from typing import Any, Callable, Dict, Optional, Tuple
+from flask import Response, current_app, request
 from twig_server.database.Project import Project
+from twig_server.database.prereq_graph import PrereqGraph
 from twig_server.database.Tag import Tag
-
-from twig_server.database.connection import Neo4jConnection
-from twig_server.database.User import User
 from twig_server.database.Resource import Resource
-from neo4j import graph
 
-from twig_server.database.native import Node, Relationship
-import twig_server.app as app
+def helper_get_authorized_project(project_id: str) -> Tuple[Optional[Project], bool]:
+    """Loads the project and checks that the X-User owns it, in one query
+    :returns:
+        the project (`None` if it does not exist) and whether the user owns it
+    """
+    project = Project.lookup(current_app.config["driver"], int(project_id))
+    authorized = project.query_authorized(request.headers.get('X-User'))
+    if project.db_obj is None:
+        return None, False
+    return project, authorized
+
+def helper_get_project_to_write(project_id: str) -> Project:
+    """The project for a write filtered by `Project.owned_match`, without
+    loading it: the write's own statement only matches while the X-User
+    owns it. When it matched nothing, `helper_write_refused` says why.
+    """
+    return Project.lookup(current_app.config["driver"], int(project_id))
+
+def helper_write_refused(project: Project, response: Any) -> Tuple[Any, int]:
+    """Response for an owner filtered write that matched nothing: 404 if
+    the project does not exist, 401 if the X-User does not own it,
+    otherwise `response` with 404. Only this path checks the owner
+    separately, writes that succeed take a single query.
+    """
+    authorized = project.query_authorized(request.headers.get('X-User'))
+    if project.db_obj is None:
+        return "project not found", 404
+    if not authorized:
+        return "not authorized", 401
+    return response, 404
+
+def helper_get_prereq_graph(project_id: str) -> Optional[PrereqGraph]:
+    """The project's prereq graph at its current version, from the
+    cache when possible, `None` if the project does not exist
+    """
+    project = Project.lookup(current_app.config["driver"], int(project_id))
+    return current_app.config["prereq_graphs"].get(project)
+
+def helper_not_modified(project: Project) -> Optional[Response]:
+    """304 response when the request's If-None-Match holds the project's
+    current ETag, so the caller can skip building the payload
+    """
+    if not request.if_none_match.contains(project.etag()):
+        return None
+    return helper_with_etag(Response(status=304), project)
+
+def helper_with_etag(response: Response, project: Project) -> Response:
+    """Tags a response with the project's ETag. Clients must revalidate,
+    the ETag changes with every write to the project.
+    """
+    response.set_etag(project.etag())
+    response.cache_control.no_cache = True
+    return response
+
+def helper_background() -> bool:
+    """Whether the request asks to run as a background job"""
+    return request.args.get('background', '').lower() in ('1', 'true')
+
+def internal_only(view: Callable) -> Callable:
+    """Gates an operational route that oathkeeper does not authenticate:
+    404 unless INTERNAL_ROUTES_TOKEN is set, 401 unless the request sends
+    it as `Authorization: Bearer <token>`
+    """
+
+    @functools.wraps(view)
+    def gated(*args: Any, **kwargs: Any) -> Any:
+        token = current_app.config.get("INTERNAL_ROUTES_TOKEN")
+        if not token:
+            return "not found", 404
+        if not hmac.compare_digest(
+                request.headers.get('Authorization', '').encode(),
+                f"Bearer {token}".encode()):
+            return "not authorized", 401
+        return view(*args, **kwargs)
+    return gated
 
-def authorize_user(project: Project):
-    kratos_user_id = request.headers.get('X-User')
-    owner = project.get_owner()
-    if(kratos_user_id != owner['kratos_user_id']):
-        return False
-    return True
+def helper_request_properties() -> Optional[Dict[str, Any]]:
+    """Properties an edit route should set: the JSON body if there is one,
+    which keeps value types, otherwise the query string as strings.
+    `None` if the JSON body is not an object.
+    """
+    if request.is_json:
+        body = request.get_json(silent=True)
+        return body if isinstance(body, dict) else None
+    return request.args.to_dict()
 
 def tag_belongs_to_project(tag: Tag, project: Project):
     return int(tag.get_project_properties()['uid']) == int(project.properties['uid'])
 
-def helper_get_project(project_id: str):
-    project_uid = int(project_id)
-    assert project_uid is not None
-    project = Project(current_app.config["driver"], uid=project_uid)
-    project.query_uid()
-    assert project.db_obj is not None
+def helper_get_project(project_id: str) -> Optional[Project]:
+    """The project, `None` if it does not exist or was deleted"""
+    project = Project.lookup(current_app.config["driver"], int(project_id))
+    if project.db_obj is None:
+        return None
     return project
 def helper_get_resource(resource_id: str):
     resource_uid = int(resource_id)
     assert resource_uid is not None
-    resource = Resource(current_app.config["driver"], uid=resource_uid)
-    resource.query_uid()
+    resource = Resource.lookup(current_app.config["driver"], resource_uid)
     assert resource.db_obj is not None
     return resource
 def helper_get_tag(tag_id: str):
     tag_uid = int(tag_id)
     assert tag_uid is not None
-    tag = Tag(current_app.config["driver"], uid = tag_uid)
-    tag.query_uid()
+    tag = Tag.lookup(current_app.config["driver"], tag_uid)
     assert tag.db_obj is not None
     return tag
\ No newline at end of file
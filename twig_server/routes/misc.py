@@ -1,9 +1,73 @@
-from flask import Flask, current_app, request
+from flask import Flask, Response, current_app, jsonify, request
 from twig_server.database.Project import Project
 
 from twig_server.database.connection import Neo4jConnection
 from twig_server.database.User import User
 from twig_server.database.Resource import Resource
 from neo4j import graph
+from twig_server.routes.helper import internal_only
+
 def explore():
-    pass
\ No newline at end of file
+    pass
+
+@internal_only
+def pool_status():
+    """Neo4j connection pool utilization, see Neo4jConnection.pool_status"""
+    return jsonify(current_app.config["driver"].pool_status()), 200
+
+@internal_only
+def metrics():
+    """Request and cypher statement metrics in the Prometheus text format"""
+    return Response(
+        current_app.config["metrics"].render(),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
+@internal_only
+def slow_queries():
+    """Recent slow statements, with PROFILE plans when sampled"""
+    query_log = current_app.config.get("query_log")
+    if query_log is None:
+        return "query log is disabled, set NEO4J_QUERY_LOG", 404
+    return jsonify(query_log.recent()), 200
+
+def job_status(job_id: str):
+    """`GET /jobs/<job_id>`, status and progress of a background job"""
+    job = current_app.config["jobs"].get(job_id)
+    if job is None:
+        return "no such job", 404
+    if job.owner != request.headers.get('X-User'):
+        return "not authorized", 401
+    return jsonify(job.to_dict()), 200
+
+def list_jobs():
+    """`GET /jobs?limit=50`, the user's most recent background jobs"""
+    owner = request.headers.get('X-User')
+    if owner is None:
+        return "not authorized", 401
+    limit = max(1, min(request.args.get('limit', 50, type=int), 200))
+    return jsonify([
+        job.to_dict() for job in current_app.config["jobs"].list(owner, limit)
+    ]), 200
+
+def cancel_job(job_id: str):
+    """`POST,DELETE /jobs/<job_id>/cancel`, stops a queued or running
+    cancellable job.
+    Returns 202, the job may still run until its next progress report.
+    """
+    runner = current_app.config["jobs"]
+    job = runner.get(job_id)
+    if job is None:
+        return "no such job", 404
+    if job.owner != request.headers.get('X-User'):
+        return "not authorized", 401
+    if job.finished_at is not None:
+        return "job already finished", 404
+    if not job.cancellable:
+        return "job cannot be cancelled", 404
+    job = runner.cancel(job_id)
+    if job is None:
+        return "job already finished", 404
+    if not job.cancel_requested:
+        return "job cannot be cancelled", 404
+    return jsonify(job.to_dict()), 202
@@ -1,30 +1,55 @@
-from flask import jsonify, current_app, request
+import shutil
+import tempfile
+
+from flask import Response, jsonify, current_app, request
 from twig_server.database.Project import Project
+from twig_server.database import batch, transfer
+from twig_server.database.unit_of_work import current_unit_of_work, read_only, unit_of_work_scope
+from twig_server.jobs import Job, JobLimitExceeded
 
 from twig_server.database.User import User
 from twig_server.database.Resource import Resource
 from twig_server.database.native import Node, Relationship
+from twig_server.routes.helper import helper_background, helper_get_authorized_project, helper_get_prereq_graph, helper_not_modified, helper_request_properties, helper_with_etag
 from neo4j import graph
 
 import twig_server.app as app
 
+EXPLORE_DEFAULT_LIMIT = 50
+EXPLORE_MAX_LIMIT = 200
+IMPORT_MAX_BATCH_SIZE = 10000
+IMPORT_SPOOL_SIZE = 1 << 20  # bytes of a background import kept in memory
+BATCH_MAX_OPERATIONS = 500
+
+@read_only
 def explore():
-    projects = Project.explore_projects(current_app.config['driver'].conn)
+    """
+    `GET /explore?limit=&after=`, pass the returned `next` as `after`
+    to get the following page. `next` is null on the last page.
+    """
+    try:
+        limit = int(request.args.get('limit', EXPLORE_DEFAULT_LIMIT))
+        after = request.args.get('after')
+        after = int(after) if after else None
+    except ValueError:
+        return "limit and after must be ints", 404
+    limit = max(1, min(limit, EXPLORE_MAX_LIMIT))
+    # one extra row tells whether there is a next page
+    projects = Project.explore_projects(
+        current_app.config['driver'], limit + 1, after)
     ret: list = []
-    owners = {}
-    for x in projects:
-        owner = Node.extract_properties(x.get(x._Record__keys[0]))['kratos_user_id']
-        if(owner in owners): continue
-        owner_user = User(current_app.config['driver'], kratos_user_id=owner)
-        owner_user.query_kratos_user_id()
-        owners[owner] = owner_user
-    for x in projects:
-        owner = Node.extract_properties(x.get(x._Record__keys[0]))['kratos_user_id']
+    for x in projects[:limit]:
         col = x.get(x._Record__keys[1])
         if(type(col) is graph.Node):
             # is a node
-            ret.append({'project':Node.extract_properties(col), 'owner':owners[owner].properties})
-    return jsonify({'projects':ret}), 200
+            ret.append({
+                'project': Node.extract_properties(col),
+                'owner': Node.extract_properties(x.get(x._Record__keys[0]))
+            })
+    next_cursor = None
+    if len(projects) > limit:
+        next_cursor = int(projects[limit - 1]['m'].id)
+    return jsonify({'projects': ret, 'next': next_cursor}), 200
 
 def new_project():
     kratos_user_id = request.headers.get('X-User')
@@ -42,78 +67,278 @@ def new_project():
     return jsonify({'project':project.properties, 'owner': user.properties}), 200
 
 
-def list_resources(project: Project):
-    resources = Resource.list_resources(
-        current_app.config["driver"].conn, project
-    )
-    ret: list = []
-    for x in resources:
-        col = x.get(x._Record__keys[2])
-        assert type(col) is graph.Node
-        ret.append(Node.extract_properties(col))
-    return ret
-
-
-def list_relationships(project: Project):
-    resources = Relationship.list_relationships(
-        current_app.config["driver"].conn, project
-    )
-    ret: list = []
-    for x in resources:
-        row = []
-        for i in range(len(x)):
-            col = x.get(x._Record__keys[i])
-            if type(col) is graph.Node:
-                row.append(Node.extract_properties(col)["uid"])
-            else:
-                row.append(Relationship.extract_properties(col))
-        ret.append(row)
-    return ret
+def list_project_graph(project: Project):
+    """
+    resources followed by `[a_uid, relationship, b_uid]` prereq rows,
+    and the tag uids of every resource, assembled in a single pass.
+    Loads `project`; returns `None` if it does not exist.
+    """
+    row = Resource.query_project_graph(current_app.config["driver"], project)
+    if row is None:
+        return None
+    buffer = current_app.config.get("position_buffer")
+    pending = buffer.positions(project.uid) if buffer is not None else {}
+    resources: list = []
+    relationships: list = []
+    resource_tags: dict = {}
+    for x in row['resources']:
+        col = x['resource']
+        if col is None:  # project without resources
+            continue
+        properties = Node.extract_properties(col)
+        if properties['uid'] in pending:
+            properties['pos_x'], properties['pos_y'] = pending[properties['uid']]
+        resources.append(properties)
+        resource_tags[properties['uid']] = x['tags']
+        for e in x['edges']:
+            relationships.append([
+                properties['uid'],
+                Relationship.extract_properties(e),
+                int(e.end_node.id),
+            ])
+    return resources + relationships, resource_tags
 
 
 def edit_project(project_id: str):
-
-    project = Project(current_app.config["driver"], uid=int(project_id))
-    res = project.query_uid()
-    if res is None:
+    project, authorized = helper_get_authorized_project(project_id)
+    if project is None:
         return "project not found", 404
-
-    kratos_user_id = request.headers.get('X-User')
-    owner = project.get_owner()
-    if(kratos_user_id != owner['kratos_user_id']):
+    if(not authorized):
         return "not authorized", 401
 
-    for key in request.args:
-        value = request.args.get(key)
-        project.set(key, value)
+    properties = helper_request_properties()
+    if properties is None:
+        return "body must be a JSON object", 404
+    if(Project._version_property in properties
+       or Project._changes_since_property in properties):
+        return "you cannot change the project version", 404
+    try:
+        project.patch(properties)
+    except ValueError as e:
+        return str(e), 404
+    project.record_changes([Project.change_entry(
+        'updated', 'project', project.uid, project.properties)])
     return jsonify(project.properties), 200
 
 
 def delete_project(project_id: str):
-    project = Project(current_app.config["driver"], uid=int(project_id))
-
-    kratos_user_id = request.headers.get('X-User')
-    owner = project.get_owner()
-    if(kratos_user_id != owner['kratos_user_id']):
+    project, authorized = helper_get_authorized_project(project_id)
+    if project is None:
+        return jsonify({"success": False}), 404
+    if(not authorized):
         return "not authorized", 401
 
-    res = project.query_uid()
-    if res:
-        project.delete()
-        return jsonify({"success": True}), 200
-    else:
-        return jsonify({"success": False}), 404
+    assert project.uid is not None
+    project_uid = int(project.uid)
+    conn = current_app.config["driver"]
+    batch_size = current_app.config.get("PROJECT_DELETE_BATCH_SIZE") or 1000
+    try:
+        # stopping half way would leave a hidden, half deleted project
+        job = current_app.config["jobs"].submit(Job(
+            'delete_project',
+            request.headers.get('X-User'),
+            lambda job: Project.delete_cascade(
+                conn, project_uid, batch_size, job.report),
+            cancellable=False,
+        ))
+    except JobLimitExceeded as e:
+        return str(e), 429
+    project.mark_deleted()
+    # gone for every other route already, the job deletes what it owned
+    return jsonify({"success": True, "job": job.to_dict()}), 202
 
 def update_positions(project_id: str):
-    p = Project(current_app.config['driver'], uid=project_id)
-    pr = p.query_uid()
-    kratos_user_id = request.headers.get('X-User')
-    owner = p.get_owner()
-    if(owner['kratos_user_id'] != kratos_user_id):
+    """
+    `POST /project/<id>/positions/update`, with `?background=true` as a
+    job for large updates: 202 with the job, `skipped` is its result
+    """
+    project, authorized = helper_get_authorized_project(project_id)
+    if project is None:
+        return "project not found", 404
+    if(not authorized):
+        return "not authorized", 401
+    positions = request.get_json(silent=True)
+    if not isinstance(positions, dict):
+        return "body must be a JSON object", 404
+    buffer = current_app.config.get("position_buffer")
+    if buffer is not None and not helper_background():
+        assert project.uid is not None
+        skipped = buffer.add(int(project.uid), positions)
+        return jsonify({'success': True, 'skipped': skipped, 'buffered': True}), 200
+    if not helper_background():
+        skipped = project.update_positions(positions)
+        return jsonify({'success': True, 'skipped': skipped}), 200
+
+    def run(job: Job) -> dict:
+        with unit_of_work_scope(project.conn):
+            return {'skipped': project.update_positions(positions)}
+    try:
+        job = current_app.config["jobs"].submit(Job(
+            'update_positions', request.headers.get('X-User'), run))
+    except JobLimitExceeded as e:
+        return str(e), 429
+    return jsonify({'success': True, 'job': job.to_dict()}), 202
+@read_only
+def project_changes(project_id: str):
+    """
+    `GET /project/<id>/changes?since=<version>`, everything that changed
+    after `version` (the project's `version` or ETag the client holds).
+    `reload` is true when the change log no longer reaches back that far.
+    """
+    try:
+        since = int(request.args.get('since', ''))
+    except (TypeError, ValueError):
+        return "since must be an int", 404
+    project = Project.lookup(current_app.config["driver"], int(project_id))
+    changes = project.list_changes(since)
+    if project.db_obj is None:
+        return "no such project", 404
+    version = project.properties.get(Project._version_property, 0)
+    if changes is None:
+        return jsonify({'reload': True, 'version': version}), 200
+    return helper_with_etag(jsonify({
+        'reload': False,
+        'version': version,
+        'changes': changes,
+    }), project), 200
+
+@read_only
+def prereq_order(project_id: str):
+    """
+    `GET /project/<id>/prereqs/order`, a learning order: every resource
+    after its prereqs. Resources on or after a cycle are in `cyclic`.
+    """
+    graph = helper_get_prereq_graph(project_id)
+    if graph is None:
+        return "no such project", 404
+    order, cyclic = graph.topological_order()
+    return jsonify({'version': graph.version, 'order': order, 'cyclic': cyclic}), 200
+
+@read_only
+def longest_prereq_chain(project_id: str):
+    """`GET /project/<id>/prereqs/longest_chain`, first prereq first"""
+    graph = helper_get_prereq_graph(project_id)
+    if graph is None:
+        return "no such project", 404
+    chain = graph.longest_chain()
+    return jsonify({'version': graph.version, 'chain': chain}), 200
+
+@read_only
+def export_project(project_id: str):
+    """
+    `GET /project/<id>/export`, the project graph as NDJSON, see
+    twig_server/database/transfer.py. Streamed as it is read.
+    """
+    project = Project.lookup(current_app.config["driver"], int(project_id))
+    if project.db_obj is None:
+        return "no such project", 404
+    lines = transfer.export_project(
+        current_app.config["driver"], int(project_id))
+    return Response(lines, mimetype="application/x-ndjson"), 200
+
+def import_project(project_id: str):
+    """
+    `POST /project/<id>/import?batch_size=`, adds the NDJSON body (an
+    export, possibly of another project) to the project. Returns the
+    counts and `ids`, the uid each imported uid got. All or nothing.
+    With `?background=true` it runs as a job and the summary is its result.
+    """
+    project, authorized = helper_get_authorized_project(project_id)
+    if project is None:
+        return "project not found", 404
+    if(not authorized):
         return "not authorized", 401
-    Resource.update_all_positions(
-            current_app.config['driver'], request.json, project_id=int(project_id))
-    return "ok", 200
+    try:
+        batch_size = int(request.args.get(
+            'batch_size', current_app.config.get("IMPORT_BATCH_SIZE") or 1000))
+    except ValueError:
+        return "batch_size must be an int", 404
+    batch_size = max(1, min(batch_size, IMPORT_MAX_BATCH_SIZE))
+    conn = current_app.config["driver"]
+    if helper_background():
+        # the request body is gone once the job runs
+        body = tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_SIZE)
+        shutil.copyfileobj(request.stream, body)
+        body.seek(0)
+
+        def run(job: Job) -> dict:
+            with body, unit_of_work_scope(conn):
+                importer = transfer.ProjectImport(
+                    conn, project, batch_size, job.report)
+                importer.read(body)
+                project.record_changes([], reload=True)
+                return import_summary(project, importer)
+        try:
+            job = current_app.config["jobs"].submit(Job(
+                'import_project', request.headers.get('X-User'), run))
+        except JobLimitExceeded as e:
+            body.close()
+            return str(e), 429
+        return jsonify({'job': job.to_dict()}), 202
+
+    importer = transfer.ProjectImport(conn, project, batch_size)
+    try:
+        importer.read(request.stream)
+    except transfer.ImportLineError as e:
+        # a 404 would otherwise commit the batches written so far
+        unit_of_work = current_unit_of_work()
+        assert unit_of_work is not None
+        unit_of_work.rollback()
+        return str(e), 404
+    # too many changes for the log, clients reload instead
+    project.record_changes([], reload=True)
+    return jsonify(import_summary(project, importer)), 200
+
+def import_summary(project: Project, importer: transfer.ProjectImport) -> dict:
+    return {
+        'counts': importer.counts,
+        'batches': importer.batches,
+        'ids': {
+            record_type: {str(ref): uid for ref, uid in ids.items()}
+            for record_type, ids in importer.ids.items()
+        },
+        'version': project.properties.get(Project._version_property),
+    }
+
+def batch_operations(project_id: str):
+    """
+    `POST /project/<id>/batch` with `{"operations": [...]}`, see
+    twig_server/database/batch.py. Runs them in order in one transaction,
+    all or nothing, and returns the result of each.
+    """
+    project, authorized = helper_get_authorized_project(project_id)
+    if project is None:
+        return "project not found", 404
+    if(not authorized):
+        return "not authorized", 401
+    body = request.get_json(silent=True)
+    operations = body.get('operations') if isinstance(body, dict) else None
+    if not isinstance(operations, list):
+        return "operations must be a list", 404
+    if len(operations) > BATCH_MAX_OPERATIONS:
+        return f"at most {BATCH_MAX_OPERATIONS} operations", 404
+    operation_batch = batch.ProjectBatch(
+        current_app.config["driver"], project, current_app.config["prereq_graphs"])
+    try:
+        operation_batch.run(operations)
+    except batch.BatchError as e:
+        # a 4xx would otherwise commit the operations before it
+        unit_of_work = current_unit_of_work()
+        assert unit_of_work is not None
+        unit_of_work.rollback()
+        return str(e), e.status
+    version = project.properties.get(Project._version_property)
+    if operation_batch.changes:
+        version = project.record_changes(operation_batch.changes)
+    return jsonify({
+        'results': operation_batch.results,
+        'refs': {
+            ref: uid for ref, (_, uid) in operation_batch.refs.items()
+        },
+        'version': version,
+    }), 200
+
+@read_only
 def query_project(project_id: str):
     list_items: bool = False
     req_list_items = request.args.get("list_items")
@@ -123,23 +348,34 @@ def query_project(project_id: str):
         or req_list_items != "1"
     ):
         list_items = True
-    project = Project(current_app.config["driver"], uid=int(project_id))
-    res = project.query_uid()
+    project = Project.lookup(current_app.config["driver"], int(project_id))
+    buffer = current_app.config.get("position_buffer")
+    # buffered positions are not part of the version, and so the ETag, yet
+    buffered = buffer is not None and bool(buffer.positions(project.uid))
+    if request.if_none_match and not buffered:
+        # only worth a round trip when the client has a version cached
+        if project.db_obj is None:
+            return "no such project", 404
+        not_modified = helper_not_modified(project)
+        if not_modified is not None:
+            return not_modified
+    ans = []
+    resource_tags = {}
+    if list_items:
+        graph = list_project_graph(project)
+        if graph is not None:
+            ans, resource_tags = graph
+    res = project.db_obj
     if res:
-        ans = []
-        if list_items:
-            ans = list_resources(project=project)
-            ans2 = list_relationships(project=project)
-            if ans2:
-                ans.extend(ans2)
-        return (
-            jsonify(
-                {
-                    "project": project.properties,
-                    "items": ans,
-                    "user": str(request.headers),
-                }
-            ),
-            200,
+        response = jsonify(
+            {
+                "project": project.properties,
+                "items": ans,
+                "resource_tags": resource_tags,
+                "user": str(request.headers),
+            }
         )
+        if not buffered:
+            response = helper_with_etag(response, project)
+        return response, 200
     return "no such project", 404
@@ -1,31 +1,43 @@
-import resource
 from flask import jsonify, current_app, request
 from twig_server.database.Project import Project
-from twig_server.database.Tag import Tag
 
-from twig_server.database.connection import Neo4jConnection
-from twig_server.database.User import User
 from twig_server.database.Resource import Resource
 from neo4j import graph
 
-from twig_server.database.native import Node, Relationship
-import twig_server.app as app
-from twig_server.routes.helper import helper_get_project, helper_get_resource, helper_get_tag, tag_belongs_to_project, authorize_user
+from twig_server.database.unit_of_work import read_only
+from twig_server.routes.helper import helper_get_authorized_project, helper_get_prereq_graph, helper_get_project_to_write, helper_request_properties, helper_write_refused
 
 def new_node(project):
     resource = Resource(current_app.config['driver'])
     resource.create(project)
+    project.record_changes([Project.change_entry(
+        'created', 'resource', resource.uid, resource.properties)])
     return jsonify(resource.properties)
 
 def new_relationship(project, a_id: str, b_id: str):
-    resource = Relationship(current_app.config['driver'], a_id=a_id, b_id=b_id)
-    resource.create('prereq')
-    return jsonify(resource.properties)
+    # locked first, so a prereq added concurrently is either in the graph
+    # or waits for this one. Checked before the write, so the graph is not
+    # cached with a prereq this request could still roll back.
+    project.lock()
+    graph = current_app.config['prereq_graphs'].get(project)
+    cycle = graph.check_edge(int(a_id), int(b_id)) if graph else None
+    if cycle is not None:
+        return f"would close a prereq cycle: {' -> '.join(map(str, cycle + [cycle[0]]))}", 404
+    resource = Resource.create_prereq(
+        current_app.config['driver'], project, request.headers.get('X-User'),
+        int(a_id), int(b_id))
+    if resource is None:
+        return "resource not found", 404
+    project.record_changes([Project.change_entry(
+        'created', 'relationship', resource.properties.get('uid'),
+        {'a': int(a_id), 'b': int(b_id), 'properties': resource.properties})])
+    return jsonify(resource.properties), 200
 
 def new_item(project_id: str):
-    project = helper_get_project(project_id)
-
-    if(not authorize_user(project)):
+    project, authorized = helper_get_authorized_project(project_id)
+    if project is None:
+        return "project not found", 404
+    if(not authorized):
         return "not authorized", 401
 
     if(request.args.get('item') == 'node'):
@@ -35,51 +47,80 @@ def new_item(project_id: str):
         b_id = request.args.get('b_id')
         assert a_id is not None
         assert b_id is not None
-        return new_relationship(project, a_id, b_id), 200
+        return new_relationship(project, a_id, b_id)
     else:
         return "item must be set", 404
     
 def edit_resource(project_id: str, resource_id: str):
-    project = helper_get_project(project_id)
-    resource = helper_get_resource(resource_id)
-    res = resource.query_uid()
-    if(not authorize_user(project)):
-        return "not authorized", 401
-
+    project = helper_get_project_to_write(project_id)
+    properties = helper_request_properties()
+    if properties is None:
+        return "body must be a JSON object", 404
+    resource = Resource.lookup(current_app.config["driver"], int(resource_id))
+    try:
+        res = resource.patch_matched(
+            resource.in_project(project, request.headers.get('X-User')),
+            properties)
+    except ValueError as e:
+        return str(e), 404
     if res is None:
-        return "resource not found", 404
-    for key in request.args:
-        value = request.args.get(key)
-        resource.set(key, value)
+        return helper_write_refused(project, "resource not found")
+    project.record_changes([Project.change_entry(
+        'updated', 'resource', resource.uid, resource.properties)])
     return jsonify(resource.properties), 200
 
 def delete_resource(project_id: str, resource_id: str):
-    project = helper_get_project(project_id)
-    resource = helper_get_resource(resource_id)
-    res = resource.query_uid()
-    if(not authorize_user(project)):
-        return "not authorized", 401
-
-    if(res):
-        resource.delete()
+    project = helper_get_project_to_write(project_id)
+    resource = Resource.lookup(current_app.config["driver"], int(resource_id))
+    if(resource.delete_matched(
+            resource.in_project(project, request.headers.get('X-User')))):
+        project.record_changes([Project.change_entry(
+            'deleted', 'resource', int(resource_id))])
         return jsonify({'success': True}), 200
     else:
-        return jsonify({'success': False}), 404
+        return helper_write_refused(project, jsonify({'success': False}))
 
 def delete_relationship(project_id: str, relationship_id: str):
-    project = helper_get_project(project_id)
-    if(not authorize_user(project)):
-        return "not authorized", 401
-
+    project = helper_get_project_to_write(project_id)
     relationship_uid= int(relationship_id)
-    rls = Relationship(current_app.config["driver"], uid=relationship_uid)
-    res = rls.query_uid()
-    if res is not None:
-        rls.delete()
+    if(Resource.delete_prereq(
+            current_app.config["driver"], project,
+            request.headers.get('X-User'), relationship_uid)):
+        project.record_changes([Project.change_entry(
+            'deleted', 'relationship', relationship_uid)])
         return jsonify({'success': True}), 200
     else:
-        return jsonify({'success': False}), 404
+        return helper_write_refused(project, jsonify({'success': False}))
 
 def edit_relationship(project_id: str, relationship_id: str):
     # not of great importance now
-    return 'not implemented yet', 404
\ No newline at end of file
+    return 'not implemented yet', 404
+
+@read_only
+def resource_prereqs(project_id: str, resource_id: str):
+    """
+    `GET /project/<id>/resource/<id>/prereqs`, every resource to learn
+    before this one, in learning order
+    """
+    return reachable_resources(project_id, resource_id, 'prereqs')
+
+@read_only
+def resource_unlocks(project_id: str, resource_id: str):
+    """
+    `GET /project/<id>/resource/<id>/unlocks`, every resource this one is
+    a direct or indirect prereq of, in learning order
+    """
+    return reachable_resources(project_id, resource_id, 'unlocks')
+
+def reachable_resources(project_id: str, resource_id: str, direction: str):
+    graph = helper_get_prereq_graph(project_id)
+    if graph is None:
+        return "no such project", 404
+    try:
+        resource_uid = int(resource_id)
+        uids = getattr(graph, direction)(resource_uid)
+    except (KeyError, ValueError):
+        return "resource not found", 404
+    return jsonify({
+        'version': graph.version, 'resource': resource_uid, direction: uids,
+    }), 200
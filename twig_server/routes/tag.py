@@ -1,93 +1,75 @@
-import resource
 from flask import jsonify, current_app, request
 from twig_server.database.Project import Project
 from twig_server.database.Tag import Tag
+from twig_server.database.unit_of_work import read_only
 
-from twig_server.database.connection import Neo4jConnection
-from twig_server.database.User import User
 from twig_server.database.Resource import Resource
 from neo4j import graph
 
 from twig_server.database.native import Node, Relationship
-import twig_server.app as app
-from twig_server.routes.helper import helper_get_project, helper_get_resource, helper_get_tag, authorize_user, tag_belongs_to_project
+from twig_server.routes.helper import helper_get_authorized_project, helper_get_project, helper_get_project_to_write, helper_get_resource, helper_get_tag, helper_not_modified, helper_with_etag, helper_write_refused, tag_belongs_to_project
 def add_tag(project_id: str, resource_id: str):
-    project = helper_get_project(project_id)
-
+    project = helper_get_project_to_write(project_id)
     tag_id = request.args.get("tag_uid")
     try:
         assert tag_id is not None
         tag_uid = int(tag_id)
     except:
         return "tag_uid is not an int", 404
-    tag = Tag(current_app.config["driver"], uid = tag_uid)
-    tag.query_uid()
-    assert tag.db_obj is not None
-
-    if(not authorize_user(project)):
-        return "not authorized", 401
-
-    if(not tag_belongs_to_project(tag, project)):
-        return "resource not in project", 401
-    
+    tag = Tag.lookup(current_app.config["driver"], tag_uid)
     resource_uid = int(resource_id)
 
     rls = Relationship(current_app.config['driver'], a_id=resource_uid, b_id=tag_uid)
     rls.query_endpoints()
     if('uid' in rls.properties):
-        return "tag already attached to node", 404
-    rls.create(Tag._label_resource_relationship)
+        return helper_write_refused(project, "tag already attached to node")
+    resource = Resource.lookup(current_app.config["driver"], resource_uid)
+    link = resource.join_tag(tag, project, request.headers.get('X-User'))
+    if link is None:
+        return helper_write_refused(project, "resource or tag not in project")
+    project.record_changes([Project.change_entry(
+        'created', 'tag_link', link.properties.get('uid'),
+        {'resource': resource_uid, 'tag': tag_uid})])
     return jsonify(tag.properties)
-    
-def update_color(project_id: str, tag_id: str):
-    project = helper_get_project(project_id)
-    tag = helper_get_tag(tag_id)
-    if(not authorize_user(project)):
-        return "not authorized", 401
-    if(not tag_belongs_to_project(tag, project)):
-        return "tag does not belong to project", 401
-    new_color = request.args.get("color")
-    if(new_color is None):
-        return "new color cannot be None", 404
-    tag.set('color', new_color)
-    tag.sync_properties()
+
+def update_tag(project_id: str, tag_id: str, key: str, value):
+    """Sets property `key` of a tag of the project"""
+    project = helper_get_project_to_write(project_id)
+    if(value is None):
+        return f"new {key} cannot be None", 404
+    tag = Tag.lookup(current_app.config["driver"], int(tag_id))
+    res = tag.patch_matched(
+        tag.in_project(project, request.headers.get('X-User')), {key: value})
+    if res is None:
+        return helper_write_refused(project, "tag not found in project")
+    project.record_changes([Project.change_entry(
+        'updated', 'tag', tag.uid, tag.properties)])
     return jsonify(tag.properties)
 
+def update_color(project_id: str, tag_id: str):
+    return update_tag(project_id, tag_id, 'color', request.args.get("color"))
+
 
 def update_priority(project_id: str, tag_id: str):
-    project = helper_get_project(project_id)
-    tag = helper_get_tag(tag_id)
-    if(not authorize_user(project)):
-        return "not authorized", 401
-    if(not tag_belongs_to_project(tag, project)):
-        return "tag does not belong to project", 401
     new_priority = request.args.get("priority")
-    if(new_priority is None):
-        return "new priority cannot be None", 404
-    tag.set('priority', int(new_priority))
-    tag.sync_properties()
-    return jsonify(tag.properties)
+    try:
+        priority = None if new_priority is None else int(new_priority)
+    except ValueError:
+        return "priority is not an int", 404
+    return update_tag(project_id, tag_id, 'priority', priority)
 def update_name(project_id: str, tag_id: str):
-    project = helper_get_project(project_id)
-    tag = helper_get_tag(tag_id)
-    if(not authorize_user(project)):
-        return "not authorized", 401
-    if(not tag_belongs_to_project(tag, project)):
-        return "tag does not belong to project", 401
-    new_name = request.args.get("name")
-    if(new_name is None):
-        return "new name cannot be None", 404
-    tag.set('name', new_name)
-    tag.sync_properties()
-    return jsonify(tag.properties)
+    return update_tag(project_id, tag_id, 'name', request.args.get("name"))
 
 
+@read_only
 def get_tagged_resources(project_id: str, tag_id: str):
     project = helper_get_project(project_id)
+    if project is None:
+        return "project not found", 404
     tag = helper_get_tag(tag_id)
     if(not tag_belongs_to_project(tag, project)):
         return "tag does not belong to project", 401
-    resources = Resource.get_tagged_resources(current_app.config["driver"].conn, tag)
+    resources = Resource.get_tagged_resources(current_app.config["driver"], tag)
     ret = []
     for x in resources:
         col = x.get(x._Record__keys[0])
@@ -96,65 +78,90 @@ def get_tagged_resources(project_id: str, tag_id: str):
     return jsonify(ret)
 
 def create_tag(project_id: str):
-    project = helper_get_project(project_id)
-    if(not authorize_user(project)):
+    project, authorized = helper_get_authorized_project(project_id)
+    if project is None:
+        return "project not found", 404
+    if(not authorized):
         return "not authorized", 401
 
     tag_name = request.args.get("name")
     tag_color = request.args.get("color")
     if(tag_color is None):
         tag_color = "pink"
-    tag = Tag(current_app.config["driver"], name=tag_name)
+    tag = Tag(
+        current_app.config["driver"],
+        name=tag_name,
+        color=tag_color,
+        priority=0,
+    )
     tag.create(project)
-    tag.set("color", tag_color)
-    tag.set("priority", 0)
+    project.record_changes([Project.change_entry(
+        'created', 'tag', tag.uid, tag.properties)])
     return jsonify(tag.properties)
 
+@read_only
 def list_tags(project_id: str, resource_id: str):
+    project = helper_get_project(project_id)
+    if project is None:
+        return "project not found", 404
+    not_modified = helper_not_modified(project)
+    if not_modified is not None:
+        return not_modified
     resource = helper_get_resource(resource_id)
-    tags = Resource.list_resource_tags(current_app.config["driver"].conn, resource)
+    tags = Resource.list_resource_tags(current_app.config["driver"], resource)
     ret = []
     for x in tags:
         col = x.get(x._Record__keys[2])
         assert type(col) is graph.Node
         ret.append(Node.extract_properties(col))    
-    return jsonify(ret)
+    return helper_with_etag(jsonify(ret), project)
 
 def dissociate_tag(project_id: str, resource_id: str):
+    project = helper_get_project_to_write(project_id)
     tag_id = request.args.get("tag_uid")
-    resource = helper_get_resource(resource_id)
     try:
         assert tag_id is not None
         tag_uid = int(tag_id)
     except:
         return "tag_uid is not an int", 404
-    tag = Tag(current_app.config["driver"], uid= tag_uid)
-    rls_properties = resource.find_rls_with(tag)
-    rls = Relationship(current_app.config["driver"], uid = rls_properties['uid'])
-    rls.query_uid()
-    assert rls.db_obj is not None
-    rls.delete()
+    resource = Resource.lookup(current_app.config["driver"], int(resource_id))
+    tag = Tag.lookup(current_app.config["driver"], tag_uid)
+    link_uid = resource.unjoin_tag(
+        tag, project, request.headers.get('X-User'))
+    if link_uid is None:
+        return helper_write_refused(
+            project, "tag not attached to resource in project")
+    project.record_changes([Project.change_entry(
+        'deleted', 'tag_link', link_uid,
+        {'resource': int(resource_id), 'tag': tag_uid})])
     return "deleted", 200
 
+@read_only
 def list_all_tags(project_id: str):
     project = helper_get_project(project_id)
-    tags = Tag.list_project_tags(current_app.config["driver"].conn, project)
+    if project is None:
+        return "project not found", 404
+    not_modified = helper_not_modified(project)
+    if not_modified is not None:
+        return not_modified
+    tags = Tag.list_project_tags(current_app.config["driver"], project)
     ret = []
     for x in tags:
         col = x.get(x._Record__keys[2])
         assert type(col) is graph.Node
         ret.append(Node.extract_properties(col))    
-    return jsonify(ret)
+    return helper_with_etag(jsonify(ret), project)
 
 def delete_tag(project_id: str):
-    project = helper_get_project(project_id)
-    if(not authorize_user(project)):
-        return "not authorized", 401
-    tag_id = request.args.get('uid')
-    tag = Tag(current_app.config["driver"], uid=tag_id)
-    tag_db_obj = tag.query_uid()
-    if(tag_db_obj):
-        tag.delete()
+    project = helper_get_project_to_write(project_id)
+    try:
+        tag_uid = int(request.args.get('uid', ''))
+    except (TypeError, ValueError):
+        return "uid is not an int", 404
+    tag = Tag.lookup(current_app.config["driver"], tag_uid)
+    if(tag.delete_matched(tag.in_project(project, request.headers.get('X-User')))):
+        project.record_changes([Project.change_entry(
+            'deleted', 'tag', tag_uid)])
         return "ok", 200
     else:
-        return "tag not found", 404
\ No newline at end of file
+        return helper_write_refused(project, "tag not found")
@@ -5,10 +5,11 @@ from twig_server.database.User import User
 from neo4j import graph
 
 from twig_server.database.native import Node
+from twig_server.routes.helper import helper_request_properties
 import twig_server.app as app
 
 def list_projects(user: User):
-    projects = Project.list_projects(current_app.config['driver'].conn, user)
+    projects = Project.list_projects(current_app.config['driver'], user)
     ret: list = []
     for x in projects:
         col = x.get(x._Record__keys[2])
@@ -62,11 +63,15 @@ def update_user(kratos_user_id: str):
     )
     res = user.query_kratos_user_id()
     if res:
-        for key in request.args:
-            if(key == 'kratos_user_id'):
-                return "you cannot change your kratos_user_id", 401
-            value = request.args.get(key)
-            user.set(key, value)
+        properties = helper_request_properties()
+        if properties is None:
+            return "body must be a JSON object", 404
+        if('kratos_user_id' in properties):
+            return "you cannot change your kratos_user_id", 401
+        try:
+            user.patch(properties)
+        except ValueError as e:
+            return str(e), 404
         return concat_user_info_with_project_list(user)
     else:
         return "no such user", 404
\ No newline at end of file
@@ -0,0 +1,38 @@
+# one-off cleanup of resources, tags and change log entries left behind by
+# project deletes that did not cascade, and of interrupted cascades
+#
+#   python -m twig_server.sweep --batch-size 1000
+#
+# Uses the same NEO4J_* environment as the server.
+
+import argparse
+import json
+from typing import List, Optional
+
+from twig_server.app import create_app
+from twig_server.database.Project import Project
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Delete nodes that belong to no project"
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=1000,
+        help="nodes deleted per transaction",
+    )
+    args = parser.parse_args(argv)
+    app = create_app()
+    counts = Project.sweep_orphans(
+        app.config["driver"],
+        max(1, args.batch_size),
+        lambda **counts: print(json.dumps(counts), flush=True),
+    )
+    print(json.dumps(counts))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())